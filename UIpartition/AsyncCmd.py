@@ -0,0 +1,187 @@
+#! /usr/bin/python
+#
+#    uipartition - A disk partitions/RAID/LVM setup tool
+#    Copyright (C) 2010-2015  MontaVista Software, LLC
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor,
+#      Boston, MA  02110-1301  USA
+
+
+#
+# Run external commands from an asyncio event loop in its own thread.
+#
+# Commands can be run from coroutines on the loop (run() and
+# run_all()), or from normal code with call(), which blocks like
+# subprocess does, submit(), which returns a concurrent.futures.Future,
+# and call_all(), which runs a batch of commands at once and waits for
+# all of them.
+#
+# The number of commands running at once is limited, both in total and
+# for each device (or anything else named by the device key), so
+# commands that shouldn't run on the same disk at the same time don't.
+# Commands can have a timeout, and a command that times out or is
+# cancelled is killed.
+#
+
+import asyncio
+import threading
+import subprocess
+
+class CmdErr(Exception):
+    def __init__(self, cmd, returncode, out, errout):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.out = out
+        self.errout = errout
+        return
+
+    def __str__(self):
+        return ("Error %d:%s\n%s\n%s"
+                % (self.returncode, self.cmd, self.out, self.errout))
+
+    pass
+
+class CmdTimeout(CmdErr):
+    def __init__(self, cmd, timeout, out="", errout=""):
+        CmdErr.__init__(self, cmd, -1, out, errout)
+        self.timeout = timeout
+        return
+
+    def __str__(self):
+        return ("Timed out after %gs:%s\n%s\n%s"
+                % (self.timeout, self.cmd, self.out, self.errout))
+
+    pass
+
+class Executor:
+    # max_cmds is the number of commands that can run at once,
+    # per_device the number that can run at once with the same device.
+    def __init__(self, max_cmds=16, per_device=1):
+        self.max_cmds = max_cmds
+        self.per_device = per_device
+        self.lock = threading.Lock()
+        self.loop = None
+        self.thread = None
+        return
+
+    # The loop is started the first time it's needed.
+    def _getLoop(self):
+        with self.lock:
+            if (self.loop is None):
+                self.loop = asyncio.new_event_loop()
+                self.sem = asyncio.Semaphore(self.max_cmds)
+                self.devsems = { }
+                self.thread = threading.Thread(target=self.loop.run_forever,
+                                               name="AsyncCmd", daemon=True)
+                self.thread.start()
+                pass
+            return self.loop
+        return None
+
+    async def _run(self, cmd, timeout):
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        try:
+            (out, err) = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise CmdTimeout(str(cmd), timeout)
+        except asyncio.CancelledError:
+            proc.kill()
+            await proc.wait()
+            raise
+        out = out.decode("utf8")
+        err = err.decode("utf8")
+        if (proc.returncode != 0):
+            raise CmdErr(str(cmd), proc.returncode, out, err)
+        return out
+
+    # Run a command on the loop, returning its output.  Raises CmdErr if
+    # it fails, CmdTimeout if it takes more than timeout seconds.
+    async def run(self, cmd, device=None, timeout=None):
+        async with self.sem:
+            if (device is None):
+                return await self._run(cmd, timeout)
+            sem = self.devsems.get(device)
+            if (sem is None):
+                sem = asyncio.Semaphore(self.per_device)
+                self.devsems[device] = sem
+                pass
+            async with sem:
+                return await self._run(cmd, timeout)
+            pass
+        return None
+
+    # Run a batch of commands on the loop.  cmds is a list of (cmd,
+    # device) and the results are returned in the same order, with
+    # the exception in place of the output for commands that failed.
+    async def run_all(self, cmds, timeout=None):
+        return await asyncio.gather(*[ self.run(cmd, device, timeout)
+                                       for (cmd, device) in cmds ],
+                                    return_exceptions=True)
+
+    # Start a command from outside the loop.  The returned future's
+    # cancel() kills the command.
+    def submit(self, cmd, device=None, timeout=None):
+        return asyncio.run_coroutine_threadsafe(self.run(cmd, device,
+                                                         timeout),
+                                                self._getLoop())
+
+    # Run a command from outside the loop and wait for it.
+    def call(self, cmd, device=None, timeout=None):
+        return self.submit(cmd, device, timeout).result()
+
+    # Run a batch of commands from outside the loop and wait for them,
+    # see run_all().
+    def call_all(self, cmds, timeout=None):
+        f = asyncio.run_coroutine_threadsafe(self.run_all(cmds, timeout),
+                                             self._getLoop())
+        return f.result()
+
+    pass
+
+# Compare running commands one at a time and as a batch:
+#   python -m UIpartition.AsyncCmd [-n count] command args...
+if __name__== '__main__':
+    import sys
+    import time
+
+    count = 20
+    args = sys.argv[1:]
+    if (len(args) >= 2 and args[0] == "-n"):
+        count = int(args[1])
+        args = args[2:]
+        pass
+    if (not args):
+        args = [ "sleep", "0.1" ]
+        pass
+
+    ex = Executor()
+    start = time.time()
+    for i in range(0, count):
+        ex.call(args)
+        pass
+    t1 = time.time() - start
+    start = time.time()
+    for r in ex.call_all([ (args, None) ] * count):
+        if (isinstance(r, Exception)):
+            print(str(r))
+            pass
+        pass
+    t2 = time.time() - start
+    print("%d commands: one at a time %.3fs, batch %.3fs" % (count, t1, t2))
+    pass
@@ -0,0 +1,646 @@
+#! /usr/bin/python
+#
+#    uipartition - A disk partitions/RAID/LVM setup tool
+#    Copyright (C) 2010-2015  MontaVista Software, LLC
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor,
+#      Boston, MA  02110-1301  USA
+
+#
+# Time the partitioner on a made up machine, to see how startup,
+# re-reading, moving around the screen, changing units, and working out
+# what to do at quit scale with the number of devices.
+#
+# FakeSystem is a machine with ndisks GPT disks of nparts partitions
+# each.  The first partitions of each pair of disks are in a RAID1, the
+# second partitions are LVM PVs spread over nvgs volume groups with
+# nlvs logical volumes each, and the rest hold filesystems.  It answers
+# everything the partitioner asks through System: sysfs, the partition
+# tables, blkid, and lvm.  The screen is a window that draws nothing.
+# The results are printed as JSON, with the time each step took and
+# how many commands, sysfs reads, and drawing calls it did, so they can
+# be compared from run to run:
+#
+#   python -m UIpartition.Benchmark [ndisks [nparts [nvgs [nlvs]]]]
+#
+# or on a machine that was recorded (see Capture):
+#
+#   python -m UIpartition.Benchmark --replay capture-file
+#
+
+import os
+import sys
+import json
+import time
+import errno
+import struct
+import uuid
+import zlib
+import tempfile
+import threading
+
+from . import System
+from . import SysBlock
+from . import Geometry
+from . import AsyncCmd
+from . import LVMReport
+from . import Partitioner
+from . import Capture
+
+# Where the devices really are in sysfs, /sys/class/block has links to
+# these.
+_disk_dir = "/sys/devices/pci0000:00/0000:00:10.0/block"
+_virtual_dir = "/sys/devices/virtual/block"
+
+_type_linux = "0FC63DAF-8483-4772-8E79-3D69D8477DE4"
+_type_raid = "A19D880F-05FC-4D3B-A006-743F0F84911E"
+_type_lvm = "E6D6D379-F507-44C2-A23C-238F2A3DF928"
+
+# 1TiB disks
+_disk_sects = 2 * 1024 * 1024 * 1024
+
+_align = 2048
+
+# sda, sdb, ... sdz, sdaa, ...
+def _disk_name(i):
+    s = ""
+    i += 1
+    while (i > 0):
+        (i, r) = divmod(i - 1, 26)
+        s = chr(ord("a") + r) + s
+        pass
+    return "sd" + s
+
+# A UUID that is the same from run to run.
+def _uuid(kind, n):
+    return str(uuid.UUID(int=(kind << 64) | n)).upper()
+
+# The front of a GPT disk: protective MBR, header, and entries.
+def _gpt_image(numsects, parts, diskuuid):
+    nentries = max(128, len(parts))
+    ents = bytearray(nentries * 128)
+    for (i, (start, nsects, ptype, puuid)) in enumerate(parts):
+        struct.pack_into("<16s16sQQQ", ents, i * 128,
+                         uuid.UUID(ptype).bytes_le, uuid.UUID(puuid).bytes_le,
+                         start, start + nsects - 1, 0)
+        name = ("part%d" % (i + 1)).encode("utf-16-le")
+        ents[i * 128 + 56:i * 128 + 56 + len(name)] = name
+        pass
+    entsects = len(ents) // 512
+    hdr = bytearray(512)
+    struct.pack_into("<8sIIIIQQQQ16sQIII", hdr, 0, b"EFI PART", 0x10000,
+                     92, 0, 0, 1, numsects - 1, 2 + entsects,
+                     numsects - 2 - entsects, uuid.UUID(diskuuid).bytes_le,
+                     2, nentries, 128, zlib.crc32(ents) & 0xffffffff)
+    struct.pack_into("<I", hdr, 16, zlib.crc32(hdr[0:92]) & 0xffffffff)
+    mbr = bytearray(512)
+    struct.pack_into("<B3sB3sII", mbr, 446, 0, b"\0\x02\0", 0xee,
+                     b"\xff\xff\xff", 1, min(numsects - 1, 0xffffffff))
+    mbr[510:512] = b"\x55\xaa"
+    return bytes(mbr) + bytes(hdr) + bytes(ents)
+
+# A block device of the FakeSystem.  Only the front of it holds
+# anything, the rest reads as zeros.
+class _Device:
+    def __init__(self, image, nbytes):
+        self.image = image
+        self.nbytes = nbytes
+        return
+
+    def pread(self, n, offset):
+        if (offset >= self.nbytes):
+            return b""
+        n = min(n, self.nbytes - offset)
+        b = self.image[offset:offset + n]
+        return b + bytes(n - len(b))
+
+    def size(self):
+        return self.nbytes
+
+    def ioctl_int(self, req, fmt="I"):
+        vals = { Geometry.BLKGETSIZE64: self.nbytes,
+                 Geometry.BLKSSZGET: 512,
+                 Geometry.BLKPBSZGET: 4096,
+                 Geometry.BLKIOMIN: 4096,
+                 Geometry.BLKIOOPT: 0,
+                 Geometry.BLKALIGNOFF: 0 }
+        if (req not in vals):
+            raise OSError(errno.ENOTTY, os.strerror(errno.ENOTTY))
+        return vals[req]
+
+    def close(self):
+        return
+
+    pass
+
+class FakeSystem(System.System):
+    real = False
+
+    def __init__(self, ndisks, nparts, nvgs, nlvs):
+        # Nothing is really run, so there is no executor or lvm shell.
+        self.lvm_shell = None
+
+        self.lock = threading.Lock()
+        self.counts = { }
+
+        # sysfs, by the real path of each file and directory
+        self.attrs = { }
+        self.dirs = { }
+        self.links = { }
+
+        # Block device name to its real directory in sysfs
+        self.sysdevs = { }
+
+        # /dev names to (the /dev name it links to, device number)
+        self.devnodes = { }
+
+        # The data and size of each device, by /dev name
+        self.images = { }
+        self.sizes = { }
+
+        # (devname, uuid, type) for blkid
+        self.blkid = [ ]
+
+        # Other files, by name.  /etc/fstab mounts all the filesystems.
+        self.files = { }
+        self.fstab = [ ]
+
+        # name: [ size, [ pvs ], [ (lv name, size) ] ]
+        self.vgs = { }
+
+        self.ndisks = ndisks
+        self.nparts = nparts
+        self.nraids = 0
+        self.nlvs = 0
+        self._nextpart = 0
+        self._nextdm = 0
+
+        self._set("/proc/sys/kernel/random/boot_id", _uuid(0, 0).lower())
+        self._mkdir(SysBlock.sysblock)
+        pvs = [ ]
+        for i in range(0, ndisks):
+            pvs += self._addDisk(i)
+            pass
+        for i in range(0, ndisks // 2):
+            self._addRAID(i, _disk_name(2 * i) + "1",
+                          _disk_name(2 * i + 1) + "1")
+            pass
+        self._addVGs(pvs, nvgs, nlvs)
+        self.files["/etc/fstab"] = "".join(self.fstab)
+        return
+
+    def _count(self, what):
+        with self.lock:
+            self.counts[what] = self.counts.get(what, 0) + 1
+            pass
+        return
+
+    # Return the counts since the last call.
+    def takeCounts(self):
+        with self.lock:
+            counts = self.counts
+            self.counts = { }
+            pass
+        return counts
+
+    def _mkdir(self, path):
+        if (path in self.dirs):
+            return
+        self.dirs[path] = set()
+        parent = os.path.dirname(path)
+        if (parent != path):
+            self._mkdir(parent)
+            self.dirs[parent].add(os.path.basename(path))
+            pass
+        return
+
+    def _set(self, path, value):
+        self._mkdir(os.path.dirname(path))
+        self.dirs[os.path.dirname(path)].add(os.path.basename(path))
+        self.attrs[path] = str(value)
+        return
+
+    def _addBlockDev(self, name, path, devnum, numsects):
+        self.sysdevs[name] = path
+        self.dirs[SysBlock.sysblock].add(name)
+        self._set(path + "/size", numsects)
+        self._set(path + "/dev", "%d:%d" % devnum)
+        self._set(path + "/stat", " ".join(["0"] * 17))
+        self._set(path + "/alignment_offset", 0)
+        self._mkdir(path + "/holders")
+        devname = "/dev/" + name
+        self.devnodes[devname] = (devname, devnum)
+        self.sizes[devname] = numsects * 512
+        return
+
+    def _addDisk(self, i):
+        name = _disk_name(i)
+        path = os.path.join(_disk_dir, name)
+        # Not how the kernel numbers them, but they are unique.
+        self._addBlockDev(name, path, (8, i), _disk_sects)
+        self._set(path + "/removable", 0)
+        self._set(path + "/device/wwid", "naa.5000c500%08x" % i)
+        self._set(path + "/queue/logical_block_size", 512)
+        self._set(path + "/queue/physical_block_size", 4096)
+        self._set(path + "/queue/minimum_io_size", 4096)
+        self._set(path + "/queue/optimal_io_size", 0)
+
+        partsects = (((_disk_sects - _align - 34) // max(self.nparts, 1))
+                     // _align * _align)
+        parts = [ ]
+        pvs = [ ]
+        for n in range(1, self.nparts + 1):
+            pname = name + str(n)
+            start = _align + (n - 1) * partsects
+            puuid = _uuid(2, self._nextpart)
+            if (n == 1 and (i ^ 1) < self.ndisks):
+                ptype = _type_raid
+                self.blkid.append(("/dev/" + pname, puuid,
+                                   "linux_raid_member"))
+            elif (n == 2):
+                ptype = _type_lvm
+                self.blkid.append(("/dev/" + pname, puuid, "LVM2_member"))
+                pvs.append(("/dev/" + pname, partsects))
+            else:
+                ptype = _type_linux
+                self.blkid.append(("/dev/" + pname, puuid, "ext4"))
+                self.fstab.append("/dev/%s /disk/%s ext4 defaults 0 2\n"
+                                  % (pname, pname))
+                pass
+            parts.append((start, partsects, ptype, puuid))
+
+            ppath = os.path.join(path, pname)
+            self._addBlockDev(pname, ppath, (259, self._nextpart), partsects)
+            self._set(ppath + "/partition", n)
+            self._set(ppath + "/start", start)
+            self._nextpart += 1
+            pass
+        self.images["/dev/" + name] = _gpt_image(_disk_sects, parts,
+                                                 _uuid(1, i))
+        return pvs
+
+    def _addRAID(self, i, m1, m2):
+        name = "md%d" % i
+        path = os.path.join(_virtual_dir, name)
+        numsects = int(self.attrs[self.sysdevs[m1] + "/size"]) - 8192
+        self._addBlockDev(name, path, (9, i), numsects)
+        self._set(path + "/removable", 0)
+        self._set(path + "/md/array_state", "clean")
+        self._set(path + "/md/level", "raid1")
+        self._set(path + "/md/raid_disks", 2)
+        self._set(path + "/md/chunk_size", 0)
+        self._set(path + "/md/sync_action", "idle")
+        self._set(path + "/md/uuid", _uuid(3, i).lower())
+        for (slot, m) in enumerate((m1, m2)):
+            dpath = path + "/md/dev-" + m
+            self._set(dpath + "/slot", slot)
+            self._set(dpath + "/state", "in_sync")
+            self.links[dpath + "/block"] = "../../../../../" + m
+            self.dirs[dpath].add("block")
+            self.dirs[self.sysdevs[m] + "/holders"].add(name)
+            pass
+        fsuuid = _uuid(4, i)
+        self.blkid.append(("/dev/" + name, fsuuid, "ext4"))
+        self.fstab.append("UUID=%s /data/%s ext4 defaults 0 2\n"
+                          % (fsuuid, name))
+        self.nraids += 1
+        return
+
+    def _addVGs(self, pvs, nvgs, nlvs):
+        if (not pvs or nvgs == 0):
+            return
+        for (i, (pv, numsects)) in enumerate(pvs):
+            vg = self.vgs.setdefault("vg%d" % (i % nvgs), [ 0, [ ], [ ] ])
+            vg[0] += numsects
+            vg[1].append(pv)
+            pass
+        for vgname in sorted(self.vgs):
+            vg = self.vgs[vgname]
+            lvsects = ((vg[0] * 4 // 5) // max(nlvs, 1)) // 8192 * 8192
+            for j in range(0, nlvs):
+                lvname = "lv%d" % j
+                vg[2].append((lvname, lvsects))
+                name = "dm-%d" % self._nextdm
+                path = os.path.join(_virtual_dir, name)
+                devnum = (253, self._nextdm)
+                self._addBlockDev(name, path, devnum, lvsects)
+                self._set(path + "/removable", 0)
+                self._set(path + "/dm/name", vgname + "-" + lvname)
+                self._set(path + "/dm/uuid", "LVM-" + _uuid(5, self._nextdm))
+                self.devnodes["/dev/%s/%s" % (vgname, lvname)] = (
+                    "/dev/" + name, devnum)
+                mappername = "/dev/mapper/%s-%s" % (vgname, lvname)
+                self.devnodes[mappername] = ("/dev/" + name, devnum)
+                self.blkid.append(("/dev/" + name, _uuid(6, self._nextdm),
+                                   "xfs"))
+                self.fstab.append("%s /srv/%s/%s xfs defaults 0 2\n"
+                                  % (mappername, vgname, lvname))
+                self._nextdm += 1
+                self.nlvs += 1
+                pass
+            pass
+        return
+
+    # Turn a path through the /sys/class/block links into the real one.
+    def _resolve(self, path):
+        path = os.path.normpath(path)
+        prefix = SysBlock.sysblock + "/"
+        if (path.startswith(prefix)):
+            w = path[len(prefix):].split("/", 1)
+            real = self.sysdevs.get(w[0])
+            if (real is not None):
+                w[0] = real
+                path = "/".join(w)
+                pass
+            pass
+        return path
+
+    def _lvmReport(self, vgnames):
+        entries = [ ]
+        for vgname in sorted(self.vgs):
+            if (vgnames and vgname not in vgnames):
+                continue
+            (numsects, pvs, lvs) = self.vgs[vgname]
+            used = sum([ n for (lv, n) in lvs ])
+            entries.append({
+                "vg": [ { "vg_name": vgname, "vg_size": str(numsects),
+                          "vg_free": str(numsects - used) } ],
+                "pv": [ { "pv_name": pv, "vg_name": vgname } for pv in pvs ],
+                "lv": [ { "lv_name": lv, "vg_name": vgname,
+                          "lv_size": str(n) } for (lv, n) in lvs ],
+                "pvseg": [ ], "seg": [ ] })
+            pass
+        return json.dumps({ "report": entries })
+
+    def _blkid(self, devnames):
+        out = ""
+        for (devname, fsuuid, fstype) in self.blkid:
+            if (devnames and devname not in devnames):
+                continue
+            out += ("DEVNAME=%s\nUUID=%s\nTYPE=%s\n\n"
+                    % (devname, fsuuid, fstype))
+            pass
+        return out
+
+    def call(self, cmd, device=None, timeout=None):
+        self._count("cmd " + cmd[0])
+        n = len(LVMReport.fullreport_args)
+        if (cmd[0] == "lvm" and cmd[1:n + 1] == LVMReport.fullreport_args):
+            return self._lvmReport(cmd[n + 1:])
+        if (cmd[0] == "blkid"):
+            return self._blkid(cmd[3:])
+        if (cmd[0] == "blockdev"):
+            return ""
+        raise AsyncCmd.CmdErr(str(cmd), 1, "",
+                              "Not something the benchmark can do")
+
+    def call_all(self, cmds, timeout=None):
+        results = [ ]
+        for (cmd, device) in cmds:
+            try:
+                results.append(self.call(cmd, device, timeout))
+            except AsyncCmd.CmdErr as e:
+                results.append(e)
+                pass
+            pass
+        return results
+
+    def stream(self, cmd, progress):
+        return self.call(cmd)
+
+    def read_attr(self, path):
+        self._count("read_attr")
+        return self.attrs.get(self._resolve(path))
+
+    def read_file(self, path):
+        if (path not in self.files):
+            raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+        return self.files[path]
+
+    def listdir(self, path):
+        self._count("listdir")
+        d = self.dirs.get(self._resolve(path))
+        if (d is None):
+            raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+        return sorted(d)
+
+    def exists(self, path):
+        path = self._resolve(path)
+        return path in self.dirs or path in self.attrs or path in self.links
+
+    def isdir(self, path):
+        return self._resolve(path) in self.dirs
+
+    def realpath(self, path):
+        if (path in self.devnodes):
+            return self.devnodes[path][0]
+        return self._resolve(path)
+
+    def readlink(self, path):
+        link = self.links.get(self._resolve(path))
+        if (link is None):
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL), path)
+        return link
+
+    def dev_number(self, devname):
+        node = self.devnodes.get(devname)
+        if (node is None):
+            return None
+        return os.makedev(node[1][0], node[1][1])
+
+    def open_dev(self, devname):
+        self._count("open_dev")
+        node = self.devnodes.get(devname)
+        if (node is None):
+            raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), devname)
+        return _Device(self.images.get(node[0], b""), self.sizes[node[0]])
+
+    def open_listener(self):
+        return None
+
+    pass
+
+# A curses window that doesn't draw anything, but counts what it was
+# asked to do.
+class NullWindow:
+    def __init__(self, nlines, ncols, counts=None):
+        self.nlines = nlines
+        self.ncols = ncols
+        if (counts is None):
+            counts = { }
+            pass
+        self.counts = counts
+        return
+
+    def getmaxyx(self):
+        return (self.nlines, self.ncols)
+
+    def derwin(self, nlines, ncols, y, x):
+        return NullWindow(nlines, ncols, self.counts)
+
+    def getch(self):
+        return -1
+
+    def __getattr__(self, name):
+        def draw(*args):
+            self.counts[name] = self.counts.get(name, 0) + 1
+            return None
+        return draw
+
+    # Return the number of drawing calls since the last call.
+    def takeCount(self):
+        n = sum(self.counts.values())
+        self.counts.clear()
+        return n
+
+    pass
+
+# Popups would eat the keys being timed, so the messages are kept
+# instead of being shown.
+class _Partitioner(Partitioner.Partitioner):
+    def __init__(self, *args, **kwargs):
+        self.messages = [ ]
+        Partitioner.Partitioner.__init__(self, *args, **kwargs)
+        return
+
+    def popupWin(self, s, handler=None, handlerObj=None, reformat=True):
+        self.messages.append(s)
+        return
+
+    pass
+
+class Benchmark:
+    # system must have a takeCounts() like FakeSystem.
+    def __init__(self, system, input_fstab="/etc/fstab", nlines=50,
+                 ncols=160):
+        self.system = system
+        self.input_fstab = input_fstab
+        self.window = NullWindow(nlines, ncols)
+        self.results = { }
+        self.errors = [ ]
+        return
+
+    # Run f and record how long it took and what it did as name.
+    def _time(self, name, f):
+        self.system.takeCounts()
+        self.window.takeCount()
+        start = time.perf_counter()
+        v = f()
+        t = time.perf_counter() - start
+        self.results[name] = { "ms": round(t * 1000, 3),
+                               "calls": self.system.takeCounts(),
+                               "draws": self.window.takeCount() }
+        return v
+
+    def _start(self, output_fstab, probe_cache):
+        p = _Partitioner(self.window, input_fstab=self.input_fstab,
+                         output_fstab=output_fstab, probe_cache=probe_cache)
+        self.errors += p.messages
+        p.messages = [ ]
+        return p
+
+    # Press c until stop(number of presses) is true, and record the time
+    # per key as name.
+    def _timeKeys(self, name, p, c, stop):
+        def press():
+            n = 0
+            while (not stop(n)):
+                p.handleChar(c)
+                n += 1
+                pass
+            return n
+        n = self._time(name, press)
+        r = self.results[name]
+        r["keys"] = n
+        r["us_per_key"] = round(r["ms"] * 1000 / max(n, 1), 1)
+        return
+
+    def run(self):
+        old = System.set_current(self.system)
+        tmpdir = tempfile.TemporaryDirectory()
+        cache_file = Partitioner._probe_cache.filename
+        try:
+            fstab = os.path.join(tmpdir.name, "fstab")
+            p = self._time("startup_cold",
+                           lambda: self._start(fstab, False))
+
+            # Fill the probe cache, then start from it.
+            Partitioner._probe_cache.filename = os.path.join(tmpdir.name,
+                                                             "probe-cache")
+            self._start(fstab, True)
+            self._time("startup_warm", lambda: self._start(fstab, True))
+            Partitioner._probe_cache.filename = cache_file
+            Partitioner._probe_cache.enabled = False
+
+            self._time("reread", p.reRead)
+            self._time("reread_owner", lambda: p.reReadOwner(p.findObj(p.disks[-1])))
+
+            p.setPos(0, 0)
+            last = p.numLines() - 1
+            self._timeKeys("npage", p, "NPAGE", lambda n: p.linepos >= last)
+            self._timeKeys("up", p, "UP", lambda n: p.linepos == 0)
+
+            # Go through all the units and back.
+            units = p.units.__class__
+            self._timeKeys("reunit", p, "U",
+                           lambda n: n > 0 and p.units.__class__ == units)
+            work = self._time("get_work", p.getWork)
+            self.errors += p.messages
+
+            # What is on the screen, by kind
+            topology = { "lines": p.numLines(), "work": len(work) }
+            for i in range(0, p.numLines()):
+                kind = p.getObj(i).__class__.__name__
+                topology[kind] = topology.get(kind, 0) + 1
+                pass
+            return { "topology": topology,
+                     "results": self.results,
+                     "errors": self.errors }
+        finally:
+            Partitioner._probe_cache.filename = cache_file
+            Partitioner._probe_cache.enabled = True
+            tmpdir.cleanup()
+            System.set_current(old)
+            pass
+        return None
+
+    pass
+
+if __name__== '__main__':
+    if (len(sys.argv) == 3 and sys.argv[1] == "--replay"):
+        try:
+            system = Capture.ReplaySystem(sys.argv[2])
+        except Capture.CaptureErr as e:
+            sys.stderr.write("%s\n" % str(e))
+            sys.exit(1)
+            pass
+    else:
+        args = [ 64, 8, 4, 8 ]
+        for (i, a) in enumerate(sys.argv[1:5]):
+            args[i] = int(a)
+            pass
+        (ndisks, nparts, nvgs, nlvs) = args
+        system = FakeSystem(ndisks, nparts, nvgs, nlvs)
+        pass
+    b = Benchmark(system)
+    r = b.run()
+    if (isinstance(system, Capture.ReplaySystem)):
+        r["misses"] = sorted(system.misses)
+        pass
+    print(json.dumps(r, indent=2, sort_keys=True))
+    if (b.errors):
+        sys.exit(1)
+        pass
+    pass
@@ -0,0 +1,433 @@
+#! /usr/bin/python
+#
+#    uipartition - A disk partitions/RAID/LVM setup tool
+#    Copyright (C) 2010-2015  MontaVista Software, LLC
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor,
+#      Boston, MA  02110-1301  USA
+
+#
+# Record everything the partitioner asks a machine (see System) into a
+# capture file, and play it back later on another machine.  That way
+# a big or odd machine can be looked at, profiled, and benchmarked
+# without having it.
+#
+# RecordingSystem passes everything on to a real System and keeps the
+# question, the answer (or the error), and for the slow things, how
+# long it took.  The lvm shell isn't used while recording, so the LVM
+# commands are run and captured like everything else.  Commands run
+# with progress are recorded like any other command, with all their
+# output.
+#
+# ReplaySystem answers from a capture file.  The same question can get
+# different answers over a run (the LVM report after a VG is made, for
+# instance), so the answers to each question are given in the order
+# they were recorded, and the last one is repeated once they run out.
+# Answers for different devices don't depend on each other, so the
+# probes running in parallel don't change anything.  Questions that
+# aren't in the capture get "not found" answers and are kept in
+# "misses".  If timing is set, commands and device reads take as long
+# as they did when they were recorded.  The output of commands run with
+# progress is given to the progress all at once when they are done.
+#
+# Device events aren't recorded, and nothing is written on replay.
+#
+
+import os
+import json
+import time
+import zlib
+import errno
+import base64
+import threading
+
+from . import System
+from . import AsyncCmd
+
+class CaptureErr(Exception):
+    def __init__(self, str):
+        self.s = str
+        return
+
+    def __str__(self):
+        return self.s
+
+    pass
+
+_version = 1
+
+# The answers and errors are stored as JSON.  bytes are compressed,
+# since most of what is read from a device is zeros.
+def _encode(v):
+    if (isinstance(v, bytes)):
+        return { "bytes": base64.b64encode(zlib.compress(v)).decode() }
+    return v
+
+def _decode(v):
+    if (isinstance(v, dict) and "bytes" in v):
+        return zlib.decompress(base64.b64decode(v["bytes"]))
+    return v
+
+def _encode_err(e):
+    if (isinstance(e, AsyncCmd.CmdTimeout)):
+        return { "timeout": e.timeout, "cmd": e.cmd, "out": e.out,
+                 "errout": e.errout }
+    if (isinstance(e, AsyncCmd.CmdErr)):
+        return { "returncode": e.returncode, "cmd": e.cmd, "out": e.out,
+                 "errout": e.errout }
+    return { "errno": e.errno, "strerror": e.strerror,
+             "filename": e.filename }
+
+def _decode_err(d):
+    if ("timeout" in d):
+        return AsyncCmd.CmdTimeout(d["cmd"], d["timeout"], d["out"],
+                                   d["errout"])
+    if ("returncode" in d):
+        return AsyncCmd.CmdErr(d["cmd"], d["returncode"], d["out"],
+                               d["errout"])
+    return OSError(d["errno"], d["strerror"], d["filename"])
+
+def _key(op, args):
+    return json.dumps([ op ] + list(args))
+
+# A device opened by a RecordingSystem
+class _RecordingDevice:
+    def __init__(self, system, devname, dev):
+        self.system = system
+        self.devname = devname
+        self.dev = dev
+        return
+
+    def pread(self, n, offset):
+        return self.system._record("pread", (self.devname, n, offset),
+                                   lambda: self.dev.pread(n, offset),
+                                   timed=True)
+
+    def size(self):
+        return self.system._record("size", (self.devname,), self.dev.size)
+
+    def ioctl_int(self, req, fmt="I"):
+        return self.system._record("ioctl_int", (self.devname, req, fmt),
+                                   lambda: self.dev.ioctl_int(req, fmt))
+
+    def close(self):
+        self.dev.close()
+        return
+
+    pass
+
+class RecordingSystem(System.System):
+    def __init__(self, base=None):
+        if (base is None):
+            base = System.System()
+            pass
+        self.base = base
+        self.real = base.real
+        self.lvm_shell = None
+        self.lock = threading.Lock()
+        self.entries = [ ]
+        return
+
+    def _add(self, e, start, timed):
+        if (timed):
+            e["time"] = round(time.time() - start, 6)
+            pass
+        with self.lock:
+            self.entries.append(e)
+            pass
+        return
+
+    # Call f and record what it returned or raised as the answer to
+    # op with args.  Other exceptions aren't something the partitioner
+    # expects, so they aren't recorded.
+    def _record(self, op, args, f, timed=False):
+        e = { "op": op, "args": list(args) }
+        start = time.time()
+        try:
+            v = f()
+        except (AsyncCmd.CmdErr, OSError) as err:
+            e["error"] = _encode_err(err)
+            self._add(e, start, timed)
+            raise
+        e["result"] = _encode(v)
+        self._add(e, start, timed)
+        return v
+
+    def call(self, cmd, device=None, timeout=None):
+        return self._record("call", (list(cmd),),
+                            lambda: self.base.call(cmd, device, timeout),
+                            timed=True)
+
+    # The commands are recorded one at a time, each as taking as long as
+    # the whole batch.
+    def call_all(self, cmds, timeout=None):
+        start = time.time()
+        results = self.base.call_all(cmds, timeout)
+        t = round(time.time() - start, 6)
+        with self.lock:
+            for ((cmd, device), r) in zip(cmds, results):
+                e = { "op": "call", "args": [ list(cmd) ], "time": t }
+                if (isinstance(r, (AsyncCmd.CmdErr, OSError))):
+                    e["error"] = _encode_err(r)
+                elif (isinstance(r, Exception)):
+                    continue
+                else:
+                    e["result"] = r
+                    pass
+                self.entries.append(e)
+                pass
+            pass
+        return results
+
+    def stream(self, cmd, progress):
+        return self._record("call", (list(cmd),),
+                            lambda: self.base.stream(cmd, progress),
+                            timed=True)
+
+    def read_attr(self, path):
+        return self._record("read_attr", (path,),
+                            lambda: self.base.read_attr(path))
+
+    def read_file(self, path):
+        return self._record("read_file", (path,),
+                            lambda: self.base.read_file(path))
+
+    def listdir(self, path):
+        return self._record("listdir", (path,),
+                            lambda: self.base.listdir(path))
+
+    def exists(self, path):
+        return self._record("exists", (path,),
+                            lambda: self.base.exists(path))
+
+    def isdir(self, path):
+        return self._record("isdir", (path,),
+                            lambda: self.base.isdir(path))
+
+    def realpath(self, path):
+        return self._record("realpath", (path,),
+                            lambda: self.base.realpath(path))
+
+    def readlink(self, path):
+        return self._record("readlink", (path,),
+                            lambda: self.base.readlink(path))
+
+    def dev_number(self, devname):
+        return self._record("dev_number", (devname,),
+                            lambda: self.base.dev_number(devname))
+
+    def open_dev(self, devname):
+        devs = [ ]
+        def do_open():
+            devs.append(self.base.open_dev(devname))
+            return True
+        self._record("open_dev", (devname,), do_open, timed=True)
+        return _RecordingDevice(self, devname, devs[0])
+
+    def open_listener(self):
+        return self.base.open_listener()
+
+    # Write out what was recorded.  Raises OSError if it can't be
+    # written.
+    def save(self, filename):
+        with self.lock:
+            data = { "version": _version, "entries": list(self.entries) }
+            pass
+        f = open(filename, "w")
+        try:
+            json.dump(data, f)
+        finally:
+            f.close()
+            pass
+        return
+
+    pass
+
+# A device opened by a ReplaySystem
+class _ReplayDevice:
+    def __init__(self, system, devname):
+        self.system = system
+        self.devname = devname
+        return
+
+    def pread(self, n, offset):
+        return self.system._answer("pread", (self.devname, n, offset))
+
+    def size(self):
+        return self.system._answer("size", (self.devname,))
+
+    def ioctl_int(self, req, fmt="I"):
+        return self.system._answer("ioctl_int", (self.devname, req, fmt))
+
+    def close(self):
+        return
+
+    pass
+
+# What is returned for questions that aren't in the capture
+_not_found = {
+    "read_attr": None,
+    "exists": False,
+    "isdir": False,
+    "dev_number": None,
+}
+
+class ReplaySystem(System.System):
+    real = False
+
+    # Raises CaptureErr if the file isn't a capture.
+    def __init__(self, filename, timing=False):
+        self.lvm_shell = None
+        self.timing = timing
+        self.lock = threading.Lock()
+        self.counts = { }
+        self.misses = set()
+
+        # The answers to each question, and how many were given
+        self.answers = { }
+        self.used = { }
+        try:
+            f = open(filename, "r")
+            try:
+                data = json.load(f)
+            finally:
+                f.close()
+                pass
+            if (data.get("version") != _version):
+                raise CaptureErr("%s is a version %s capture, not %d"
+                                 % (filename, data.get("version"), _version))
+            for e in data["entries"]:
+                k = _key(e["op"], e["args"])
+                self.answers.setdefault(k, [ ]).append(e)
+                pass
+            pass
+        except (IOError, OSError, ValueError, KeyError, TypeError,
+                AttributeError) as e:
+            raise CaptureErr("Unable to read capture %s: %s"
+                             % (filename, str(e)))
+        return
+
+    # The next recorded entry for the question, or None.
+    def _entry(self, op, args):
+        k = _key(op, args)
+        if (op == "call"):
+            what = "cmd " + args[0][0]
+        else:
+            what = op
+            pass
+        with self.lock:
+            self.counts[what] = self.counts.get(what, 0) + 1
+            answers = self.answers.get(k)
+            if (answers is None):
+                self.misses.add(k)
+                return None
+            i = self.used.get(k, 0)
+            if (i < len(answers) - 1):
+                self.used[k] = i + 1
+                pass
+            return answers[i]
+        return None
+
+    # Give the answer from entry e, raising the recorded error if there
+    # was one.
+    def _result(self, op, args, e):
+        if (e is None):
+            if (op in _not_found):
+                return _not_found[op]
+            if (op == "realpath"):
+                return os.path.normpath(args[0])
+            if (op == "call"):
+                raise AsyncCmd.CmdErr(str(args[0]), -1, "",
+                                      "Not in the capture")
+            raise OSError(errno.ENOENT, "Not in the capture", args[0])
+        if ("error" in e):
+            raise _decode_err(e["error"])
+        return _decode(e["result"])
+
+    def _answer(self, op, args):
+        e = self._entry(op, args)
+        if (self.timing and e is not None and "time" in e):
+            time.sleep(e["time"])
+            pass
+        return self._result(op, args, e)
+
+    # Return the number of questions of each kind since the last call.
+    def takeCounts(self):
+        with self.lock:
+            counts = self.counts
+            self.counts = { }
+            pass
+        return counts
+
+    def call(self, cmd, device=None, timeout=None):
+        return self._answer("call", (list(cmd),))
+
+    # The batch takes as long as the slowest command in it.
+    def call_all(self, cmds, timeout=None):
+        results = [ ]
+        delay = 0
+        for (cmd, device) in cmds:
+            e = self._entry("call", (list(cmd),))
+            if (e is not None):
+                delay = max(delay, e.get("time", 0))
+                pass
+            try:
+                results.append(self._result("call", (list(cmd),), e))
+            except (AsyncCmd.CmdErr, OSError) as err:
+                results.append(err)
+                pass
+            pass
+        if (self.timing):
+            time.sleep(delay)
+            pass
+        return results
+
+    def stream(self, cmd, progress):
+        out = self.call(cmd)
+        progress.output(out.encode("utf8"))
+        return out
+
+    def read_attr(self, path):
+        return self._answer("read_attr", (path,))
+
+    def read_file(self, path):
+        return self._answer("read_file", (path,))
+
+    def listdir(self, path):
+        return self._answer("listdir", (path,))
+
+    def exists(self, path):
+        return self._answer("exists", (path,))
+
+    def isdir(self, path):
+        return self._answer("isdir", (path,))
+
+    def realpath(self, path):
+        return self._answer("realpath", (path,))
+
+    def readlink(self, path):
+        return self._answer("readlink", (path,))
+
+    def dev_number(self, devname):
+        return self._answer("dev_number", (devname,))
+
+    def open_dev(self, devname):
+        self._answer("open_dev", (devname,))
+        return _ReplayDevice(self, devname)
+
+    def open_listener(self):
+        return None
+
+    pass
@@ -19,8 +19,8 @@
 #      Boston, MA  02110-1301  USA
 
 import curses
-from . import FlexScrollPad
 from . import DebugLog
+from . import Screen
 
 # FlexScrollColumn raises these when the user passes in bogus data.
 class FlexScrollColumnErr(Exception):
@@ -41,10 +41,34 @@ class Dummy:
     pass
 dummyObj = Dummy()
 
+# One line in the display.  sizes is the column sizes passed in by the
+# user (not copied), cols the strings in each column, objs the objects
+# in each column, and hl the highlighted column, or None.
+#
+# The line number is so the line an object is on can be found without
+# searching, it may be stale, see lineOf().
+class _Row:
+    __slots__ = ("line", "sizes", "cols", "objs", "hl")
+
+    def __init__(self, line, sizes):
+        self.line = line
+        self.sizes = sizes
+        self.cols = [ "" ] * len(sizes)
+        self.objs = [ None ] * len(sizes)
+        self.hl = None
+        return
+
+    pass
+
 # A class that provides a line and column display and displays a window
 # into the structure.  It consists of a list of lines.  Each line consists
 # of a list of columns.
-class FlexScrollColumn(FlexScrollPad.FlexScrollPad):
+#
+# Only the lines that are in the window are drawn.  The rest are just
+# kept as their column strings and drawn when they are scrolled into
+# view, so the cost of changing a line doesn't depend on how many lines
+# there are.
+class FlexScrollColumn:
     # Create an object displayed in a windows that is nlines long and
     # ncols wide.  Those have nothing to do with the lines and columns
     # in the object, they are just the window size.  The upper left hand
@@ -52,101 +76,242 @@ class FlexScrollColumn(FlexScrollPad.FlexScrollPad):
     # is created as a child of the given parent and y and x are relative
     # to the parent.
     def __init__(self, parent, nlines, ncols, y, x):
-        self.pad = FlexScrollPad.FlexScrollPad(parent, nlines, ncols,
-                                               y, x)
+        self.w = parent.derwin(nlines, ncols, y, x)
+        Screen.setup_window(self.w)
+        self.nlines = nlines
         self.ncols = ncols
-        self.colsizes = []
-        self.cols = []
-        self.objs = []
+        self.topy = 0
+        self.rows = []
+
+        # Index of objects, keyed by (column, id(obj)), to find the
+        # line they are on.  It points to the row.  The rows before
+        # self.renumber have the right line number, the ones after it
+        # may have been moved by an insert or delete; they are fixed up
+        # when a lookup needs it.
+        self.index = { }
+        self.renumber = 0
+        return
+
+    def _indexObj(self, line, column, obj):
+        if (obj is not None):
+            self.index[(column, id(obj))] = (obj, self.rows[line])
+            pass
+        return
+
+    def _unindexObj(self, line, column):
+        row = self.rows[line]
+        obj = row.objs[column]
+        if (obj is None):
+            return
+        key = (column, id(obj))
+        if (key in self.index and self.index[key][1] is row):
+            del self.index[key]
+            pass
+        return
+
+    def _moved(self, line):
+        if (line < self.renumber):
+            self.renumber = line
+            pass
         return
 
     # Return the curses window
     def getWindow(self):
-        return self.pad.getWindow()
+        return self.w
     
     # How many lines are in the internal buffer?
     def numLines(self):
-        return len(self.cols)
+        return len(self.rows)
 
     # How many column are in the given line?
     def numColumns(self, line):
-        return len(self.cols[line])
+        return len(self.rows[line].cols)
 
     def getNumDisplayLines(self):
-        (lines, cols) = self.pad.getmaxyx()
-        return lines
+        return self.nlines
 
     # Return the displayed string for the given line/column
     def getField(self, line, column):
-        return self.cols[line][column]
+        return self.rows[line].cols[column]
 
     # Return the object for the given line/column
     def getObj(self, line, column):
-        return self.objs[line][column]
+        return self.rows[line].objs[column]
     
     # Set the object for the given line/column
     def setObj(self, line, column, obj):
-        self.objs[line][column] = obj
+        self._unindexObj(line, column)
+        self.rows[line].objs[column] = obj
+        self._indexObj(line, column, obj)
         return
 
     def getFirstDisplayedLine(self):
-        return self.pad.getFirstDisplayedLine()
+        return self.topy
 
     # Note: This may return more than the number of lines in the buffer if
     # only a partial screen is displayed at the end.
     def getLastDisplayedLine(self):
-        return self.pad.getLastDisplayedLine()
+        return self.topy + self.nlines - 1
+
+    # Adding a character to the bottom right position in a window
+    # results in an error, even though it actually works.
+    def _addstr(self, y, x, s, attr):
+        try:
+            self.w.addstr(y, x, s, attr)
+        except curses.error:
+            pass
+        return
+
+    # Draw the given line if it is in the window.
+    def _drawLine(self, line):
+        dy = line - self.topy
+        if (dy < 0 or dy >= self.nlines or line >= len(self.rows)):
+            return
+        row = self.rows[line]
+        strs = [ ]
+        pos = 0
+        hlstart = -1
+        hlend = -1
+        for col in range(0, len(row.cols)):
+            size = row.sizes[col]
+            if (size < 0):
+                size = -size
+            elif (size == 0): # Rest of line
+                size = self.ncols - pos
+                pass
+            s = row.cols[col]
+            if (len(s) < size):
+                # Pad end with spaces
+                s = s + "%*s" % (size - len(s), " ")
+            elif (len(s) > size):
+                s = s[0:size]
+                pass
+            if (col == row.hl):
+                hlstart = pos
+                hlend = pos + size
+                pass
+            strs.append(s)
+            pos += size
+            pass
+        s = "".join(strs)
+        if (len(s) < self.ncols):
+            s = s + "%*s" % (self.ncols - len(s), " ")
+        else:
+            s = s[0:self.ncols]
+            pass
+
+        if (hlstart < 0 or hlstart >= self.ncols):
+            self._addstr(dy, 0, s, 0)
+            return
+        self._addstr(dy, 0, s[0:hlstart], 0)
+        self._addstr(dy, hlstart, s[hlstart:hlend], curses.A_STANDOUT)
+        if (hlend < self.ncols):
+            self._addstr(dy, hlend, s[hlend:], 0)
+            pass
+        return
+
+    def _drawLines(self, first, last):
+        for line in range(first, last):
+            if (line >= len(self.rows)):
+                break
+            self._drawLine(line)
+            pass
+        return
 
     def scrolly(self, count=1):
-        self.pad.scrolly(count)
+        if (count < 0):
+            # Scrolling down
+            count = -count
+            if (self.topy == 0):
+                return
+            if (count > self.topy):
+                count = self.topy
+                pass
+            self.topy -= count
+            if (count >= self.nlines):
+                # Scrolling a screen or more, just redraw
+                self.redraw()
+            else:
+                # Partial scroll, move what's there and draw the new lines
+                self.w.move(0, 0)
+                self.w.insdelln(count)
+                self._drawLines(self.topy, self.topy + count)
+                pass
+            pass
+        elif (count > 0):
+            # scrolling up
+            if (self.topy + self.nlines >= len(self.rows)):
+                return
+            if (self.topy + count > len(self.rows)):
+                count = len(self.rows) - self.topy - 1
+                pass
+            self.topy += count
+            if (count >= self.nlines):
+                # Scrolling a screen or more, just redraw
+                self.redraw()
+            else:
+                # Partial scroll, move what's there and draw the new lines
+                self.w.move(0, 0)
+                self.w.insdelln(-count)
+                self._drawLines(self.topy + self.nlines - count,
+                                self.topy + self.nlines)
+                pass
+            pass
         return
     
     # Push all changes to the display
     def refresh(self):
-        self.pad.refresh()
+        Screen.refresh(self.w)
         return
 
     # Redraw the window
     def redraw(self):
-        self.pad.redraw()
+        Screen.clear(self.w)
+        self._drawLines(self.topy, self.topy + self.nlines)
         return
 
     # Return the line number that contains the given object in the given
     # column
     def lineOf(self, column, obj):
-        for i in range(0, len(self.objs)):
-            if (self.objs[i][column] == obj):
-                return i
+        v = self.index.get((column, id(obj)))
+        if (v is None):
+            raise FlexScrollColumnErr("Could not find object in list")
+        row = v[1]
+        rows = self.rows
+        if (row.line >= len(rows) or rows[row.line] is not row):
+            # The line number is stale, so the line is past the
+            # renumber point (everything before it is right).  Fix up
+            # the rows from there until we get to this one.  Inserts
+            # and deletes are usually near the lines looked up, so this
+            # doesn't go far.
+            i = self.renumber
+            while True:
+                rows[i].line = i
+                if (rows[i] is row):
+                    break
+                i += 1
+                pass
+            self.renumber = i + 1
             pass
-        raise FlexScrollColumnErr("Could not find object in list")
+        return row.line
 
     # redo the columns to match the new colsizes, starting from the
     # given column
     def recolumn(self, line, col, colsizes):
-        self.colsizes[line] = self.colsizes[line][0:col] + colsizes
-        
+        row = self.rows[line]
+
         # Delete column information from col to the end:
-        for i in range(col, len(self.cols[line])):
-            del self.cols[line][col]
-            del self.objs[line][col]
+        for i in range(col, len(row.cols)):
+            self._unindexObj(line, i)
             pass
-
-        # Add new empty column information
-        for i in range(0, len(colsizes)):
-            self.cols[line].append("")
-            self.objs[line].append(None)
+        row.sizes = row.sizes[0:col] + colsizes
+        row.cols = row.cols[0:col] + [ "" ] * len(colsizes)
+        row.objs = row.objs[0:col] + [ None ] * len(colsizes)
+        if (row.hl is not None and row.hl >= col):
+            row.hl = None
             pass
 
-        # Redisplay the line, starting at the given column
-        startx = 0
-        for i in range(0, col):
-            startx += self._getcolsize(line, i)
-            pass
-
-        self.pad.clrtoeol(line, startx)
-        for i in range(col, len(self.cols[line])):
-            self._showcol(line, i)
-            pass
+        self._drawLine(line)
         return
         
     # Add a new line at the given line number.  The line number may be
@@ -161,79 +326,66 @@ class FlexScrollColumn(FlexScrollPad.FlexScrollPad):
     # column means that it will take the rest of the line, and is
     # selectable.
     def insertLine(self, line, colsizes):
-        if (line > len(self.cols)):
+        if (line > len(self.rows)):
             raise FlexScrollColumnErr("insertLine at %d, last line was %d"
-                                      % (line, len(self.cols)))
-
-        self.colsizes.insert(line, colsizes)
-        colstrs = [ ]
-        objs = []
-        for i in colsizes:
-            colstrs.append("")
-            objs.append(None)
+                                      % (line, len(self.rows)))
+
+        self.rows.insert(line, _Row(line, colsizes))
+        self._moved(line)
+
+        if (line < self.topy):
+            # Keep the same lines in the window
+            self.topy += 1
+        elif (line < self.topy + self.nlines):
+            self.w.move(line - self.topy, 0)
+            self.w.insertln()
+            self._drawLine(line)
             pass
-        self.cols.insert(line, colstrs)
-        self.objs.insert(line, objs)
-        self.pad.insertln(line)
-        self.pad.addstr(line, 0, "%*s" % (self.ncols, " "))
         return
 
     # Delete the given line
     def deleteLine(self, line):
-        if (line >= len(self.cols)):
+        if (line >= len(self.rows)):
             raise FlexScrollColumnErr("deleteLine at %d, last line was %d"
-                                      % (line, len(self.cols) - 1))
+                                      % (line, len(self.rows) - 1))
 
-        del self.cols[line]
-        del self.colsizes[line]
-        del self.objs[line]
-        self.pad.deleteln(line)
-        return
-
-    def _showcol(self, line, col, attr = 0):
-        sizes = self.colsizes[line]
-        s = self.cols[line][col]
-        pos = 0
-        for si in sizes[0:col]:
-            if (si < 0):
-                si = -si
-                pass
-            pos += si
+        for i in range(0, len(self.rows[line].objs)):
+            self._unindexObj(line, i)
             pass
-        slen = len(s)
-        size = sizes[col]
-        if (size < 0):
-            size = -size
-        elif (size == 0): # Rest of line
-            size = self.ncols - pos
+        del self.rows[line]
+        self._moved(line)
+
+        if (self.topy > 0 and self.topy >= len(self.rows)):
+            # Deleted the only line in the window, back up one.
+            self.topy -= 1
+            self.redraw()
+        elif (line < self.topy):
+            self.topy -= 1
+        elif (line < self.topy + self.nlines):
+            self.w.move(line - self.topy, 0)
+            self.w.deleteln()
+            # Something may have scrolled up into the bottom line
+            self._drawLine(self.topy + self.nlines - 1)
             pass
-        if (slen < size):
-            # Pad end with spaces
-            dstr = s + "%*s" % (size - slen, " ")
-        elif (slen > size):
-            dstr = s[0:size]
-        else:
-            dstr = s
-            pass
-        self.pad.addstr(line, pos, dstr, attr)
         return
 
     def _checklinepos(self, line, name):
-        if (line >= len(self.cols)):
+        if (line >= len(self.rows)):
             raise FlexScrollColumnErr(name +" at %d, last line was %d"
-                                      % (line, len(self.cols) - 1))
+                                      % (line, len(self.rows) - 1))
         return
         
     def _checkpos(self, line, col, name):
         self._checklinepos(line, name)
-        if (col >= len(self.cols[line])):
+        if (col >= len(self.rows[line].cols)):
             raise FlexScrollColumnErr(name +" at line %d, col %d, last"
                                       " col was %d"
-                                      % (line, col, len(self.cols[line]) - 1))
+                                      % (line, col,
+                                         len(self.rows[line].cols) - 1))
         return
 
     def _getcolsize(self, line, col):
-        c = self.colsizes[line][col]
+        c = self.rows[line].sizes[col]
         if (c < 0):
             c = -c
             pass
@@ -249,12 +401,12 @@ class FlexScrollColumn(FlexScrollPad.FlexScrollPad):
             ladd = colsize - len(s)
             s = "%*s%s" % (ladd, " ", s)
             pass
-        self.cols[line][col] = s
+        self.rows[line].cols[col] = s
         if (obj != dummyObj):
-            self.objs[line][col] = obj
+            self.setObj(line, col, obj)
             pass
 
-        self._showcol(line, col)
+        self._drawLine(line)
         return
 
     # Highlight the given column, on the line, or the closest selectable
@@ -263,7 +415,7 @@ class FlexScrollColumn(FlexScrollPad.FlexScrollPad):
     # direction, the other direction is attempted.
     def highlightColumn(self, line, col, dir=RIGHT):
         self._checklinepos(line, "highlightColumn")
-        sizes = self.colsizes[line]
+        sizes = self.rows[line].sizes
         if (col >= len(sizes)):
             col = len(sizes) - 1
             pass
@@ -288,17 +440,15 @@ class FlexScrollColumn(FlexScrollPad.FlexScrollPad):
         if (not found):
             raise FlexScrollColumnErr("Unable to find column to highlight")
             
-        self._showcol(line, col, curses.A_STANDOUT)
+        self.rows[line].hl = col
+        self._drawLine(line)
         return col
 
     # Remove highlighting from the given column.
     def unhighlightColumn(self, line, col):
         self._checkpos(line, col, "unhighlightColumn")
-        sizes = self.colsizes[line]
-        while (sizes[col] < 0):
-            col += 1
-            pass
-        self._showcol(line, col, 0)
+        self.rows[line].hl = None
+        self._drawLine(line)
         return
 
     pass
@@ -20,6 +20,7 @@
 
 import curses
 from . import DebugLog
+from . import Screen
 
 # FlexScrollPad raises these when the user passes in bogus data.
 class FlexScrollPadErr(Exception):
@@ -32,13 +33,51 @@ class FlexScrollPadErr(Exception):
 
     pass
 
-# Extend sequence s by count items of to_add.  This should be built in
-# to python :(
-def _seqext(s, to_add, count):
-    for i in range(0, count):
-        s.append(to_add)
+# The attributes of a line are kept as a list of (length, attr) spans
+# that cover the text of the line, so a line with one or two
+# attributes takes one or two entries and not one per character.
+
+# Return the spans covering characters start to end (not including
+# end).
+def _span_slice(spans, start, end):
+    out = [ ]
+    pos = 0
+    for (l, a) in spans:
+        if (pos >= end):
+            break
+        s = max(pos, start)
+        e = min(pos + l, end)
+        if (e > s):
+            out.append((e - s, a))
+            pass
+        pos += l
         pass
-    return s
+    return out
+
+# Combine adjacent spans with the same attribute.
+def _span_merge(spans):
+    out = [ ]
+    for (l, a) in spans:
+        if (l <= 0):
+            continue
+        if (out and out[-1][1] == a):
+            out[-1] = (out[-1][0] + l, a)
+        else:
+            out.append((l, a))
+            pass
+        pass
+    return out
+
+# Replace characters start to end (not including end) with the new
+# spans.  end may be past the end of the line, everything after start
+# is replaced then.
+def _span_splice(spans, start, end, new):
+    total = 0
+    for (l, a) in spans:
+        total += l
+        pass
+    return _span_merge(_span_slice(spans, 0, start) + new
+                       + _span_slice(spans, end, total))
 
 # flexscrollpad - a flexibled scrolled window
 #
@@ -85,6 +124,7 @@ def _seqext(s, to_add, count):
 class FlexScrollPad:
     def __init__(self, parent, nlines, ncols, y, x):
         self.w = parent.derwin(nlines, ncols, y, x)
+        Screen.setup_window(self.w)
         self.nlines = nlines
         self.ncols = ncols
         self.curattr = 0
@@ -141,30 +181,22 @@ class FlexScrollPad:
     # and it doesn't do any error checking, the caller must do those things.
     def _redispLine(self, ywin):
         # First get the part of the line that is displayed.
-        a = self.attr[self.topy + ywin]
-        a = a[self.topx:self.topx + self.ncols]
-        if (len(a) == 0):
-            # Nothing to display, abort
-            return
+        a = _span_slice(self.attr[self.topy + ywin],
+                        self.topx, self.topx + self.ncols)
         b = self.buf[self.topy + ywin]
         b = b[self.topx:self.topx + self.ncols]
-        
-        ca = a[0]
+
+        # One add per span.
         beg = 0
-        for i in range(0, len(a)):
-            if (a[i] != ca):
-                self._addstrHack(ywin, beg, b[beg:i], ca)
-                ca = a[i]
-                beg = i
-                pass
+        for (l, ca) in a:
+            self._addstrHack(ywin, beg, b[beg:beg + l], ca)
+            beg += l
             pass
-        # Don't care about the end, curses will chop it at the window edge.
-        self._addstrHack(ywin, beg, b[beg:], ca)
         return
 
     # Redraw the whole window
     def redraw(self):
-        self.w.clear()
+        Screen.clear(self.w)
         for y in range(0, self.nlines):
             if (y + self.topy >= len(self.buf)):
                 break
@@ -178,13 +210,13 @@ class FlexScrollPad:
         if (pos != None):
             self.w.move(pos[0], pos[1])
             pass
-        self.w.refresh()
+        Screen.refresh(self.w)
         return
 
     # Clear the entire buffer.
     def clear(self):
         self._clear()
-        self.w.clear()
+        Screen.clear(self.w)
         return
     
     def _clear(self):
@@ -267,8 +299,7 @@ class FlexScrollPad:
                                    % (y, len(self.buf) - 1))
             pass
 
-        a = self.attr[y]
-        alen = len(a)
+        alen = len(self.buf[y])
         if (x >= alen):
             return
         elif (x + xlen > alen):
@@ -276,9 +307,8 @@ class FlexScrollPad:
             pass
 
         s = self.buf[y][x:x + xlen]
-        for i in range(x, x + xlen):
-            a[i] = attr
-            pass
+        self.attr[y] = _span_splice(self.attr[y], x, x + xlen,
+                                    [ (xlen, attr) ])
 
         dp = self._displaypos(y, x, xlen)
         if (dp != None):
@@ -342,28 +372,26 @@ class FlexScrollPad:
         sa = self.attr[y]
         sblen = len(sb)
         slen = len(s)
-        a = _seqext([], attr, slen);
+        a = [ (slen, attr) ]
         if (x < sblen):
             # Inserting starting inside the current string
             epos = x + slen
             if (epos < sblen):
                 # Fully inside the current string
                 sb = sb[0:x] + s + sb[epos:]
-                sa = sa[0:x] + a + sa[epos:]
             else:
                 # Starts inside, but goes past the end
                 sb = sb[0:x] + s
-                sa = sa[0:x] + a
                 pass
-            pass
+            sa = _span_splice(sa, x, epos, a)
         elif (x > sblen):
             # Past the end of the current string, pad with spaces
             sb = sb + ("%*s" % (x - sblen, " ")) + s
-            sa = sa + _seqext([], self.curattr, x - sblen) + a
+            sa = _span_merge(sa + [ (x - sblen, self.curattr) ] + a)
         else:
             # Right at the end of the current string, easy.
             sb = sb + s
-            sa = sa + a
+            sa = _span_merge(sa + a)
             pass
         self.buf[y] = sb
         self.attr[y] = sa
@@ -495,11 +523,9 @@ class FlexScrollPad:
                 # Scrolling a screen or more, just redraw
                 self.redraw()
             else:
-                # Partial scroll, optimize with inserts and adds
+                # Partial scroll, move what's there and draw the new lines
                 self.w.move(0, 0)
-                for y in range(0, count):
-                    self.w.insertln()
-                    pass
+                self.w.insdelln(count)
                 for y in range(0, count):
                     self._redispLine(y)
                     pass
@@ -519,12 +545,12 @@ class FlexScrollPad:
                 # Scrolling a screen or more, just redraw
                 self.redraw()
             else:
-                # Partial scroll, optimize with deletes and adds
-                self.w.move(0, count)
-                for y in range(0, count):
-                    self.w.deleteln()
-                    pass
-                for y in range(self.nlines - count - 1, self.nlines):
+                # Partial scroll, move what's there and draw the new lines
+                self.w.move(0, 0)
+                self.w.insdelln(-count)
+                for y in range(self.nlines - count, self.nlines):
+                    if (y + self.topy >= len(self.buf)):
+                        break
                     self._redispLine(y)
                     pass
                 pass
@@ -591,7 +617,7 @@ class FlexScrollPad:
         b = self.buf[y]
         a = self.attr[y]
         afterb = b[x:]
-        aftera = a[x:]
+        aftera = _span_slice(a, x, len(b))
         self.clrtoeol(y, x)
 
         # Make room for the string and call addstr
@@ -602,20 +628,15 @@ class FlexScrollPad:
         self.addstr(y, x, s, attr)
 
         # Now insert the cut string, making sure to get the attributes right
-        if (len(a) > 0):
+        if (len(aftera) > 0):
             y += nlcount
             x = len(self.buf[y])
             new_x = x
-            ca = aftera[0]
             beg = 0
-            for i in range(1, len(aftera)):
-                if (aftera[i] != ca):
-                    self._addstr(y, x + beg, afterb[beg:i], ca)
-                    ca = aftera[i]
-                    beg = i
-                    pass
+            for (l, ca) in aftera:
+                self._addstr(y, x + beg, afterb[beg:beg + l], ca)
+                beg += l
                 pass
-            self._addstr(y, x + beg, afterb[beg:], ca)
             pass
 
         self.refresh()
@@ -641,10 +662,8 @@ class FlexScrollPad:
         b = self.buf[y]
         if (x >= len(b)):
             return
-        a = self.attr[y]
-
         self.buf[y] = b[0:x] + b[x+1:]
-        self.attr[y] = a[0:x] + a[x+1:]
+        self.attr[y] = _span_splice(self.attr[y], x, x + 1, [ ])
 
         dp = self._displaypos(y, x, 1)
         if (dp != None):
@@ -662,9 +681,8 @@ class FlexScrollPad:
         if (slen <= 0):
             return
         
-        a = self.attr[y]
         self.buf[y] = b[0:x]
-        self.attr[y] = a[0:x]
+        self.attr[y] = _span_slice(self.attr[y], 0, x)
 
         dp = self._displaypos(y, x, slen)
         if (dp != None):
@@ -0,0 +1,215 @@
+#! /usr/bin/python
+#
+#    uipartition - A disk partitions/RAID/LVM setup tool
+#    Copyright (C) 2010-2015  MontaVista Software, LLC
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor,
+#      Boston, MA  02110-1301  USA
+
+
+#
+# The free space on a device that holds partitions, kept as a sorted
+# list of (start, end) extents of free sectors, end being one past the
+# last free sector.  Adding and removing partitions updates it in
+# place, so finding space for a new partition doesn't have to sort all
+# the partitions again.
+#
+# Partition tables may require some sectors before each partition (the
+# EBR of logical partitions), the "skip".  Those sectors are taken from
+# the free space along with the partition.
+#
+
+import bisect
+
+# Placement policies for place()
+FIRST_FIT = "first"
+BEST_FIT = "best"
+LARGEST = "largest"
+
+policies = (FIRST_FIT, BEST_FIT, LARGEST)
+
+# The smallest partition we will propose.
+_min_sects = 2
+
+class FreeExtents:
+    # Sectors lo up to (not including) hi may hold partitions.
+    def __init__(self, lo, hi, skip=0):
+        self.lo = lo
+        self.hi = hi
+        self.skip = skip
+        self.starts = [ ]
+        self.ends = [ ]
+        if (hi > lo):
+            self.starts.append(lo)
+            self.ends.append(hi)
+            pass
+        return
+
+    # A copy that can be changed without changing this one.
+    def copy(self):
+        f = FreeExtents(self.lo, self.hi, self.skip)
+        f.starts = list(self.starts)
+        f.ends = list(self.ends)
+        return f
+
+    # Return a list of the (start, end) free extents.
+    def extents(self):
+        return list(zip(self.starts, self.ends))
+
+    def totalFree(self):
+        return sum(self.ends) - sum(self.starts)
+
+    # Mark sectors start up to end as used.
+    def _take(self, start, end):
+        # The first extent that ends after start
+        i = bisect.bisect_right(self.ends, start)
+        while (i < len(self.starts) and self.starts[i] < end):
+            s = self.starts[i]
+            e = self.ends[i]
+            del self.starts[i]
+            del self.ends[i]
+            if (e > end):
+                self.starts.insert(i, end)
+                self.ends.insert(i, e)
+                pass
+            if (s < start):
+                self.starts.insert(i, s)
+                self.ends.insert(i, start)
+                i += 1
+                pass
+            pass
+        return
+
+    # Mark sectors start up to end as free.
+    def _give(self, start, end):
+        start = max(start, self.lo)
+        end = min(end, self.hi)
+        if (start >= end):
+            return
+        i = bisect.bisect_left(self.ends, start)
+        # Merge with any extents it touches or overlaps.
+        while (i < len(self.starts) and self.starts[i] <= end):
+            start = min(start, self.starts[i])
+            end = max(end, self.ends[i])
+            del self.starts[i]
+            del self.ends[i]
+            pass
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        return
+
+    # A partition was added.
+    def use(self, start, numsects):
+        self._take(start - self.skip, start + numsects)
+        return
+
+    # A partition was removed.
+    def release(self, start, numsects):
+        self._give(start - self.skip, start + numsects)
+        return
+
+    # Is sectors start up to end all free?
+    def isFree(self, start, end):
+        if (start >= end):
+            return True
+        i = bisect.bisect_right(self.starts, start) - 1
+        return i >= 0 and self.ends[i] >= end
+
+    # Can a partition go at start for numsects, including its skip?
+    def fits(self, start, numsects):
+        return self.isFree(start - self.skip, start + numsects)
+
+    # Find space for a partition.  align(v, round_up, start) aligns a
+    # position (start set) or a size.  If numsects is given, only places
+    # that can hold that many sectors are considered, otherwise any
+    # place that can hold a partition.  Returns (start, numsects) with
+    # the aligned start and size, the whole aligned free area if
+    # numsects isn't given, or None if there is no room.
+    def place(self, align, policy=FIRST_FIT, numsects=None):
+        if (numsects is not None):
+            numsects = align(numsects, True, False)
+            need = max(numsects, _min_sects)
+        else:
+            need = _min_sects
+            pass
+        found = None
+        for (s, e) in zip(self.starts, self.ends):
+            start = align(s + self.skip, True, True)
+            if (start >= e):
+                continue
+            room = align(e - start, False, False)
+            if (room < need):
+                continue
+            if (policy == FIRST_FIT):
+                found = (start, room)
+                break
+            if (found is None
+                or (policy == BEST_FIT and room < found[1])
+                or (policy == LARGEST and room > found[1])):
+                found = (start, room)
+                pass
+            pass
+        if (found is None):
+            return None
+        if (numsects is not None):
+            return (found[0], numsects)
+        return found
+
+    pass
+
+# Time proposals on a GPT disk full of partitions:
+#   python -m UIpartition.FreeExtents [npartitions]
+if __name__== '__main__':
+    import sys
+    import time
+    import random
+
+    nparts = 128
+    if (len(sys.argv) > 1):
+        nparts = int(sys.argv[1])
+        pass
+    align = 2048
+    def do_align(v, round_up, start):
+        mod = v % align
+        if (mod and round_up):
+            return v + align - mod
+        return v - mod
+
+    numsects = 4 * 1024 * 1024 * 1024 * 2
+    f = FreeExtents(34, numsects - 34)
+    parts = [ ]
+    start = time.time()
+    while (len(parts) < nparts):
+        size = random.randint(1, 64) * align * 16
+        r = f.place(do_align, random.choice(policies), size)
+        if (r is None):
+            break
+        f.use(r[0], r[1])
+        parts.append(r)
+        pass
+    t1 = time.time() - start
+    for (s, n) in random.sample(parts, len(parts) // 2):
+        f.release(s, n)
+        pass
+    start = time.time()
+    for i in range(0, 1000):
+        for p in policies:
+            f.place(do_align, p)
+            pass
+        pass
+    t2 = (time.time() - start) / 3000
+    print("%d partitions placed in %.2fms, %d free extents, %.1fus per"
+          " proposal" % (len(parts), t1 * 1000, len(f.starts), t2 * 1000000))
+    pass
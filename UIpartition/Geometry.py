@@ -0,0 +1,165 @@
+#! /usr/bin/python
+#
+#    uipartition - A disk partitions/RAID/LVM setup tool
+#    Copyright (C) 2010-2015  MontaVista Software, LLC
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor,
+#      Boston, MA  02110-1301  USA
+
+
+#
+# Get the size and block sizes of a block device with the block device
+# ioctls, or from sysfs if the device can't be opened (no permission,
+# no media, or the device node isn't there yet).
+#
+
+import os
+
+from . import SysBlock
+from . import System
+
+class GeometryErr(Exception):
+    def __init__(self, str):
+        self.s = str
+        return
+
+    def __str__(self):
+        return self.s
+
+    pass
+
+# From <linux/fs.h>
+BLKSSZGET = 0x1268
+BLKIOMIN = 0x1278
+BLKIOOPT = 0x1279
+BLKALIGNOFF = 0x127a
+BLKPBSZGET = 0x127b
+BLKGETSIZE64 = 0x80081272
+
+class Geometry:
+    # All the values are in bytes.
+    def __init__(self, size, sectsize, physsectsize, iomin, ioopt, alignoff):
+        self.size = size
+        self.sectsize = sectsize
+        self.physsectsize = physsectsize
+        self.iomin = iomin
+        self.ioopt = ioopt
+        self.alignoff = alignoff
+        return
+
+    # The number of logical sectors on the device
+    def numSects(self):
+        return self.size // self.sectsize
+
+    pass
+
+# Get the geometry with ioctls.  Raises OSError if the device can't be
+# opened or isn't a block device.
+def from_ioctl(devname):
+    dev = System.current.open_dev(devname)
+    try:
+        return Geometry(dev.ioctl_int(BLKGETSIZE64, "Q"),
+                        dev.ioctl_int(BLKSSZGET, "i"),
+                        dev.ioctl_int(BLKPBSZGET),
+                        dev.ioctl_int(BLKIOMIN),
+                        dev.ioctl_int(BLKIOOPT),
+                        dev.ioctl_int(BLKALIGNOFF, "i"))
+    finally:
+        dev.close()
+        pass
+    return None
+
+# Get the geometry from sysfs.  Returns None if the device isn't there.
+def from_sysfs(devname, bdev=None):
+    if (bdev is None):
+        bdev = SysBlock.lookup(devname)
+        if (bdev is None):
+            return None
+        pass
+    if (bdev.kind == "part"):
+        # The queue limits are on the whole device.
+        qpath = os.path.join(os.path.dirname(
+            System.current.realpath(bdev.path)), "queue")
+    else:
+        qpath = os.path.join(bdev.path, "queue")
+        pass
+
+    def attr(path, default):
+        v = SysBlock.read_attr(path)
+        try:
+            return int(v)
+        except (TypeError, ValueError):
+            return default
+        return default
+
+    physsectsize = attr(os.path.join(qpath, "physical_block_size"),
+                        bdev.sectsize)
+    return Geometry(bdev.size * 512, bdev.sectsize, physsectsize,
+                    attr(os.path.join(qpath, "minimum_io_size"),
+                         physsectsize),
+                    attr(os.path.join(qpath, "optimal_io_size"), 0),
+                    attr(os.path.join(bdev.path, "alignment_offset"), 0))
+
+# Get the geometry of the device any way we can.  Raises GeometryErr if
+# there is no way.
+def get(devname, bdev=None):
+    try:
+        return from_ioctl(devname)
+    except OSError as e:
+        err = e
+        pass
+    g = from_sysfs(devname, bdev)
+    if (g is None):
+        raise GeometryErr("Unable to get the size of %s: %s"
+                          % (devname, str(err)))
+    return g
+
+# Time the ioctls and sysfs against fdisk:
+#   python -m UIpartition.Geometry /dev/xxx ...
+if __name__== '__main__':
+    import sys
+    import time
+    import subprocess
+
+    count = 100
+    for dev in sys.argv[1:]:
+        for (name, f) in (("ioctl", from_ioctl), ("sysfs", from_sysfs)):
+            start = time.time()
+            try:
+                for i in range(0, count):
+                    g = f(dev)
+                    pass
+            except OSError as e:
+                print("%s %s: %s" % (dev, name, str(e)))
+                continue
+            t = (time.time() - start) / count
+            if (g is None):
+                print("%s %s: not found" % (dev, name))
+                continue
+            print("%s %s: %d sectors of %d (%d physical) iomin=%d ioopt=%d"
+                  " alignoff=%d, %.1fus"
+                  % (dev, name, g.numSects(), g.sectsize, g.physsectsize,
+                     g.iomin, g.ioopt, g.alignoff, t * 1000000))
+            pass
+        start = time.time()
+        try:
+            subprocess.run(("fdisk", "-l", dev), stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL)
+        except OSError as e:
+            print("%s fdisk: %s" % (dev, str(e)))
+            continue
+        print("%s fdisk: %.1fus" % (dev, (time.time() - start) * 1000000))
+        pass
+    pass
@@ -0,0 +1,199 @@
+#! /usr/bin/python
+#
+#    uipartition - A disk partitions/RAID/LVM setup tool
+#    Copyright (C) 2010-2015  MontaVista Software, LLC
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor,
+#      Boston, MA  02110-1301  USA
+
+
+#
+# Get the LVM volume groups, physical volumes, and logical volumes from
+# one "lvm fullreport" in JSON, instead of running vgs, pvs, and lvs and
+# splitting up their columns.
+#
+# The JSON has a "report" array with an entry for each VG holding
+# "vg", "pv", "lv", "pvseg" and "seg" arrays of records, all the values
+# are strings.  PVs that aren't in a VG come in an entry with an empty
+# "vg" array.  Sizes are asked for in sectors.
+#
+# LVM older than 2.02.158 doesn't have fullreport or JSON output, the
+# output of the old commands can be turned into the same records with
+# parse_text().
+#
+
+import json
+
+class LVMReportErr(Exception):
+    def __init__(self, str):
+        self.s = str
+        return
+
+    def __str__(self):
+        return self.s
+
+    pass
+
+# The command and options, VG names may be added to the end.  Only the
+# fields we use are asked for, the segment reports can't be turned off
+# so they get just one small field.
+fullreport_args = [ "fullreport", "--reportformat", "json",
+                    "--units", "s", "--nosuffix",
+                    "--configreport", "vg", "-o", "vg_name,vg_size,vg_free",
+                    "--configreport", "pv", "-o", "pv_name,vg_name",
+                    "--configreport", "lv", "-o", "lv_name,vg_name,lv_size",
+                    "--configreport", "pvseg", "-o", "pvseg_start",
+                    "--configreport", "seg", "-o", "seg_start" ]
+
+class VG:
+    def __init__(self, name, numsects, freesects):
+        self.name = name
+        self.numsects = numsects
+        self.freesects = freesects
+        return
+
+    pass
+
+class PV:
+    # vgname is "" if the PV isn't in a VG.
+    def __init__(self, devname, vgname):
+        self.devname = devname
+        self.vgname = vgname
+        return
+
+    pass
+
+class LV:
+    def __init__(self, name, vgname, numsects):
+        self.name = name
+        self.vgname = vgname
+        self.numsects = numsects
+        return
+
+    pass
+
+class Report:
+    def __init__(self):
+        self.vgs = [ ]
+        self.pvs = [ ]
+        self.lvs = [ ]
+        return
+
+    def findVG(self, name):
+        for vg in self.vgs:
+            if (vg.name == name):
+                return vg
+            pass
+        return None
+
+    def findLV(self, vgname, name):
+        for lv in self.lvs:
+            if (lv.vgname == vgname and lv.name == name):
+                return lv
+            pass
+        return None
+
+    pass
+
+def _sects(v):
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        raise LVMReportErr("Invalid LVM size: %s" % str(v))
+    return 0
+
+def _field(rec, name):
+    try:
+        return rec[name]
+    except (KeyError, TypeError):
+        raise LVMReportErr("LVM report is missing %s" % name)
+    return None
+
+# Parse the output of "lvm" with fullreport_args.  Anything else in the
+# JSON (like the command log from the lvm shell) is ignored.
+def parse(out):
+    try:
+        data = json.loads(out)
+        entries = data["report"]
+    except (ValueError, KeyError, TypeError):
+        raise LVMReportErr("Unable to parse the LVM report")
+    r = Report()
+    for e in entries:
+        for rec in e.get("vg", [ ]):
+            r.vgs.append(VG(_field(rec, "vg_name"),
+                            _sects(_field(rec, "vg_size")),
+                            _sects(_field(rec, "vg_free"))))
+            pass
+        for rec in e.get("pv", [ ]):
+            r.pvs.append(PV(_field(rec, "pv_name"), _field(rec, "vg_name")))
+            pass
+        for rec in e.get("lv", [ ]):
+            r.lvs.append(LV(_field(rec, "lv_name"), _field(rec, "vg_name"),
+                            _sects(_field(rec, "lv_size"))))
+            pass
+        pass
+    return r
+
+# Make a report from the output of "vgs", "pvs --separator :", and
+# "lvs", all with "--units s --noheadings --nosuffix" and the default
+# columns.  If vgnames is given, PVs in other VGs (or no VG) are left
+# out, since pvs can't be told which VGs to show.
+def parse_text(vgs_out, pvs_out, lvs_out, vgnames=None):
+    r = Report()
+    for l in vgs_out.split("\n"):
+        w = l.split()
+        if (len(w) < 7):
+            continue
+        r.vgs.append(VG(w[0], _sects(w[5]), _sects(w[6])))
+        pass
+    for l in pvs_out.split("\n"):
+        w = l.strip().split(":")
+        if (len(w) < 6):
+            continue
+        if (vgnames and w[1] not in vgnames):
+            continue
+        r.pvs.append(PV(w[0], w[1]))
+        pass
+    for l in lvs_out.split("\n"):
+        w = l.split()
+        if (len(w) < 4):
+            continue
+        r.lvs.append(LV(w[0], w[1], _sects(w[3])))
+        pass
+    return r
+
+# Print what LVM has:
+#   python -m UIpartition.LVMReport [vgname ...]
+if __name__== '__main__':
+    import sys
+    import time
+    import subprocess
+
+    start = time.time()
+    out = subprocess.run([ "lvm" ] + fullreport_args + sys.argv[1:],
+                         stdout=subprocess.PIPE, check=True).stdout
+    r = parse(out)
+    t = time.time() - start
+    for vg in r.vgs:
+        print("VG %-20s %12d %12d" % (vg.name, vg.numsects, vg.freesects))
+        pass
+    for pv in r.pvs:
+        print("PV %-20s %s" % (pv.devname, pv.vgname))
+        pass
+    for lv in r.lvs:
+        print("LV %-20s %-20s %12d" % (lv.name, lv.vgname, lv.numsects))
+        pass
+    print("%.1fms" % (t * 1000))
+    pass
@@ -0,0 +1,341 @@
+#! /usr/bin/python
+#
+#    uipartition - A disk partitions/RAID/LVM setup tool
+#    Copyright (C) 2010-2015  MontaVista Software, LLC
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor,
+#      Boston, MA  02110-1301  USA
+
+
+#
+# Run LVM commands through one "lvm" shell process instead of starting
+# a new lvm for each one, which saves the startup and config parsing
+# every time.
+#
+# Commands are written to the shell's stdin and their output is read
+# up to the next "lvm> " prompt.  The shell doesn't say whether a
+# command worked, so each command is given a --config that turns on
+# LVM's command log, restricted to the status, which LVM writes to the
+# file descriptor in LVM_REPORT_FD.  This is how lvmdbusd does it.
+# The --config also makes the reports JSON, and the status is the
+# log_ret_code in the "log" section.  Reports from display commands go
+# to the same file descriptor, in the same JSON object as the log, so
+# that object is returned as their output.  Text output from display
+# commands (vgs --noheadings and such) can't be had from the shell, so
+# those must be run on their own.
+#
+# If the shell can't be started, or doesn't behave the way we expect,
+# the session is marked unusable and call() raises LVMShellErr before
+# doing anything, so the caller can run the command itself.  If the
+# shell dies it is restarted for the next command.
+#
+
+import os
+import re
+import json
+import time
+import select
+import threading
+import subprocess
+
+from . import AsyncCmd
+
+class LVMShellErr(Exception):
+    def __init__(self, str):
+        self.s = str
+        return
+
+    def __str__(self):
+        return self.s
+
+    pass
+
+_prompt = b"lvm> "
+
+# Given to every command so the command's status gets reported.
+_status_config = ('report/output_format=json log/report_command_log=1'
+                  ' log/command_log_selection="log_type=status"'
+                  ' log/command_log_cols="log_ret_code"')
+
+# The status of a command that worked, ECMD_PROCESSED
+_ret_processed = 1
+
+# How long to wait for the shell to start up.
+_start_timeout = 30
+
+# Give up on the shell after it fails to start this many times.
+_max_start_failures = 3
+
+# Quote an argument the way the lvm shell splits them.  It only knows
+# about whole arguments in single or double quotes.
+def _quote(arg):
+    if (arg and not re.search(r"[\s'\"#]", arg)):
+        return arg
+    if ('"' not in arg):
+        return '"' + arg + '"'
+    if ("'" not in arg):
+        return "'" + arg + "'"
+    raise LVMShellErr("Can't quote %s for the lvm shell" % arg)
+
+class LVMShell:
+    def __init__(self, lvm="lvm"):
+        self.lvm = lvm
+        self.lock = threading.Lock()
+        self.prog = None
+        self.report_fd = None
+        self.start_failures = 0
+        self.usable = True
+        self.timed_out = False
+        return
+
+    def _stop(self):
+        if (self.prog is not None):
+            try:
+                self.prog.kill()
+            except OSError:
+                pass
+            self.prog.wait()
+            self.prog.stdin.close()
+            self.prog.stdout.close()
+            self.prog.stderr.close()
+            self.prog = None
+            pass
+        if (self.report_fd is not None):
+            os.close(self.report_fd)
+            self.report_fd = None
+            pass
+        return
+
+    def _start(self):
+        (self.report_fd, wfd) = os.pipe2(os.O_CLOEXEC)
+        env = dict(os.environ)
+        env["LC_ALL"] = "C"
+        env["LVM_REPORT_FD"] = str(wfd)
+        env["LVM_SUPPRESS_FD_WARNINGS"] = "1"
+        try:
+            self.prog = subprocess.Popen((self.lvm,), stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE,
+                                         stderr=subprocess.PIPE,
+                                         close_fds=True, pass_fds=(wfd,),
+                                         env=env)
+        except OSError as e:
+            os.close(wfd)
+            self._stop()
+            raise LVMShellErr("Unable to run %s: %s" % (self.lvm, str(e)))
+        os.close(wfd)
+        for f in (self.prog.stdout, self.prog.stderr):
+            os.set_blocking(f.fileno(), False)
+            pass
+        os.set_blocking(self.report_fd, False)
+        (out, err, report) = self._readResponse(_start_timeout)
+        if (out is None):
+            self._stop()
+            raise LVMShellErr("lvm shell didn't start: %s"
+                              % err.decode("utf8", "replace"))
+
+        # Make sure we can get the status of commands.  If not, this
+        # lvm is never going to work.
+        (out, err, status) = self._run([ "version" ], _start_timeout)
+        if (status != 0):
+            self._stop()
+            self.usable = False
+            raise LVMShellErr("lvm shell doesn't report status")
+        return
+
+    # Read the shell's output up to the next prompt.  Returns (out,
+    # err, report), out is None if the shell died or didn't prompt
+    # within the timeout, and timed_out is set for the latter.
+    def _readResponse(self, timeout):
+        self.timed_out = False
+        out = b""
+        err = b""
+        report = b""
+        fds = { self.prog.stdout.fileno(): "out",
+                self.prog.stderr.fileno(): "err",
+                self.report_fd: "report" }
+        end = None
+        if (timeout is not None):
+            end = time.time() + timeout
+            pass
+        while (not out.endswith(_prompt)):
+            wait = None
+            if (end is not None):
+                wait = end - time.time()
+                if (wait <= 0):
+                    self.timed_out = True
+                    return (None, err, report)
+                pass
+            (r, w, e) = select.select(list(fds), [ ], [ ], wait)
+            for fd in r:
+                try:
+                    data = os.read(fd, 65536)
+                except BlockingIOError:
+                    continue
+                if (not data):
+                    if (fds[fd] == "out"):
+                        # The shell is gone.
+                        return (None, err, report)
+                    del fds[fd]
+                    continue
+                if (fds[fd] == "out"):
+                    out += data
+                elif (fds[fd] == "err"):
+                    err += data
+                else:
+                    report += data
+                    pass
+                pass
+            pass
+
+        # Everything for the command was written before the prompt.
+        for fd in fds:
+            if (fds[fd] == "out"):
+                continue
+            try:
+                while True:
+                    data = os.read(fd, 65536)
+                    if (not data):
+                        break
+                    if (fds[fd] == "err"):
+                        err += data
+                    else:
+                        report += data
+                        pass
+                    pass
+                pass
+            except BlockingIOError:
+                pass
+            pass
+        return (out[0:-len(_prompt)], err, report)
+
+    # Run a command in the shell, returning (out, err, status), status
+    # is None if the shell died.
+    def _run(self, argv, timeout):
+        line = " ".join([ _quote(argv[0]), "--config", _quote(_status_config) ]
+                        + [ _quote(a) for a in argv[1:] ])
+        try:
+            self.prog.stdin.write(line.encode("utf8") + b"\n")
+            self.prog.stdin.flush()
+        except (OSError, ValueError):
+            return (b"", b"", None)
+        (out, err, report) = self._readResponse(timeout)
+        if (out is None):
+            return (out, err, None)
+
+        # readline echoes the command when it's not on a terminal.
+        echo = line.encode("utf8") + b"\n"
+        if (out.startswith(echo)):
+            out = out[len(echo):]
+            pass
+
+        # The status is the return code in the log section.  If it
+        # can't be found, call it a failure.
+        try:
+            data = json.loads(report.decode("utf8", "replace"))
+            status = int(data["log"][-1]["log_ret_code"])
+        except (ValueError, KeyError, IndexError, TypeError):
+            return (out, err, -1)
+        if (status == _ret_processed):
+            status = 0
+            pass
+
+        # A display command's report is returned with the log in it.
+        if (len(data) > 1):
+            out += report
+            pass
+        return (out, err, status)
+
+    # Run an LVM command, argv is the command and its arguments.
+    # Returns the output.  Raises AsyncCmd.CmdErr if it fails, and
+    # AsyncCmd.CmdTimeout (and the shell is restarted) if it takes
+    # longer than timeout seconds.  Raises LVMShellErr if the shell
+    # can't be used, without running the command.  If the shell dies
+    # while running the command and retry is set, it is run again in a
+    # new shell.
+    def call(self, argv, timeout=None, retry=False):
+        with self.lock:
+            while True:
+                if (not self.usable):
+                    raise LVMShellErr("lvm shell is not usable")
+                if (self.prog is None):
+                    try:
+                        self._start()
+                        self.start_failures = 0
+                    except LVMShellErr:
+                        self.start_failures += 1
+                        if (self.start_failures >= _max_start_failures):
+                            self.usable = False
+                            pass
+                        raise
+                    pass
+                (out, err, status) = self._run(argv, timeout)
+                if (status is not None):
+                    break
+                # The shell died or hung, the next command gets a new one.
+                timed_out = self.timed_out
+                self._stop()
+                if (timed_out):
+                    raise AsyncCmd.CmdTimeout(str(argv), timeout, "",
+                                              err.decode("utf8", "replace"))
+                if (not retry):
+                    raise AsyncCmd.CmdErr(str(argv), -1, "",
+                                          "lvm shell exited")
+                retry = False
+                pass
+            pass
+        out = out.decode("utf8", "replace")
+        err = err.decode("utf8", "replace")
+        if (status != 0):
+            raise AsyncCmd.CmdErr(str(argv), status, out, err)
+        return out
+
+    def close(self):
+        with self.lock:
+            self._stop()
+            pass
+        return
+
+    pass
+
+# Compare running LVM commands through the shell and one at a time:
+#   python -m UIpartition.LVMShell [-n count] command args...
+if __name__== '__main__':
+    import sys
+
+    count = 20
+    args = sys.argv[1:]
+    if (len(args) >= 2 and args[0] == "-n"):
+        count = int(args[1])
+        args = args[2:]
+        pass
+    if (not args):
+        args = [ "vgs" ]
+        pass
+
+    sh = LVMShell()
+    start = time.time()
+    for i in range(0, count):
+        sh.call(args)
+        pass
+    t1 = time.time() - start
+    start = time.time()
+    for i in range(0, count):
+        subprocess.run([ "lvm" ] + args, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+        pass
+    t2 = time.time() - start
+    print("%d x %s: shell %.3fs, separate processes %.3fs"
+          % (count, " ".join(args), t1, t2))
+    pass
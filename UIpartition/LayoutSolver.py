@@ -0,0 +1,528 @@
+#! /usr/bin/python
+#
+#    uipartition - A disk partitions/RAID/LVM setup tool
+#    Copyright (C) 2010-2015  MontaVista Software, LLC
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor,
+#      Boston, MA  02110-1301  USA
+
+#
+# Lay out partitions over a set of disks from a description of what is
+# wanted, instead of placing them one by one.
+#
+# A layout file has one line per thing wanted:
+#
+#   role size [option=value ...]
+#
+# The role is one of:
+#   fs   - A partition with a filesystem, needs fs= and usually mount=
+#   swap - A swap partition
+#   raid - A RAID1 array of partitions, each on a different disk.  It
+#          can hold a filesystem (fs= and mount=) or be put in a volume
+#          group (vg=).
+#   lvm  - A partition put in the volume group vg=
+#
+# The size is a number of bytes with an optional K, M, G, or T (powers
+# of 1024), a percentage of each disk's free space ("20%"), or a range
+# "min-max" for something that takes whatever space is left over up to
+# max.  Either end of a range may be left off.
+#
+# copies= gives how many disks get one, each on a different disk, or
+# "all" for every disk.  It defaults to 2 for raid and 1 otherwise.
+# Anything after a "#" is a comment.  For instance:
+#
+#   raid  512M  fs=ext4 mount=/boot
+#   swap  4G    copies=all
+#   lvm   1G-   copies=all vg=system
+#
+# The partitions are packed onto the disks with the biggest and the
+# most copies first, to the disks with the most free space.  Then the
+# space left on each disk is split between the ones that take what is
+# left over, RAID copies getting the same size.  Finally each disk's
+# partitions are put in the order they are in the file, if they still
+# fit that way.
+#
+
+import heapq
+
+from . import FreeExtents
+
+class LayoutErr(Exception):
+    def __init__(self, str):
+        self.s = str
+        return
+
+    def __str__(self):
+        return self.s
+
+    pass
+
+roles = ("fs", "swap", "raid", "lvm")
+
+# copies value for one on every disk
+ALL = 0
+
+_multipliers = { "": 1,
+                 "K": 1024,
+                 "M": 1024 * 1024,
+                 "G": 1024 * 1024 * 1024,
+                 "T": 1024 * 1024 * 1024 * 1024 }
+
+def _err(lineno, s):
+    return LayoutErr("Layout line %d: %s" % (lineno, s))
+
+def _parse_bytes(s, lineno):
+    s = s.upper()
+    mult = 1
+    if (s and s[-1] in _multipliers):
+        mult = _multipliers[s[-1]]
+        s = s[0:-1]
+        pass
+    try:
+        v = int(float(s) * mult)
+    except ValueError:
+        raise _err(lineno, "invalid size '%s'" % s)
+    if (v < 0):
+        raise _err(lineno, "invalid size '%s'" % s)
+    return v
+
+# One line of a layout
+class Request:
+    def __init__(self, role, lineno=0):
+        self.role = role
+        self.lineno = lineno
+        # Sizes in bytes, maxsize is None for no limit
+        self.minsize = 0
+        self.maxsize = None
+        self.percent = None
+        if (role == "raid"):
+            self.copies = 2
+        else:
+            self.copies = 1
+            pass
+        self.fstype = None
+        self.mount = None
+        self.vg = None
+        # Position in the layout
+        self.index = 0
+        return
+
+    def __str__(self):
+        if (self.role == "swap"):
+            return "swap"
+        if (self.role == "lvm"):
+            return "LVM " + self.vg
+        if (self.vg):
+            s = "LVM " + self.vg
+        elif (self.fstype):
+            s = self.fstype
+            if (self.mount):
+                s = self.mount + " " + s
+                pass
+        else:
+            s = ""
+            pass
+        if (self.role == "raid"):
+            s = ("RAID " + s).strip()
+            pass
+        return s
+
+    def setSize(self, s):
+        if (s.endswith("%")):
+            try:
+                self.percent = float(s[0:-1])
+            except ValueError:
+                raise _err(self.lineno, "invalid percentage '%s'" % s)
+            if (self.percent <= 0 or self.percent > 100):
+                raise _err(self.lineno, "invalid percentage '%s'" % s)
+            return
+        if ("-" in s):
+            (lo, hi) = s.split("-", 1)
+            if (lo):
+                self.minsize = _parse_bytes(lo, self.lineno)
+                pass
+            if (hi):
+                self.maxsize = _parse_bytes(hi, self.lineno)
+                if (self.maxsize < self.minsize):
+                    raise _err(self.lineno, "maximum is less than minimum")
+                pass
+            return
+        self.minsize = _parse_bytes(s, self.lineno)
+        self.maxsize = self.minsize
+        if (self.minsize == 0):
+            raise _err(self.lineno, "size is zero")
+        return
+
+    def setOption(self, o):
+        (k, sep, v) = o.partition("=")
+        if (not sep or not v):
+            raise _err(self.lineno, "expected option=value, got '%s'" % o)
+        if (k == "copies"):
+            if (v == "all"):
+                self.copies = ALL
+            else:
+                try:
+                    self.copies = int(v)
+                except ValueError:
+                    self.copies = -1
+                    pass
+                if (self.copies < 1):
+                    raise _err(self.lineno, "invalid copies '%s'" % v)
+                pass
+            pass
+        elif (k == "fs"):
+            self.fstype = v
+        elif (k == "mount"):
+            self.mount = v
+        elif (k == "vg"):
+            self.vg = v
+        else:
+            raise _err(self.lineno, "unknown option '%s'" % k)
+        return
+
+    # Make sure the options make sense for the role.
+    def check(self):
+        if (self.mount and not self.fstype):
+            raise _err(self.lineno, "mount= needs fs=")
+        if (self.role == "fs"):
+            if (not self.fstype):
+                raise _err(self.lineno, "fs needs fs=")
+            if (self.vg):
+                raise _err(self.lineno, "fs can't have vg=")
+            if (self.copies != 1):
+                raise _err(self.lineno, "fs can only have one copy, use raid")
+            pass
+        elif (self.role == "swap"):
+            if (self.fstype or self.vg):
+                raise _err(self.lineno, "swap can't have fs= or vg=")
+            pass
+        elif (self.role == "lvm"):
+            if (not self.vg):
+                raise _err(self.lineno, "lvm needs vg=")
+            if (self.fstype):
+                raise _err(self.lineno, "lvm can't have fs=")
+            pass
+        elif (self.role == "raid"):
+            if (self.copies == 1):
+                raise _err(self.lineno, "raid needs at least 2 copies")
+            if (self.fstype and self.vg):
+                raise _err(self.lineno, "raid can't have both fs= and vg=")
+            pass
+        return
+
+    # Does this take the space left over?
+    def grows(self):
+        return self.percent is None and self.maxsize != self.minsize
+
+    pass
+
+# Parse the text of a layout file into a list of Requests.
+def parse(text):
+    requests = [ ]
+    lineno = 0
+    for l in text.split("\n"):
+        lineno += 1
+        w = l.split("#", 1)[0].split()
+        if (len(w) == 0):
+            continue
+        if (w[0] not in roles):
+            raise _err(lineno, "unknown role '%s'" % w[0])
+        if (len(w) < 2):
+            raise _err(lineno, "no size given")
+        r = Request(w[0], lineno)
+        r.setSize(w[1])
+        for o in w[2:]:
+            r.setOption(o)
+            pass
+        r.check()
+        requests.append(r)
+        pass
+    if (len(requests) == 0):
+        raise LayoutErr("The layout is empty")
+    return requests
+
+# A partition the solver put on a disk
+class Placement:
+    def __init__(self, request, disk, start, numsects):
+        self.request = request
+        self.disk = disk
+        self.start = start
+        self.numsects = numsects
+        return
+
+    pass
+
+# A disk (or anything else that holds partitions) to lay out on.  free
+# is its FreeExtents, which is not changed, and align(v, round_up,
+# start) aligns values for it like FreeExtents.place() wants.  maxparts
+# is how many more partitions its table can hold, or None for no limit.
+# label is the name of a new partition table to write on it first, if
+# it doesn't have one yet.
+class Disk:
+    def __init__(self, name, sectsize, free, align, maxparts=None,
+                 label=None):
+        self.name = name
+        self.sectsize = sectsize
+        self.startfree = free
+        self.free = free.copy()
+        self.align = align
+        self.maxparts = maxparts
+        self.label = label
+        self.places = [ ]
+        self.growing = [ ]
+        self.index = 0
+        return
+
+    def full(self):
+        return (self.maxparts is not None
+                and len(self.places) + len(self.growing) >= self.maxparts)
+
+    # The sectors wanted for a request that doesn't grow
+    def want(self, r):
+        if (r.percent is not None):
+            n = int(self.startfree.totalFree() * r.percent / 100)
+            return self.align(n, False, False)
+        n = (r.minsize + self.sectsize - 1) // self.sectsize
+        return self.align(n, True, False)
+
+    def take(self, r, start, numsects):
+        self.free.use(start, numsects)
+        self.places.append(Placement(r, self, start, numsects))
+        return
+
+    # Put the partitions in layout order, if they fit that way.
+    def reorder(self):
+        f = self.startfree.copy()
+        starts = [ ]
+        places = sorted(self.places, key=lambda pl: pl.request.index)
+        for pl in places:
+            a = f.place(self.align, FreeExtents.FIRST_FIT, pl.numsects)
+            if (a is None):
+                return
+            f.use(a[0], a[1])
+            starts.append(a[0])
+            pass
+        for (pl, start) in zip(places, starts):
+            pl.start = start
+            pass
+        self.free = f
+        self.places = places
+        return
+
+    pass
+
+class Plan:
+    def __init__(self, disks, requests):
+        self.disks = disks
+        self.requests = requests
+        return
+
+    # The placements for a request, one per disk it is on.
+    def placements(self, r):
+        return [ pl for d in self.disks for pl in d.places
+                 if pl.request is r ]
+
+    # Text describing the plan.  conv(disk, numsects) converts a start
+    # or size to a string.
+    def describe(self, conv=None):
+        if (conv is None):
+            conv = lambda d, v: "%ds" % v
+            pass
+        s = ""
+        for d in self.disks:
+            if (len(d.places) == 0):
+                continue
+            if (d.label):
+                s += "%s (new %s partition table):\n" % (d.name, d.label)
+            else:
+                s += "%s:\n" % d.name
+                pass
+            for pl in sorted(d.places, key=lambda pl: pl.start):
+                s += ("  %13s %13s  %s\n"
+                      % (conv(d, pl.start), conv(d, pl.numsects),
+                         str(pl.request)))
+                pass
+            pass
+        return s
+
+    pass
+
+def _ncopies(r, disks):
+    if (r.copies == ALL):
+        return len(disks)
+    return r.copies
+
+def _no_room(r, n):
+    if (n > 1):
+        return _err(r.lineno, "no room for %s on %d different disks"
+                    % (str(r), n))
+    return _err(r.lineno, "no room for %s" % str(r))
+
+# Put copies of a fixed size request on the disks with the most free
+# space that it fits on.
+def _place_fixed(disks, r):
+    n = _ncopies(r, disks)
+    cands = [ ]
+    for d in disks:
+        if (d.full()):
+            continue
+        numsects = d.want(r)
+        if (numsects <= 0):
+            continue
+        a = d.free.place(d.align, FreeExtents.BEST_FIT, numsects)
+        if (a is None):
+            continue
+        cands.append((-d.free.totalFree(), d.index, d, a))
+        pass
+    if (len(cands) < n):
+        raise _no_room(r, n)
+    for (free, i, d, a) in heapq.nsmallest(n, cands):
+        d.take(r, a[0], a[1])
+        pass
+    return
+
+# Pick the disks for a request that takes what is left, the ones with
+# the fewest others doing that and then the most free space.
+def _assign_growing(disks, r):
+    n = _ncopies(r, disks)
+    cands = [ ]
+    for d in disks:
+        if (d.full() or d.free.place(d.align, FreeExtents.LARGEST) is None):
+            continue
+        cands.append((len(d.growing), -d.free.totalFree(), d.index, d))
+        pass
+    if (len(cands) < n):
+        raise _no_room(r, n)
+    chosen = [ c[3] for c in heapq.nsmallest(n, cands) ]
+    for d in chosen:
+        d.growing.append(r)
+        pass
+    return chosen
+
+# Give a growing request its share of the biggest free area on each of
+# its disks.  RAID copies are all the same size, the smallest share.
+def _place_growing(r, chosen):
+    sizes = [ ]
+    for d in chosen:
+        a = d.free.place(d.align, FreeExtents.LARGEST)
+        room = 0
+        if (a is not None):
+            room = a[1]
+            pass
+        share = d.align(room // len(d.growing), False, False) * d.sectsize
+        if (r.maxsize is not None and share > r.maxsize):
+            share = r.maxsize
+            pass
+        sizes.append(share)
+        pass
+    if (r.role == "raid"):
+        sizes = [ min(sizes) ] * len(sizes)
+        pass
+    for (d, size) in zip(chosen, sizes):
+        numsects = d.align(size // d.sectsize, False, False)
+        a = None
+        if (numsects > 0 and numsects * d.sectsize >= r.minsize):
+            a = d.free.place(d.align, FreeExtents.LARGEST, numsects)
+            pass
+        if (a is None):
+            raise _no_room(r, len(chosen))
+        d.growing.remove(r)
+        d.take(r, a[0], a[1])
+        pass
+    return
+
+# Lay the requests out on the disks.  Returns a Plan, or raises
+# LayoutErr if they don't fit.
+def solve(disks, requests):
+    if (len(disks) == 0):
+        raise LayoutErr("No disks to lay out on")
+    i = 0
+    for d in disks:
+        d.index = i
+        i += 1
+        pass
+    biggest = max([ d.startfree.totalFree() * d.sectsize for d in disks ])
+    i = 0
+    for r in requests:
+        r.index = i
+        i += 1
+        if (_ncopies(r, disks) > len(disks)):
+            raise _err(r.lineno, "%d copies, but there are only %d disks"
+                       % (r.copies, len(disks)))
+        pass
+
+    def bigger_first(r):
+        if (r.percent is not None):
+            size = biggest * r.percent / 100
+        else:
+            size = r.minsize
+            pass
+        return (-_ncopies(r, disks), -size, r.index)
+
+    fixed = sorted([ r for r in requests if not r.grows() ], key=bigger_first)
+    # The ones with a maximum go first, so what they leave goes to the
+    # ones without.
+    growing = sorted([ r for r in requests if r.grows() ],
+                     key=lambda r: (r.maxsize is None, r.maxsize or 0,
+                                    r.index))
+    for r in fixed:
+        _place_fixed(disks, r)
+        pass
+    chosen = [ _assign_growing(disks, r) for r in growing ]
+    for (r, c) in zip(growing, chosen):
+        _place_growing(r, c)
+        pass
+    for d in disks:
+        d.reorder()
+        pass
+    return Plan(disks, requests)
+
+# Time a layout over a lot of identical empty disks:
+#   python -m UIpartition.LayoutSolver [ndisks]
+if __name__== '__main__':
+    import sys
+    import time
+
+    ndisks = 128
+    if (len(sys.argv) > 1):
+        ndisks = int(sys.argv[1])
+        pass
+    align = 2048
+    def do_align(v, round_up, start):
+        mod = v % align
+        if (mod and round_up):
+            return v + align - mod
+        return v - mod
+
+    layout = """
+        raid  1G       fs=ext4 mount=/boot
+        raid  64G      vg=system
+        swap  8G       copies=all
+        fs    10%      fs=xfs mount=/scratch
+        lvm   100G-2T  copies=all vg=data
+    """
+    numsects = 4 * 1024 * 1024 * 1024 * 2
+    start = time.time()
+    requests = parse(layout)
+    disks = [ Disk("/dev/sd%d" % i, 512,
+                   FreeExtents.FreeExtents(34, numsects - 34), do_align, 128)
+              for i in range(0, ndisks) ]
+    plan = solve(disks, requests)
+    t = time.time() - start
+    nparts = sum([ len(d.places) for d in disks ])
+    print(plan.describe().split("/dev/sd2:")[0], end="")
+    print("%d disks, %d partitions laid out in %.2fms"
+          % (ndisks, nparts, t * 1000))
+    pass
@@ -0,0 +1,166 @@
+#! /usr/bin/python
+#
+#    uipartition - A disk partitions/RAID/LVM setup tool
+#    Copyright (C) 2010-2015  MontaVista Software, LLC
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor,
+#      Boston, MA  02110-1301  USA
+
+
+#
+# Get the state of md RAID arrays from sysfs.  Each md device has an
+# "md" directory with the array's attributes and a "dev-<name>"
+# directory for each member, so everything about all the arrays can be
+# read in one pass without going through /proc/mdstat.
+#
+
+import os
+
+from . import SysBlock
+from . import System
+
+# array_state values for an md device with no running array.
+# "inactive" still has members, "clear" has nothing at all.
+_stopped_states = ("clear", "inactive")
+
+def _read_int(path, default=0):
+    v = SysBlock.read_attr(path)
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return default
+    return default
+
+class MDMember:
+    def __init__(self, name, slot, state):
+        # Name of the block device, without the /dev/
+        self.name = name
+        self.devname = "/dev/" + name
+
+        # Position in the array, None for spares and failed devices.
+        self.slot = slot
+
+        # A list of "in_sync", "faulty", "spare", "write_mostly", etc.
+        self.state = state
+        return
+
+    def faulty(self):
+        return "faulty" in self.state
+
+    pass
+
+class MDArray:
+    def __init__(self, name, path):
+        self.name = name
+        self.devname = "/dev/" + name
+        mdpath = os.path.join(path, "md")
+        self.array_state = SysBlock.read_attr(os.path.join(mdpath,
+                                                           "array_state"))
+        if (self.array_state in _stopped_states):
+            self.level = "inactive"
+        else:
+            self.level = SysBlock.read_attr(os.path.join(mdpath, "level"))
+            pass
+        self.raid_disks = _read_int(os.path.join(mdpath, "raid_disks"))
+        # In bytes, 0 for levels without chunks
+        self.chunk_size = _read_int(os.path.join(mdpath, "chunk_size"))
+        # "idle", "resync", "recover", "check", etc., None for levels
+        # without redundancy.
+        self.sync_action = SysBlock.read_attr(os.path.join(mdpath,
+                                                           "sync_action"))
+        self.members = self._readMembers(mdpath)
+        return
+
+    def _readMembers(self, mdpath):
+        members = [ ]
+        try:
+            names = System.current.listdir(mdpath)
+        except OSError:
+            return members
+        for n in names:
+            if (not n.startswith("dev-")):
+                continue
+            dpath = os.path.join(mdpath, n)
+            try:
+                name = os.path.basename(System.current.readlink(
+                    os.path.join(dpath, "block")))
+            except OSError:
+                # Removed while we were looking
+                continue
+            slot = _read_int(os.path.join(dpath, "slot"), None)
+            state = SysBlock.read_attr(os.path.join(dpath, "state"))
+            if (state):
+                state = state.split(",")
+            else:
+                state = [ ]
+                pass
+            members.append(MDMember(name, slot, state))
+            pass
+
+        # Keep the members in slot order, spares and failed ones last.
+        members.sort(key=lambda m: (m.slot is None, m.slot, m.name))
+        return members
+
+    pass
+
+# Return the MDArray for the md device (without the /dev/), or None if
+# there is no array on it.
+def read(name):
+    path = os.path.join(SysBlock.sysblock, name)
+    if (not System.current.isdir(os.path.join(path, "md"))):
+        return None
+    md = MDArray(name, path)
+    if (md.array_state is None or md.array_state == "clear"):
+        return None
+    return md
+
+# Return a dictionary of MDArrays by name for the given md device names,
+# or all the md devices if names is None.
+def scan(names=None):
+    if (names is None):
+        try:
+            names = [ n for n in System.current.listdir(SysBlock.sysblock)
+                      if n.startswith("md") ]
+        except OSError:
+            return { }
+        pass
+    mds = { }
+    for n in names:
+        md = read(n)
+        if (md is not None):
+            mds[n] = md
+            pass
+        pass
+    return mds
+
+# Show the arrays, and how long it took to find them:
+#   python -m UIpartition.MDArray
+if __name__== '__main__':
+    import time
+
+    start = time.time()
+    mds = scan()
+    t = time.time() - start
+    for n in sorted(mds):
+        md = mds[n]
+        print("%-8s %-8s %-10s disks=%d chunk=%d sync=%s"
+              % (n, md.level, md.array_state, md.raid_disks, md.chunk_size,
+                 md.sync_action))
+        for m in md.members:
+            print("    %-10s slot=%s %s" % (m.name, m.slot, ",".join(m.state)))
+            pass
+        pass
+    print("%d arrays in %.1fms" % (len(mds), t * 1000))
+    pass
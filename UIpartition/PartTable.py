@@ -0,0 +1,362 @@
+#! /usr/bin/python
+#
+#    uipartition - A disk partitions/RAID/LVM setup tool
+#    Copyright (C) 2010-2015  MontaVista Software, LLC
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor,
+#      Boston, MA  02110-1301  USA
+
+#
+# Read MBR and GPT partition tables directly from a device.
+#
+# The partitions are returned in the same form as the "partitions"
+# array in "parted -j print" output in sector units, so the partitioner
+# can process them the same way, but without running parted.  parted is
+# still used to write the tables.
+#
+
+import os
+import struct
+import uuid
+import zlib
+
+from . import System
+
+class PartTableErr(Exception):
+    def __init__(self, str):
+        self.s = str
+        return
+
+    def __str__(self):
+        return self.s
+
+    pass
+
+# Size of the standard GPT partition entry array, 128 entries of 128
+# bytes.
+_gpt_std_entries_size = 128 * 128
+
+# Don't follow EBR chains forever if they are corrupt.
+_max_logical = 128
+
+# MBR partition types for extended partitions
+_mbr_extended = (0x05, 0x0f, 0x85)
+
+# Flags parted reports for MBR partition types
+_mbr_type_flags = {
+    0x82: "swap",
+    0x8e: "lvm",
+    0xfd: "raid",
+    0xef: "esp",
+    0x12: "diag",
+    0x27: "diag",
+    0x0c: "lba",
+    0x0e: "lba",
+    0x0f: "lba",
+    0x11: "hidden",
+    0x14: "hidden",
+    0x16: "hidden",
+    0x17: "hidden",
+    0x1b: "hidden",
+    0x1c: "hidden",
+    0x1e: "hidden",
+}
+
+# Flags parted reports for GPT partition types
+_gpt_type_flags = {
+    "0657FD6D-A4AB-43C4-84E5-0933C84B4F4F": "swap",
+    "A19D880F-05FC-4D3B-A006-743F0F84911E": "raid",
+    "E6D6D379-F507-44C2-A23C-238F2A3DF928": "lvm",
+    "C12A7328-F81F-11D2-BA4B-00A0C93EC93B": "esp",
+    "21686148-6449-6E6F-744E-656564454649": "bios_grub",
+    "DE94BBA4-06D1-4D40-A16A-BFD50179D6AC": "diag",
+    "E3C9E316-0B5C-4DB8-817D-F92DF00215AE": "msftres",
+}
+
+# GPT attribute bits
+_gpt_attr_legacy_boot = 1 << 2
+
+def _part(num, start, numsects, ptype, flags):
+    return { "number": num,
+             "start": "%ds" % start,
+             "end": "%ds" % (start + numsects - 1),
+             "size": "%ds" % numsects,
+             "type": ptype,
+             "flags": flags }
+
+class _Reader:
+    def __init__(self, devname, sectsize):
+        self.sectsize = sectsize
+        self.dev = System.current.open_dev(devname)
+        return
+
+    def read(self, lba, nsects):
+        n = nsects * self.sectsize
+        b = self.dev.pread(n, lba * self.sectsize)
+        if (len(b) != n):
+            raise PartTableErr("Short read at sector %d" % lba)
+        return b
+
+    def close(self):
+        self.dev.close()
+        return
+
+    pass
+
+def _crc_ok(data, crcoff, crc):
+    data = data[0:crcoff] + b"\0\0\0\0" + data[crcoff+4:]
+    return (zlib.crc32(data) & 0xffffffff) == crc
+
+# Parse a GPT header at the beginning of hdr.  Returns the header fields
+# we need, or None if it isn't valid.
+def _parse_gpt_header(hdr):
+    if (hdr[0:8] != b"EFI PART"):
+        return None
+    (hsize, hcrc) = struct.unpack_from("<II", hdr, 12)
+    if (hsize < 92 or hsize > len(hdr)):
+        return None
+    if (not _crc_ok(hdr[0:hsize], 16, hcrc)):
+        return None
+    alternate_lba = struct.unpack_from("<Q", hdr, 32)[0]
+    (entries_lba, nentries, entsize, entcrc) = struct.unpack_from("<QIII",
+                                                                  hdr, 72)
+    if (entsize < 128 or nentries > 65536):
+        return None
+    return (alternate_lba, entries_lba, nentries, entsize, entcrc)
+
+def _parse_gpt_entries(ents, nentries, entsize):
+    partitions = [ ]
+    for i in range(0, nentries):
+        e = ents[i * entsize:(i + 1) * entsize]
+        if (e[0:16] == b"\0" * 16):
+            continue
+        typeuuid = str(uuid.UUID(bytes_le=e[0:16])).upper()
+        (first, last, attrs) = struct.unpack_from("<QQQ", e, 32)
+        name = e[56:128].decode("utf-16-le", "replace").split("\0")[0]
+        flags = [ ]
+        f = _gpt_type_flags.get(typeuuid)
+        if (f == "esp"):
+            flags.append("boot")
+            pass
+        if (f):
+            flags.append(f)
+            pass
+        if (attrs & _gpt_attr_legacy_boot):
+            flags.append("legacy_boot")
+            pass
+        p = _part(i + 1, first, last - first + 1, "primary", flags)
+        p["type-uuid"] = typeuuid
+        p["uuid"] = str(uuid.UUID(bytes_le=e[16:32])).upper()
+        p["name"] = name
+        partitions.append(p)
+        pass
+    return partitions
+
+# Return the partitions from the entries a GPT header points to, or
+# None if the entries are corrupt.
+def _gpt_partitions(r, head, h):
+    ss = r.sectsize
+    (alternate_lba, entries_lba, nentries, entsize, entcrc) = h
+    size = nentries * entsize
+    if (entries_lba * ss + size <= len(head)):
+        # The usual case, the entries were in the first read.
+        ents = head[entries_lba * ss:entries_lba * ss + size]
+    else:
+        ents = r.read(entries_lba, (size + ss - 1) // ss)[0:size]
+        pass
+    if ((zlib.crc32(ents) & 0xffffffff) != entcrc):
+        return None
+    return _parse_gpt_entries(ents, nentries, entsize)
+
+def _read_gpt(r, head, numsects):
+    ss = r.sectsize
+    h = _parse_gpt_header(head[ss:2 * ss])
+    partitions = None
+    if (h is not None):
+        partitions = _gpt_partitions(r, head, h)
+        pass
+    if (partitions is not None):
+        return partitions
+
+    # The primary header or its entries are bad, try the backup.  It
+    # is where the primary header says, or at the end of the disk.
+    backup = None
+    if (h is not None and 1 < h[0] < numsects):
+        lba = h[0]
+    else:
+        lba = numsects - 1
+        pass
+    if (lba > 1):
+        backup = _parse_gpt_header(r.read(lba, 1))
+        pass
+    if (backup is not None):
+        partitions = _gpt_partitions(r, head, backup)
+        pass
+    if (partitions is not None):
+        return partitions
+    if (h is None and backup is None):
+        return None
+    raise PartTableErr("GPT partition entries are corrupt")
+
+def _mbr_entries(sect):
+    ents = [ ]
+    for i in range(0, 4):
+        ents.append(struct.unpack_from("<B3xB3xII", sect, 446 + i * 16))
+        pass
+    return ents
+
+# Does this look like a DOS partition table, and not a filesystem boot
+# sector?
+def _is_mbr(sect):
+    if (sect[510:512] != b"\x55\xaa"):
+        return False
+    if (sect[82:87] == b"FAT32" or sect[54:57] == b"FAT"
+        or sect[3:11] == b"NTFS    "):
+        return False
+    for (status, ptype, start, nsects) in _mbr_entries(sect):
+        if (status not in (0, 0x80)):
+            return False
+        pass
+    return True
+
+def _mbr_flags(status, ptype):
+    flags = [ ]
+    if (status == 0x80):
+        flags.append("boot")
+        pass
+    if (ptype in _mbr_type_flags):
+        flags.append(_mbr_type_flags[ptype])
+        pass
+    return flags
+
+def _read_mbr(r, head):
+    partitions = [ ]
+    ext = None
+    num = 0
+    for (status, ptype, start, nsects) in _mbr_entries(head):
+        num += 1
+        if (ptype == 0 or nsects == 0):
+            continue
+        if (ptype in _mbr_extended):
+            p = _part(num, start, nsects, "extended",
+                      _mbr_flags(status, ptype))
+            ext = start
+        else:
+            p = _part(num, start, nsects, "primary",
+                      _mbr_flags(status, ptype))
+            pass
+        p["type-id"] = "0x%02x" % ptype
+        partitions.append(p)
+        pass
+
+    # Follow the chain of EBRs for the logical partitions.
+    ebr = ext
+    num = 5
+    seen = set()
+    while (ebr is not None and num < 5 + _max_logical and ebr not in seen):
+        seen.add(ebr)
+        sect = r.read(ebr, 1)
+        if (sect[510:512] != b"\x55\xaa"):
+            break
+        ents = _mbr_entries(sect)
+        (status, ptype, start, nsects) = ents[0]
+        if (ptype != 0 and nsects != 0):
+            p = _part(num, ebr + start, nsects, "logical",
+                      _mbr_flags(status, ptype))
+            p["type-id"] = "0x%02x" % ptype
+            partitions.append(p)
+            num += 1
+            pass
+        (status, ptype, start, nsects) = ents[1]
+        if (ptype in _mbr_extended and start != 0):
+            ebr = ext + start
+        else:
+            ebr = None
+            pass
+        pass
+    return partitions
+
+# Partition tables we recognize but don't handle, so the disk shows as
+# having an unknown table and not an empty one.
+def _is_other_label(head, ss):
+    if (head[508:510] == b"\xda\xbe"):
+        return True # Sun
+    if (head[0:2] == b"ER" and head[512:514] in (b"PM", b"TS")):
+        return True # Mac
+    if (head[0:4] == b"\x0b\xe5\xa9\x41"):
+        return True # SGI
+    for off in (ss, ss + 64):
+        if (head[off:off+4] == b"\x57\x45\x56\x82"):
+            return True # BSD
+        pass
+    return False
+
+# Read the partition table from the device.  Returns (label,
+# partitions), where label is "msdos", "gpt", "unknown" for a table we
+# don't handle, or None if there is no partition table.  partitions is
+# None unless the label is "msdos" or "gpt".  Raises OSError or
+# PartTableErr on failures.
+def read(devname, sectsize, numsects):
+    r = _Reader(devname, sectsize)
+    try:
+        # Read the MBR, the GPT header, and a standard size GPT entry
+        # array all at once.
+        nsects = 2 + _gpt_std_entries_size // sectsize
+        if (nsects > numsects):
+            nsects = numsects
+            pass
+        head = r.read(0, nsects)
+        if (len(head) < 512):
+            return (None, None)
+
+        protective = False
+        if (head[510:512] == b"\x55\xaa"):
+            for (status, ptype, start, n) in _mbr_entries(head):
+                if (ptype == 0xee):
+                    protective = True
+                    pass
+                pass
+            pass
+        if (protective or head[sectsize:sectsize+8] == b"EFI PART"):
+            partitions = _read_gpt(r, head, numsects)
+            if (partitions is not None):
+                return ("gpt", partitions)
+            pass
+        if (_is_mbr(head) and not protective):
+            return ("msdos", _read_mbr(r, head))
+        if (_is_other_label(head, sectsize)):
+            return ("unknown", None)
+        return (None, None)
+    finally:
+        r.close()
+        pass
+    return (None, None)
+
+if __name__== '__main__':
+    import sys
+    import json
+    for dev in sys.argv[1:]:
+        size = os.stat(dev).st_size
+        if (size == 0):
+            fd = os.open(dev, os.O_RDONLY)
+            size = os.lseek(fd, 0, os.SEEK_END)
+            os.close(fd)
+            pass
+        (label, partitions) = read(dev, 512, size // 512)
+        print(json.dumps({ "disk": { "path": dev, "label": label,
+                                     "partitions": partitions } },
+                         indent=2))
+        pass
+    pass
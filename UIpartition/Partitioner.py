@@ -33,14 +33,35 @@ from . import CursesKeyMap
 from . import Popup
 from . import PopupEditVals
 from . import PopupList
+from . import Superblock
+from . import SysBlock
+from . import PartTable
+from . import ProbeCache
+from . import Screen
+from . import Wipe
+from . import Progress
+from . import AsyncCmd
+from . import LVMShell
+from . import LVMReport
+from . import MDArray
+from . import Geometry
+from . import FreeExtents
+from . import System
+from . import LayoutSolver
 import copy
 from . import DebugLog
-import subprocess
 import tempfile
+import io
 import os
 
 import sys
 import traceback
+import functools
+import threading
+import concurrent.futures
+import shutil
+import time
+import select
 import json
 
 # Dummy object for passing around info
@@ -65,62 +86,309 @@ _namelen = 15 # Including indention
 _sizelen = 13 # A size or start/end location, good for 100+ terabytes of sectors
 _typelen = 6  # filesystem/partition type
 
-class CmdErr(Exception):
-    def __init__(self, cmd, returncode, out, errout):
-        self.cmd = cmd
-        self.returncode = returncode
-        self.out = out
-        self.errout = errout
-        return
+CmdErr = AsyncCmd.CmdErr
 
-    def __str__(self):
-        return ("Error %d:%s\n%s\n%s"
-                % (self.returncode, self.cmd, self.out, self.errout))
+# Timeout, in seconds, for commands that just get information.  If
+# these hang something is badly wrong with a device.
+_query_timeout = 120
 
-    pass
+# The main loop waits for keys and events with select(), but curses
+# only gives some things (like a window resize) through getch().  So
+# don't wait longer than this, in seconds, before calling getch().
+getch_interval = 0.5
 
-def _call_cmd(cmd):
-    prog = subprocess.Popen(cmd,
-                            stdin=None, stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE, close_fds=True)
-    (out, err) = prog.communicate()
-    out = out.decode("utf8")
-    err = err.decode("utf8")
-    if (prog.returncode != 0):
-        raise CmdErr(str(cmd), prog.returncode, out, err)
-    return out
+# Run a command and return its output.  All the external commands are
+# run through System.current, so commands on the same device don't step
+# on each other and independent ones can be run together with its
+# call_all().  device names what the command works on, only one command
+# at a time is run on a device.  If timeout is given the command is
+# killed after that many seconds.
+def _call_cmd(cmd, device=None, timeout=None):
+    return System.current.call(cmd, device, timeout)
+
+# Like _call_cmd(), but pass the output to progress.output() as it
+# comes in, and call progress.poll() every so often while waiting, see
+# System.stream().
+def _stream_cmd(cmd, progress):
+    return System.current.stream(cmd, progress)
 
 # Default unit is sectors
 def _call_parted(dev, cmds, unit="s"):
     return _call_cmd(["parted", "-msj", "--align=none", dev, "unit " + unit]
-                     + cmds)
+                     + cmds, device=dev)
     
 def _call_mdadm(dev, cmd, opts=[]):
-    return _call_cmd(["mdadm", cmd, dev] + opts)
+    return _call_cmd(["mdadm", cmd, dev] + opts, device=dev)
+
+# Run an LVM command, through the system's lvm shell if it has one and
+# it works.  If not, LVM changes take a global lock anyway, so they are
+# all run as if on one device, and the display commands can run
+# together.  The display commands are safe to run again if the shell
+# dies.  Not every command has its own program (fullreport doesn't), so
+# lvm is run with the command.
+def _call_lvm(argv, device="lvm", timeout=None, retry=False):
+    shell = System.current.lvm_shell
+    if (shell is not None):
+        try:
+            return shell.call(argv, timeout, retry)
+        except LVMShell.LVMShellErr:
+            pass
+        pass
+    return _call_cmd(["lvm"] + argv, device=device, timeout=timeout)
 
 def _call_lvmcmd(cmd, opts = []):
     # Add -y to avoid interactive questions.
-    return _call_cmd([cmd, "-y"] + opts)
+    return _call_lvm([cmd, "-y"] + opts)
 
-def _call_lvmdispcmd(cmd, opts = []):
+def _lvmdispcmd(cmd, opts = []):
     opts = ["--units", "s", "--noheadings", "--nosuffix"] + opts
-    return _call_lvmcmd(cmd, opts)
+    return [cmd, "-y"] + opts
+
+# Run a list of LVM display commands (from _lvmdispcmd()) all at once,
+# returning the outputs in the same order, or the exception for
+# commands that failed.  Their output is text, which the lvm shell
+# can't give back (see LVMShell), so they are always run on their own.
+def _call_lvmdispcmds(cmds):
+    return System.current.call_all([ (c, None) for c in cmds ],
+                                    timeout=_query_timeout)
+
+# Get the VGs, PVs, and LVs from LVM as an LVMReport.Report, just for
+# the given VG names if there are any.  If LVM is too old for
+# fullreport, vgs, pvs, and lvs are used instead.
+def _lvm_report(vgnames=[]):
+    try:
+        out = _call_lvm(LVMReport.fullreport_args + vgnames, device=None,
+                        timeout=_query_timeout, retry=True)
+        return LVMReport.parse(out)
+    except (CmdErr, LVMReport.LVMReportErr):
+        pass
+    results = _call_lvmdispcmds([ _lvmdispcmd("vgs", vgnames),
+                                  _lvmdispcmd("pvs", ["--separator", ":"]),
+                                  _lvmdispcmd("lvs", vgnames) ])
+    for r in results:
+        if (isinstance(r, Exception)):
+            raise r
+        pass
+    (vgs_out, pvs_out, lvs_out) = results
+    return LVMReport.parse_text(vgs_out, pvs_out, lvs_out, vgnames)
+
+def _rereadpt_cmd(devname):
+    return ["blockdev", "--rereadpt", devname]
 
 def _reread_partition_table(devname):
-    return _call_cmd(["blockdev", "--rereadpt", devname])
+    return _call_cmd(_rereadpt_cmd(devname), device=devname,
+                     timeout=_query_timeout)
+
+# Wipes go straight to the device, so they can't be done on a machine
+# that isn't this one (see System).
+def _check_wipe(devname):
+    if (not System.current.real):
+        raise PartitionerErr("Not wiping %s, it isn't on this machine"
+                             % devname)
+    return
 
-def _get_file_info(devname):
-    return _call_cmd(("file", "--special-files", "--dereference", devname))
+# Remove all the signatures from the device.
+def _wipe_dev(devname):
+    _check_wipe(devname)
+    try:
+        Wipe.wipe(devname)
+    except Wipe.WipeErr as e:
+        raise PartitionerErr(str(e))
+    finally:
+        _dev_written(devname)
+        pass
+    return
 
-def _get_dev_uuid(devname):
+# Remove any md superblocks from the device.
+def _wipe_md(devname):
+    _check_wipe(devname)
     try:
-        uuid = _call_cmd(("blkid", "-o", "value", "-s", "UUID", 
-                          devname)).strip()
-    except CmdErr:
-        uuid = None
+        Wipe.wipe_md(devname)
+    except Wipe.WipeErr as e:
+        raise PartitionerErr(str(e))
+    finally:
+        _dev_written(devname)
         pass
-    return uuid
-    
+    return
+
+# Convert the \xNN escapes udev uses in /dev/disk/by-* names back into
+# the characters.
+def _udev_unescape(s):
+    if ("\\x" not in s):
+        return s
+    out = ""
+    i = 0
+    while (i < len(s)):
+        if (s[i:i+2] == "\\x" and i + 4 <= len(s)):
+            try:
+                out += chr(int(s[i+2:i+4], 16))
+                i += 4
+                continue
+            except ValueError:
+                pass
+            pass
+        out += s[i]
+        i += 1
+        pass
+    return out
+
+# Parse "blkid -o export" output into a list of dictionaries, one per
+# device.
+def _parse_blkid_export(out):
+    devs = [ ]
+    d = { }
+    for l in out.split("\n"):
+        l = l.strip()
+        if (not l):
+            if (d):
+                devs.append(d)
+                d = { }
+                pass
+            continue
+        kv = l.split("=", 1)
+        if (len(kv) == 2):
+            d[kv[0]] = kv[1]
+            pass
+        pass
+    if (d):
+        devs.append(d)
+        pass
+    return devs
+
+# An index of the UUID, LABEL, and PARTUUID of all the block devices on
+# the system.  It is built once per scan from the udev /dev/disk/by-*
+# links, or from a single blkid run if udev doesn't maintain those, so
+# looking up a device doesn't require running blkid for it.  Devices
+# are indexed by device number so that any name for the device
+# (/dev/dm-N, /dev/mapper/vg-lv, /dev/vg/lv) finds it.
+#
+# When the partitioner writes to a device its entry is invalidated, and
+# the next lookup for it runs blkid on just that device, since udev may
+# not have caught up with the change yet.
+class DevIndex:
+    bydirs = (("UUID", "/dev/disk/by-uuid"),
+              ("LABEL", "/dev/disk/by-label"),
+              ("PARTUUID", "/dev/disk/by-partuuid"))
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.info = None
+        self.dirty = set()
+        return
+
+    # Throw away the current info and read it all in again.
+    def rescan(self):
+        info = { }
+        if (System.current.isdir(self.bydirs[0][1])):
+            for (tag, d) in self.bydirs:
+                try:
+                    names = System.current.listdir(d)
+                except OSError:
+                    continue
+                for n in names:
+                    rdev = _dev_number(os.path.join(d, n))
+                    if (rdev is None):
+                        continue
+                    info.setdefault(rdev, { })[tag] = _udev_unescape(n)
+                    pass
+                pass
+            pass
+        else:
+            try:
+                out = _call_cmd(("blkid", "-o", "export"))
+            except CmdErr:
+                out = ""
+                pass
+            for d in _parse_blkid_export(out):
+                rdev = _dev_number(d.get("DEVNAME", ""))
+                if (rdev is not None):
+                    info[rdev] = d
+                    pass
+                pass
+            pass
+
+        with self.lock:
+            self.info = info
+            self.dirty = set()
+            pass
+        return
+
+    # The given device has been written, don't trust the index for it
+    # any more.
+    def invalidate(self, devname):
+        rdev = _dev_number(devname)
+        if (rdev is not None):
+            with self.lock:
+                self.dirty.add(rdev)
+                pass
+            pass
+        return
+
+    # Remember a value for a device found some other way.
+    def setTag(self, devname, tag, value):
+        rdev = _dev_number(devname)
+        if (rdev is not None):
+            with self.lock:
+                if (self.info is not None):
+                    self.info.setdefault(rdev, { })[tag] = value
+                    pass
+                pass
+            pass
+        return
+
+    # Return the value of the given tag (UUID, LABEL, PARTUUID) for the
+    # device, or None if it doesn't have one.
+    def lookup(self, devname, tag):
+        if (self.info is None):
+            self.rescan()
+            pass
+        rdev = _dev_number(devname)
+        if (rdev is None):
+            return None
+        with self.lock:
+            refetch = rdev in self.dirty
+            pass
+        if (refetch):
+            try:
+                out = _call_cmd(("blkid", "-o", "export", devname))
+                devs = _parse_blkid_export(out)
+            except CmdErr:
+                devs = [ ]
+                pass
+            with self.lock:
+                if (devs):
+                    self.info[rdev] = devs[0]
+                elif (rdev in self.info):
+                    del self.info[rdev]
+                    pass
+                self.dirty.discard(rdev)
+                pass
+            pass
+        with self.lock:
+            return self.info.get(rdev, { }).get(tag)
+
+    pass
+
+# Return the device number of the given block device, or None if it
+# doesn't exist.
+def _dev_number(devname):
+    return System.current.dev_number(devname)
+
+_dev_index = DevIndex()
+
+# Probe results saved from previous runs
+_probe_cache = ProbeCache.ProbeCache()
+
+def _get_dev_uuid(devname):
+    return _dev_index.lookup(devname, "UUID")
+
+# Called when the partitioner writes something to a device that might
+# change its UUID or label.
+def _dev_written(devname):
+    _dev_index.invalidate(devname)
+    _probe_cache.invalidate(devname)
+    return
+
 #
 # A superclass for unit display
 #
@@ -136,13 +404,15 @@ class Units:
             pass
         return s
 
-    def convFromStr(self, p, device, s):
+    # start is set if the value is a position on the device and not a
+    # size, see alignValue().
+    def convFromStr(self, p, device, s, start=False):
         s = s.strip()
         if (s[-1] == self.unitdisplay):
             s = s[0:-1]
             pass
         v = int(float(s) * self.divider) / device.sectsize
-        return device.alignValue(p, v)
+        return device.alignValue(p, v, start=start)
     
     pass
 
@@ -152,7 +422,7 @@ class SectorUnits(Units):
     def convToStr(self, device, val):
         return str(val)
 
-    def convFromStr(self, p, device, s):
+    def convFromStr(self, p, device, s, start=False):
         return int(s)
     
     def allocNext(self):
@@ -222,12 +492,52 @@ class WorkObj:
 
     pass
 
+# Long running commands that write to a device, like making a
+# filesystem.  processWork() runs these in parallel with a JobRunner, so
+# they don't touch the display or the partitioner, they just have the
+# commands to run.  If wipe is set, the old signatures are removed from
+# the device first.
+class JobObj(WorkObj):
+    def __init__(self, device, desc, cmds, wipe=False):
+        WorkObj.__init__(self, None, device, write_op=True)
+        self.desc = desc
+        self.cmds = cmds
+        self.wipe = wipe
+        return
+
+    def __str__(self):
+        return "%s on %s" % (self.desc, self.data.devname)
+
+    # Run the commands, in the calling thread.  If progress is given,
+    # it is a Progress.Progress that is kept up to date.
+    def run(self, ioprio=None, progress=None):
+        if (self.wipe):
+            _wipe_dev(self.data.devname)
+            pass
+        n = 0
+        for cmd in self.cmds:
+            if (progress):
+                progress.startCmd(cmd, n, len(self.cmds))
+                pass
+            if (ioprio):
+                cmd = ioprio + cmd
+                pass
+            if (progress):
+                _stream_cmd(cmd, progress)
+            else:
+                _call_cmd(cmd)
+                pass
+            n += 1
+            pass
+        return
+
+    pass
+
 #
 # A superclass for various filesystem types, also used for unset filesystem
 #
 class FSType(DestSubtype):
     name = ""
-    file_str = "no match here"
     opts = [ ]
 
     def __init__(self):
@@ -236,9 +546,6 @@ class FSType(DestSubtype):
     def __str__(self):
         return self.name
 
-    def match(self, s):
-        return self.file_str in s
-
     def setup(self, parent, p, line, col):
         self.parent = parent
         self.col = col
@@ -281,16 +588,10 @@ class FSType(DestSubtype):
         if (not self.name or not self.parent.changed or p.in_reread):
             # Don't do the empty fstype or if unchanged
             return ()
-        return (WorkObj(self, device, write_op=True), )
-
-    def work(self, p, device):
-        p.redraw()
-        p.popupInfo("Making %s filesystem on %s" % (self.name, device.devname))
-
-        # Make sure the existing filesystem check doesn't fail the mkfs
-        _call_cmd(["dd", "if=/dev/zero", "of=" + device.devname, "count=100"])
-        _call_cmd(["mkfs." + self.name,] + self.opts + [device.devname, ])
-        return
+        # Wipe it so the existing filesystem check doesn't fail the mkfs
+        cmds = [ ["mkfs." + self.name,] + self.opts + [device.devname, ] ]
+        return (JobObj(device, "%s filesystem" % self.name, cmds,
+                       wipe=True), )
 
     def newInst(self):
         return FSType()
@@ -299,7 +600,6 @@ class FSType(DestSubtype):
 
 class Ext2FS(FSType):
     name = "ext2"
-    file_str = "ext2 filesystem"
     
     def newInst(self):
         return Ext2FS()
@@ -308,7 +608,6 @@ class Ext2FS(FSType):
 
 class Ext3FS(FSType):
     name = "ext3"
-    file_str = "ext3 filesystem"
     
     def newInst(self):
         return Ext3FS()
@@ -317,7 +616,6 @@ class Ext3FS(FSType):
 
 class Ext4FS(FSType):
     name = "ext4"
-    file_str = "ext4 filesystem"
     
     def newInst(self):
         return Ext4FS()
@@ -326,7 +624,6 @@ class Ext4FS(FSType):
 
 class XFSFS(FSType):
     name = "xfs"
-    file_str = "XFS filesystem"
     opts = [ "-f", ]
     
     def newInst(self):
@@ -336,7 +633,6 @@ class XFSFS(FSType):
 
 class VFATFS(FSType):
     name = "vfat"
-    file_str = "mkdosfs"
     
     def newInst(self):
         return VFATFS()
@@ -677,6 +973,7 @@ class LVMValue(DestValue):
         p.setObj(line, col, self)
         if (self.do_init):
             _call_lvmcmd("pvcreate", ["-ff", self.parent.parent.devname])
+            _dev_written(self.parent.parent.devname)
             self.do_init = False
             pass
         if (self.vg):
@@ -694,6 +991,7 @@ class LVMValue(DestValue):
     def shutdown(self, p):
         self.removeFromVG(p)
         _call_lvmcmd("pvremove", [self.parent.parent.devname,])
+        _dev_written(self.parent.parent.devname)
 
         # Break circular dependencies
         del self.parent
@@ -797,28 +1095,19 @@ class SwapDest(DestType):
         return
 
     def needsWork(self, p, device):
-        if (self.changed or p.output_fstab_str):
-            return (WorkObj(self, device, write_op=self.changed), )
-        return ()
-
-    def work(self, p, device):
-        if (p.output_fstab_str):
-            p.output_fstab.write(device.getMountName()
-                                 + "\tnone\tswap\tsw\t0\t0\n")
+        work = ()
+        if (self.changed and not p.in_reread):
+            work += (JobObj(device, "swap filesystem",
+                            [ ["mkswap", "-f", device.devname] ]), )
             pass
-        if (self.changed):
-            p.redraw()
-            p.popupInfo("Making swap filesystem on %s" % (device.devname))
-            # Can't use _call_cmd because of the popupInfoDone
-            cmd = ("mkswap", "-f", device.devname)
-            prog = subprocess.Popen(cmd,
-                                    stdin=None, stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE, close_fds=True)
-            (out, err) = prog.communicate()
-            p.popupInfoDone()
-            if (prog.returncode != 0):
-                raise CmdErr(str(cmd), prog.returncode, out, err)
+        if (p.output_fstab_str):
+            work += (WorkObj(self, device), )
             pass
+        return work
+
+    def work(self, p, device):
+        p.output_fstab.write(device.getMountName()
+                             + "\tnone\tswap\tsw\t0\t0\n")
         return
 
     def newInst(self, do_init=True):
@@ -946,29 +1235,31 @@ class RAIDLabel(Label):
 
     def Command(self, p, c):
         if (c == "A"):
-            # Find the first unused MD number
-            craids = [ ]
-            rline = p.findLine(self)
-            for l in range(rline + 1, p.numLines()):
-                o = p.getObj(l)
-                if (o.__class__ != RAID):
-                    break
-                # Get number from "/dev/mdN"
-                craids.append(int(o.devname[7:]))
-                pass
-            craids.sort()
-            i = 0
-            for l in craids:
-                if (l != i):
-                    break
-                i += 1
-                pass
-
-            RAID(p, "/dev/md%d" % i)
-            pass
+            self.newRAID(p)
         else:
             return False
         return True
+
+    # Add a RAID with the first unused MD number.
+    def newRAID(self, p):
+        craids = [ ]
+        rline = p.findLine(self)
+        for l in range(rline + 1, p.numLines()):
+            o = p.getObj(l)
+            if (o.__class__ != RAID):
+                break
+            # Get number from "/dev/mdN"
+            craids.append(int(o.devname[7:]))
+            pass
+        craids.sort()
+        i = 0
+        for l in craids:
+            if (l != i):
+                break
+            i += 1
+            pass
+
+        return RAID(p, "/dev/md%d" % i)
     
     pass
 
@@ -1169,7 +1460,8 @@ class InvalidPartitionTable(PartitionTableBase):
     name = "<inv>"
 
     def write(self, devname):
-        _call_cmd(("dd", "if=/dev/zero", "of=" + devname, "count=100"))
+        # This gets the backup GPT at the end, too.
+        _wipe_dev(devname)
 
         # Tell the kernel to reread the partition table, thus invalidating it
         _reread_partition_table(devname)
@@ -1234,6 +1526,14 @@ def _alloc_dest(s, do_init=True):
     raise PartitionerErr("Invalid destination: " + s)
 
 
+# Optimal alignment, in bytes, for devices that don't give one.
+_default_align = 1024 * 1024
+
+# What the footer shows for the placement policies
+_placement_names = { FreeExtents.FIRST_FIT: "First",
+                     FreeExtents.BEST_FIT: "Best",
+                     FreeExtents.LARGEST: "Largest" }
+
 #
 # Superclass for classes that own partitions.
 #
@@ -1253,6 +1553,7 @@ class PartitionOwner:
         self.sectsize = sectsize
         self.partitions = []
         self.partitiondevname = pdevname
+        self.initFreeExtents()
 
         p.setSizeColumn(self, line, _size_col, numsects)
 
@@ -1265,33 +1566,63 @@ class PartitionOwner:
         p.setSizeColumn(self, line, self.free_col, self.freesects)
         return
 
+    # Set up the index of free areas from the table, size, and
+    # partitions.
+    def initFreeExtents(self):
+        self.free = FreeExtents.FreeExtents(
+            self.partitionOffset + self.table.reservedBeginning,
+            self.partitionOffset + self.numsects - self.table.reservedEnd,
+            self.table.reservedSkip)
+        for part in self.partitions:
+            self.free.use(part.sectstart, part.numsects)
+            pass
+        return
+
     # Called when free space is added or removed
     def addToFreeSpace(self, p, line, size):
         self.freesects += size
         p.setSizeColumn(self, line, self.free_col, self.freesects)
         return
 
-    # Get the minimum and optimal partition alignments
+    # Get the minimum and optimal partition alignments, in sectors, and
+    # the sector the alignment starts from, from the device's queue
+    # limits in sysfs.
     def getAlignInfo(self):
-        # Get minimum and optimal alignment for a disk.
-        out = _call_cmd(("blockdev", "--getiomin", self.devname))
-        self.minalign = int(out.strip()) / 512
+        cached = _probe_cache.get(self.devname, "align")
+        if (cached is not None):
+            (self.minalign, self.optalign, self.alignoff) = cached
+            return
+
+        g = Geometry.from_sysfs(self.devname)
+        if (g is None):
+            # Not there yet (a RAID being created), use the defaults.
+            g = Geometry.Geometry(0, self.sectsize, self.sectsize,
+                                  self.sectsize, 0, 0)
+            pass
+        self.minalign = max(g.iomin, g.physsectsize) // self.sectsize
         if (self.minalign == 0):
             self.minalign = 1
             pass
-        out = _call_cmd(("blockdev", "--getioopt", self.devname))
-        self.optalign = int(out.strip()) / 512
+        self.optalign = g.ioopt // self.sectsize
         if (self.optalign == 0):
-            # Align to Windows standards, 1MiB
-            self.optalign = 1024000 / self.sectsize
+            # Align to Windows standards, 1MiB, if that works with the
+            # minimum.  This is what parted does.
+            self.optalign = _default_align // self.sectsize
+            if (self.optalign % self.minalign != 0):
+                self.optalign = self.minalign
+                pass
             pass
         if (self.optalign < self.minalign):
             self.optalign = self.minalign
             pass
+        # The offset is -1 if the device can't be aligned at all.
+        self.alignoff = max(g.alignoff, 0) // self.sectsize
+        _probe_cache.put(self.devname, "align",
+                         [ self.minalign, self.optalign, self.alignoff ])
         return
 
-    def _doAlignV(self, v, alignv, round_up):
-        mod = v % alignv
+    def _doAlignV(self, v, alignv, round_up, offset):
+        mod = (v - offset) % alignv
         if (mod != 0):
             if (round_up):
                 v += alignv - mod
@@ -1301,11 +1632,18 @@ class PartitionOwner:
             pass
         return v
 
-    def alignValue(self, p, v, round_up=True):
+    # Align a size, or a position on the device if start is set.  Only
+    # positions are moved by the alignment offset.
+    def alignValue(self, p, v, round_up=True, start=False):
+        if (start):
+            offset = self.alignoff
+        else:
+            offset = 0
+            pass
         if (p.align_opt):
-            v = self._doAlignV(v, self.optalign, round_up)
+            v = self._doAlignV(v, self.optalign, round_up, offset)
         else:
-            v = self._doAlignV(v, self.minalign, round_up)
+            v = self._doAlignV(v, self.minalign, round_up, offset)
             pass
         return v
 
@@ -1314,26 +1652,13 @@ class PartitionOwner:
             line = p.findLine(self)
             pass
         self.partitions.append(part)
+        self.free.use(part.sectstart, part.numsects)
 
         # Recalculate free space
         self.freesects -= part.numsects
         p.setSizeColumn(self, line, self.free_col, self.freesects)
         return
 
-    # Get a list of free areas on the disk.  Note that it returns one more
-    # than the end.
-    def getUsedAreas(self):
-        used = [ ]
-        for i in self.partitions:
-            used.append( (i.sectstart, i.sectstart + i.numsects) )
-            pass
-        if (self.table.reservedEnd != 0):
-            used.append( (self.numsects - self.table.reservedEnd,
-                          self.numsects) )
-            pass
-        used.sort()
-        return used
-
     def printInfo(self, p, extra=None):
         s = (("More information for %s:\n"
              + "Sector size:       %d")
@@ -1342,6 +1667,9 @@ class PartitionOwner:
             s += (("\nMinimum alignment: %d\n"
                   + "Optimum alignment: %d")
                   % (self.minalign, self.optalign))
+            if (self.alignoff):
+                s += "\nAlignment offset:  %d" % self.alignoff
+                pass
             pass
         uuid = _get_dev_uuid(self.devname)
         if (uuid):
@@ -1358,32 +1686,13 @@ class PartitionOwner:
             raise PartitionerErr("Disk already has %d partitions"
                                  % self.table.maxPartitions)
 
-        # Get a sorted list of used space so we can search
-        used = self.getUsedAreas()
-
-        # Find the first hole and use it for the initial size
-        csect = (self.partitionOffset + self.table.reservedBeginning
-                 + self.table.reservedSkip)
-        found = False
-        for i in used:
-            csect = self.alignValue(p, csect)
-            # Make sure we can fit an entire alignment section in, thus the
-            # second alignValue below.
-            if (i[0] > self.alignValue(p, csect+1)):
-                found = True
-                sectstart = csect
-                numsects = i[0] - csect
-                break
-            csect = i[1] + self.table.reservedSkip
-            pass
-        if (not found):
-            csect = self.alignValue(p, csect)
-            if ((csect - self.partitionOffset) >= self.numsects):
-                raise PartitionerErr("No more space on disk")
-            sectstart = csect
-            numsects = self.numsects - (csect - self.partitionOffset)
-            pass
-        numsects = self.alignValue(p, numsects, round_up=False)
+        # Use the free area the placement policy picks for the initial
+        # values.
+        area = self.free.place(functools.partial(self.alignValue, p),
+                               p.placement)
+        if (area is None):
+            raise PartitionerErr("No more space on disk")
+        (sectstart, numsects) = area
 
         o = Obj()
         o.extended = extended
@@ -1422,7 +1731,7 @@ class PartitionOwner:
         
         p = o.p
         try:
-            sectstart = p.units.convFromStr(p, self, vals[0])
+            sectstart = p.units.convFromStr(p, self, vals[0], start=True)
         except:
             p.popupWin("Starting sector '" + vals[0]
                        + "' was not a valid number, please"
@@ -1449,7 +1758,7 @@ class PartitionOwner:
                        self.continueEdit, o)
             return
 
-        o.sectstart = self.alignValue(p, sectstart)
+        o.sectstart = self.alignValue(p, sectstart, start=True)
         o.numsects = self.alignValue(p, numsects)
 
         if (sectstart != o.sectstart or numsects != o.numsects):
@@ -1463,60 +1772,47 @@ class PartitionOwner:
         del sectstart
         del numsects
 
-        extended = o.extended
-
-        # Add the partition
-        line = p.findLine(self)
-        kernel_update_worked = True
-        if (extended):
-            try:
-                _call_parted(self.partitiondevname,
-                             ["mkpart extended %d %d"
-                              % (o.sectstart,
-                                 o.sectstart + o.numsects - 1),])
-            except CmdErr as e:
-                if ("Error informing the kernel" in e.out):
-                    kernel_update_worked = False
-                else:
-                    raise
-                pass
+        if (o.extended):
+            ptype = "extended"
         else:
-            try:
-                _call_parted(self.partitiondevname,
-                             ["mkpart %s %d %d"
-                              % (self.subpartitions,
-                                 o.sectstart,
-                                 o.sectstart + o.numsects - 1),])
-            except CmdErr as e:
-                if ("Error informing the kernel" in e.out):
-                    kernel_update_worked = False
-                else:
-                    raise
-                pass
+            ptype = self.subpartitions
             pass
-
-        self.partitionUpdatedHook()
-
-        # We used to have parted return the added partition id (which
-        # itself required a hack, since for some odd reason parted
-        # didn't do this by default) and use that to add the proper
-        # information.  This had problems, though, since adding a
-        # partition with existing content could cause udev to
-        # instantiate RAIDs and LVMs, and the partitioner wouldn't
-        # know about this.  So to work around both of these problem,
-        # just reread everything when a partition is added.  It's
-        # slow, but it's reliable.
-        p.reRead()
-
-        if (not kernel_update_worked):
+        if (not self.makePartitions(p, ((o.sectstart, o.numsects),), ptype)):
             p.popupWin("Error informing the kernel about the partitions"
-                       + " update for " + name + ", so linux will not"
-                       + " know about the changes.  You will need to"
+                       + " update for " + self.devname + ", so linux will"
+                       + " not know about the changes.  You will need to"
                        + " restart the system to pick up the partition"
                        + " changes.")
             pass
         return
 
+    # Create partitions of type ptype in the given (start, numsects)
+    # areas with one run of parted.  Returns False if the kernel
+    # couldn't be told about them.
+    def makePartitions(self, p, areas, ptype):
+        kernel_update_worked = True
+        try:
+            _call_parted(self.partitiondevname,
+                         [ "mkpart %s %d %d" % (ptype, start,
+                                                start + numsects - 1)
+                           for (start, numsects) in areas ])
+        except CmdErr as e:
+            if ("Error informing the kernel" in e.out):
+                kernel_update_worked = False
+            else:
+                raise
+            pass
+
+        self.partitionUpdatedHook()
+
+        # Adding a partition with existing content can cause udev to
+        # instantiate RAIDs and LVMs, so we can't just add the
+        # partition.  Re-read this device's table and pick up anything
+        # new that was built on it; if that doesn't work out, this
+        # will fall back to re-reading everything.
+        p.reReadOwner(self)
+        return kernel_update_worked
+
     def delCmd(self, p, part):
         i = 0
         for x in self.partitions:
@@ -1534,12 +1830,15 @@ class PartitionOwner:
 
         _call_parted(self.partitiondevname, ["rm %d" % part.num,])
 
+        # Partitions added after the initial scan are not in line order
+        # in self.partitions, so look the line up.
         del self.partitions[i]
-        p.deleteLine(line + i + 1)
+        p.deleteLine(p.findLine(part))
         
         self.partitionUpdatedHook()
 
         # Recalculate free space
+        self.free.release(part.sectstart, part.numsects)
         self.freesects += part.numsects
         p.setSizeColumn(self, line, self.free_col, self.freesects)
 
@@ -1568,18 +1867,12 @@ class PartitionOwner:
         end = sectstart + numsects - 1
         if (end > (self.partitionOffset + self.numsects)):
             return "goes past end"
-        
-        used = self.getUsedAreas()
-        for u in used:
-            if (end < u[0]):
-                continue
-            if (sectstart >= u[1]):
-                if (sectstart < u[1] + self.table.reservedSkip):
-                    return ("This partition requires a reserved area before"
-                            + " the beginning")
-                continue
+
+        if (not self.free.isFree(sectstart, sectstart + numsects)):
             return "is inside another used area"
-        
+        if (not self.free.fits(sectstart, numsects)):
+            return ("This partition requires a reserved area before"
+                    + " the beginning")
         return None
     
     pass
@@ -1607,7 +1900,9 @@ class Disk(LineEntry, PartitionOwner):
             self.table = None
             pass
 
-        if devname.startswith("/dev/nvme"):
+        # Like the kernel, put a "p" between the disk name and partition
+        # number if the disk name ends in a digit (nvme0n1p1, mmcblk0p1).
+        if devname[-1].isdigit():
             self.split = "p"
         else:
             self.split = ""
@@ -1654,12 +1949,14 @@ class Disk(LineEntry, PartitionOwner):
         if (table is None):
             self.freesects = self.numsects
             del self.partitions
+            del self.free
         else:
             table.setup(self, p, p.lineOf(0, self), 6)
 
             self.freesects = (self.numsects - self.table.reservedBeginning
                               - self.table.reservedEnd)
             self.partitions = []
+            self.initFreeExtents()
             line -= 1
             p.setSizeColumn(self, line, self.free_col, self.freesects)
             pass
@@ -1685,11 +1982,11 @@ class Disk(LineEntry, PartitionOwner):
         elif (c == "I"):
             identity = None
             try:
-                if (os.path.exists("/lib/udev/scsi_id")):
+                if (System.current.exists("/lib/udev/scsi_id")):
                     scsi_id = "/lib/udev/scsi_id"
-                elif (os.path.exists("/lib64/udev/scsi_id")):
+                elif (System.current.exists("/lib64/udev/scsi_id")):
                     scsi_id = "/lib64/udev/scsi_id"
-                elif (os.path.exists("/lib32/udev/scsi_id")):
+                elif (System.current.exists("/lib32/udev/scsi_id")):
                     scsi_id = "/lib32/udev/scsi_id"
                 else:
                     identity = "\nUnable to find scsi_id cmd, so no info"
@@ -1820,6 +2117,7 @@ class ExtendedPartition(LineEntry, PartitionOwner):
         self.num = num
         self.minalign = parent.minalign
         self.optalign = parent.optalign
+        self.alignoff = parent.alignoff
         self.sectsize = parent.sectsize
         coloff = parent.coloffset + 1
         namesize = _namelen - coloff
@@ -2040,12 +2338,14 @@ class RAID(LineEntry, PartitionOwner):
         if (table is None):
             self.freesects = self.numsects
             del self.partitions
+            del self.free
         else:
             table.setup(self, p, p.lineOf(0, self), 6)
 
             self.freesects = (self.numsects - self.table.reservedBeginning
                               - self.table.reservedEnd)
             self.partitions = []
+            self.initFreeExtents()
             line -= 1
             p.setSizeColumn(self, line, self.free_col, self.freesects)
             pass
@@ -2063,14 +2363,18 @@ class RAID(LineEntry, PartitionOwner):
         self.sectsize = sectsize # FIXME = sector size change?
         p.setSizeColumn(self, line, 3, numsects)
         if (self.table):
+            self.initFreeExtents()
             self.addToFreeSpace(p, line, diff)
             pass
         return
 
     def querySize(self, p):
         line = p.findLine(self)
-        (numsects, sectsize, err) = _disk_info_from_fdisk(self.devname)
-        if (numsects is None):
+        try:
+            g = Geometry.get(self.devname)
+            numsects = g.numSects()
+            sectsize = g.sectsize
+        except Geometry.GeometryErr:
             # It doesn't exist, just set it to zero
             numsects = 0
             sectsize = 512
@@ -2154,6 +2458,10 @@ class RAID(LineEntry, PartitionOwner):
             opts.append(vol.devname)
             pass
         _call_mdadm(self.devname, "--create", opts)
+        for vol in self.vols:
+            _dev_written(vol.devname)
+            pass
+        _dev_written(self.devname)
         self.running = True
         self.querySize(p)
         return
@@ -2178,6 +2486,8 @@ class RAID(LineEntry, PartitionOwner):
                         ["--force", "--level=%s" % str(level),
                          "--metadata=0.90", "--run", "--raid-devices=1",
                          vol.devname])
+            _dev_written(vol.devname)
+            _dev_written(self.devname)
             self.running = True
         else:
             _call_mdadm(self.devname, "--grow",
@@ -2207,7 +2517,7 @@ class RAID(LineEntry, PartitionOwner):
                 self.setNumSects(p, p.findLine(self), 0, 512)
                 self.running = False
                 # Make sure the disk doesn't come back
-                _call_cmd(["mdadm", "--zero-superblock", vol.devname])
+                _wipe_md(vol.devname)
             else:
                 _call_mdadm(r, "--fail", [vol.devname,])
                 _call_mdadm(r, "--remove", [vol.devname,])
@@ -2215,7 +2525,7 @@ class RAID(LineEntry, PartitionOwner):
                             ["--force", "--raid-devices=%d" % (nvols - 1)])
                 if (str(self.level) != "multipath"):
                     # Make sure the disk doesn't come back
-                    _call_cmd(["mdadm", "--zero-superblock", vol.devname])
+                    _wipe_md(vol.devname)
                     pass
                 self.querySize(p)
                 pass
@@ -2309,9 +2619,12 @@ class LVMVG(LineEntry):
 
     def recalcSize(self, p, line):
         if (self.really_exists):
-            out = _call_lvmdispcmd("vgs", [self.devname,])
-            w = out.split()
-            self.setSize(p, line, int(w[5]), int(w[6]))
+            vgname = os.path.basename(self.devname)
+            vg = _lvm_report([vgname,]).findVG(vgname)
+            if (vg is None):
+                raise PartitionerErr("LVM doesn't know about %s"
+                                     % self.devname)
+            self.setSize(p, line, vg.numsects, vg.freesects)
         else:
             self.setSize(p, line, 0, 0)
             pass
@@ -2414,7 +2727,7 @@ class LVMVG(LineEntry):
             _namelen, self.GetLVNameDone, o)
         return
 
-    def alignValue(self, p, v, round_up=True):
+    def alignValue(self, p, v, round_up=True, start=False):
         # No need for alignment, let the LVM tools do that
         return v
 
@@ -2449,9 +2762,11 @@ class LVMVG(LineEntry):
                                   self.devname])
 
         # Calculate the actual number of sectors
-        out = _call_lvmdispcmd("lvs", [devname,])
-        w = out.split()
-        numsects = int(w[3])
+        vgname = os.path.basename(self.devname)
+        lv = _lvm_report([vgname,]).findLV(vgname, name)
+        if (lv is None):
+            raise PartitionerErr("LVM doesn't know about %s" % devname)
+        numsects = lv.numsects
 
         lvol = LVMLV(p, devname, self, numsects)
         self.addLVol(p, lvol)
@@ -2513,74 +2828,85 @@ class LVMLV(LineEntry):
 
     pass
 
-def _disk_info_from_fdisk(d):
-    # Grrr.  Parted doesn't print any disk information if the
-    # label isn't valid.  Use fdisk to get it.
-    prog = subprocess.Popen(("fdisk", d),
-                            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE, close_fds=True)
-    (out, err) = prog.communicate(bytes("\np\nq\n".encode("utf8")))
-    out = out.decode("utf8")
-    err = err.decode("utf8")
-    if (prog.returncode != 0):
-        return (None, None, err)
-    l = out.split("\n")
-    for i in range(0, len(l)):
-        if (l[i].startswith("Disk /dev/")):
-            # Found the one we want
-            w = l[i].split()
-            diskbytesize = int(w[4])
-            w = l[i+2].split()
-            # For some reason this moves around.
+# Convert a partition table label, as parted or PartTable reports it, to
+# the partition table type.  Returns None if the device has no table.
+def _table_from_label(label):
+    if (label == "msdos"):
+        return MBRPartitionTable()
+    elif (label == "gpt"):
+        return GUIDPartitionTable()
+    elif (label is None or label == "loop"):
+        # It appears, at least on MD devices, that a device without
+        # a partition table directly used for a filesytem appears
+        # as "loop".
+        return None
+    return UnknownPartitionTable()
+
+# Get the size, sector size, partition table type, and partitions for
+# a device.  If bdev (the SysBlock info for the device) is given, the
+# size comes from that and the partition table is read directly from
+# the device, otherwise parted is used.
+def _disk_info(d, bdev=None):
+    if (bdev is not None and bdev.size > 0):
+        numsects = bdev.numSects()
+        cached = _probe_cache.get(d, "table", bdev)
+        if (cached is not None):
+            (label, partitions) = cached
+        else:
             try:
-                sectsize = int(w[5])
-            except:
-                sectsize = int(w[6])
-            numsects = diskbytesize / sectsize
-            return (numsects, sectsize, None)
-        pass
-    return (None, None, "Unable to find disk info for %s" % d)
+                (label, partitions) = PartTable.read(d, bdev.sectsize,
+                                                     numsects)
+            except (OSError, PartTable.PartTableErr) as e:
+                return (0, 0, None, None,
+                        "Unable to read partition table on %s: %s"
+                        % (d, str(e)))
+            _probe_cache.put(d, "table", [ label, partitions ], bdev)
+            pass
+        return (numsects, bdev.sectsize, _table_from_label(label), partitions,
+                None)
 
-def _disk_info(d):
     try:
         o = _call_parted(d, ["print",])
     except CmdErr as e:
-        (numsects, sectsize, err) = _disk_info_from_fdisk(d)
-        if (err):
-            return (0, 0, None, None, err)
-        return (numsects, sectsize, None, None, None)
+        # parted doesn't give the size if the label isn't valid.
+        try:
+            g = Geometry.get(d)
+        except Geometry.GeometryErr as e:
+            return (0, 0, None, None, str(e))
+        return (g.numSects(), g.sectsize, None, None, None)
     j = json.loads(o)["disk"]
     sectsize = int(j["logical-sector-size"])
     numsects = int(j["size"].rstrip("s"))
-    if (j["label"] == "msdos"):
-        tabletype = MBRPartitionTable()
-    elif (j["label"] == "gpt"):
-        tabletype = GUIDPartitionTable()
-    elif (j["label"] == "loop"):
-        # It appears, at least on MD devices, that a device without
-        # a partition table directly used for a filesytem appears
-        # as "loop".  Don't process partitions.
-        tabletype = None
-        lines = None
-    else:
-        tabletype = UnknownPartitionTable()
+    tabletype = _table_from_label(j["label"])
+    if (tabletype is None or not tabletype.usable):
         # Don't attempt to process the partitions.
-        lines = None
-        pass
+        return (numsects, sectsize, tabletype, None, None)
     return (numsects, sectsize, tabletype, j["partitions"], None)
 
-def _process_dev_by_contents(name):
-    i = _get_file_info(name)
-    fstype = None
-    for d in _fs_types[1:]:
-        if d.match(i):
-            fstype = d.newInst()
-            break
+# Pick a destination for the device from what's on it.  allowed is the
+# allowed_dests of what will own it, a RAID or LVM member signature on
+# something that can't be one (a stale one on an LV, for instance) is
+# treated like any other unknown contents.
+def _process_dev_by_contents(name, allowed):
+    cached = _probe_cache.get(name, "contents")
+    if (cached is not None):
+        (t, uuid) = cached
+    else:
+        (t, uuid) = Superblock.probe(name)
+        _probe_cache.put(name, "contents", [ t, uuid ])
+        pass
+    if (uuid):
+        # We have it, save a lookup later.
+        _dev_index.setTag(name, "UUID", uuid)
         pass
-    if (fstype is None) and ("swap file" in i):
+    if (t == "swap"):
         dest = _alloc_dest("swap", do_init=False)
+    elif (t == "linux_raid_member" and "RAID" in allowed):
+        dest = _alloc_dest("RAID", do_init=False)
+    elif (t == "LVM2_member" and "LVM" in allowed):
+        dest = _alloc_dest("LVM", do_init=False)
     else:
-        dest = FSDest(subtype=fstype, do_init=False)
+        dest = FSDest(subtype=_valid_filesystem(t), do_init=False)
         pass
     return dest
 
@@ -2608,8 +2934,12 @@ def _process_dev_by_fstab(name, fstab_info, realdevname=None):
         pass
     return dest
 
+# Add the partitions from the partition table info to the device.  If
+# existing is given, it is a dictionary of partitions, indexed by
+# number, that are already present on the device; those are skipped
+# and only the others are added.
 def _process_partitions(p, device, partitions, devname, split, tabletype,
-                        fstab_info):
+                        fstab_info, existing=None):
     line = p.lineOf(0, device) + 1
     extended = None
     for part in partitions:
@@ -2617,6 +2947,12 @@ def _process_partitions(p, device, partitions, devname, split, tabletype,
         num = int(part["number"])
         sectstart = int(part["start"].rstrip("s"))
         numsects = int(part["end"].rstrip("s")) - sectstart + 1
+        if (existing is not None and num in existing):
+            if (part["type"] == "extended"):
+                extended = existing[num]
+                pass
+            line += 1
+            continue
         if (part["type"] == "extended"):
             extended = ExtendedPartition(p, device, name, num,
                                          line, sectstart, numsects)
@@ -2673,7 +3009,8 @@ def _process_partitions(p, device, partitions, devname, split, tabletype,
                         dest = _alloc_dest("swap", do_init=False)
                         pass
                     else:
-                        dest = _process_dev_by_contents(name)
+                        dest = _process_dev_by_contents(
+                            name, Partition.allowed_dests)
                         pass
                     pass
                 pass
@@ -2685,8 +3022,6 @@ def _process_partitions(p, device, partitions, devname, split, tabletype,
         pass
     return
 
-alldigits = ("0", "1", "2", "3", "4", "5", "6", "7", "8", "9")
-
 def _read_fstab(f):
     if (not f):
         return({}, [])
@@ -2715,207 +3050,338 @@ def _read_fstab(f):
 
     return (info, extra)
 
-def read_from_file(fn):
-    l = ""
-    try:
-        f = open(fn)
-        try:
-            l = f.readline().strip()
-            pass
-        except:
+# The maximum number of device probes run at the same time at startup.
+# The probes spend nearly all their time waiting on the disks, parted,
+# and the LVM tools, so threads work fine for this.
+_max_probe_workers = 16
+
+# Run all the given probe functions (which take no arguments) on a
+# bounded pool of worker threads.  The results are returned in the same
+# order as the probes, so the caller can merge them into the partitioner
+# in a deterministic order.  If a probe raises an exception, it is
+# raised from here.
+def _run_probes(probes):
+    if (len(probes) <= 1):
+        return [ f() for f in probes ]
+    nworkers = min(_max_probe_workers, len(probes))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=nworkers) as ex:
+        futures = [ ex.submit(f) for f in probes ]
+        return [ f.result() for f in futures ]
+
+# How many jobs (mkfs, etc.) may write to the same disk at once.  More
+# than one just makes them fight over the heads.
+_jobs_per_spindle = 1
+
+# Total number of jobs to run at once.
+_max_jobs = 8
+
+# Jobs on devices bigger than this (in 512 byte sectors, 64GiB) get a
+# lower I/O priority, so they don't starve the small jobs that share
+# a controller with them and the small ones finish quickly.
+_long_job_sects = 64 * 1024 * 1024 * 2
+
+_ioprio_long = [ "ionice", "-c", "2", "-n", "7" ]
+_ioprio_short = [ "ionice", "-c", "2", "-n", "4" ]
+
+# Return the set of disks (device names) that hold the data of the given
+# device, following partitions, RAIDs, and LVM down to the disks.  If
+# mds is given, the names of the md devices found on the way are added
+# to it.
+def _spindles(dev, mds=None):
+    if (isinstance(dev, LVMLV)):
+        # We don't know which PVs the LV is on, assume all of them.
+        vols = dev.vg.pvols
+    elif (isinstance(dev, RAID)):
+        vols = dev.vols
+        if (mds is not None):
+            mds.add(os.path.basename(dev.devname))
             pass
-        close(f)
+    elif (isinstance(dev, (Partition, ExtendedPartition))):
+        vols = [ dev.parent ]
+    else:
+        vols = [ ]
+        pass
+    s = set()
+    for v in vols:
+        s |= _spindles(v, mds)
         pass
-    except:
+    if (not s):
+        s.add(dev.devname)
         pass
-    return l
+    return s
 
-def is_a_disk(dev):
-    return read_from_file("/sys/block/" + dev + "/device/media") == "disk"
+# Don't redraw the progress more often than this, in seconds.
+_show_interval = 0.2
 
-def _add_disks(p, input_fstab):
-    startup_errs = ""
+#
+# Runs JobObjs in the background, as many at a time as the disks
+# underneath them allow, and shows their progress in a popup.  The
+# biggest are started first since they take the longest.
+#
+# fileno() becomes readable when something changes, and then handle()
+# must be called.  When all the jobs are finished, done(errs) is called
+# from handle().  errs has the errors from the jobs that failed, or is
+# empty if none did.  A failed job doesn't stop the others.
+#
+class JobRunner:
+    def __init__(self, p, jobs, done=None):
+        self.p = p
+        self.done = done
+        self.njobs = len(jobs)
+        self.ndone = 0
+        self.errs = ""
+        self.finished = False
+        self.last_show = 0
+        self.last_ndone = -1
+        (self.rfd, self.wfd) = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+
+        have_ionice = shutil.which("ionice") is not None
+        self.pending = [ ]
+        for j in jobs:
+            o = Obj()
+            o.job = j
+            o.size = getattr(j.data, "numsects", 0)
+            o.ioprio = None
+            if (have_ionice):
+                if (o.size > _long_job_sects):
+                    o.ioprio = _ioprio_long
+                else:
+                    o.ioprio = _ioprio_short
+                    pass
+                pass
+            mds = set()
+            o.spindles = _spindles(j.data, mds)
+            o.progress = Progress.Progress(sorted(mds), self._notify)
+            self.pending.append(o)
+            pass
+        self.pending.sort(key=lambda o: -o.size)
+        self.busy = { }
+        self.running = { }
+        self.ex = concurrent.futures.ThreadPoolExecutor(max_workers=_max_jobs)
+        self.handle()
+        return
 
-    p.popupInfo("Reading disk information, please wait")
+    def fileno(self):
+        return self.rfd
 
-    (fstab_info, fstab_extra) = _read_fstab(input_fstab)
+    # Called from the job threads when something changes.
+    def _notify(self):
+        try:
+            os.write(self.wfd, b"\0")
+        except BlockingIOError:
+            # Already something there to wake it up.
+            pass
+        return
 
-    # First look in /proc/diskstats and extract the disks.
-    disks = []
-    raids = []
-    try:
-        f = open("/proc/diskstats")
-    except Exception as e:
-        startup_errs += "Unable to open /proc/diskstats: " + str(e)
-        return startup_errs
+    def _startJobs(self):
+        for o in list(self.pending):
+            if (len(self.running) >= _max_jobs):
+                break
+            if (any(self.busy.get(s, 0) >= _jobs_per_spindle
+                    for s in o.spindles)):
+                continue
+            self.pending.remove(o)
+            for s in o.spindles:
+                self.busy[s] = self.busy.get(s, 0) + 1
+                pass
+            f = self.ex.submit(o.job.run, o.ioprio, o.progress)
+            self.running[f] = o
+            f.add_done_callback(lambda f: self._notify())
+            pass
+        return
 
-    try:
-        l = f.readline()
-        while (l):
-            w = l.split()
-            if (w[2].startswith("sd") and not w[2].endswith(alldigits)):
-                disks.append("/dev/" + w[2])
-                pass
-            elif (w[2].startswith("hd") and not w[2].endswith(alldigits)):
-                # Make sure it is actually a disk
-                if (is_a_disk(w[2])):
-                    disks.append("/dev/" + w[2])
-                    pass
+    def _reapJobs(self):
+        for f in [ f for f in self.running if f.done() ]:
+            o = self.running.pop(f)
+            for s in o.spindles:
+                self.busy[s] -= 1
+                pass
+            _dev_written(o.job.data.devname)
+            self.ndone += 1
+            e = f.exception()
+            if (e is not None):
+                self.errs += "Making %s failed: %s\n" % (str(o.job), str(e))
+                pass
+            pass
+        return
+
+    def _show(self):
+        width = self.p.ncols - 6
+        s = "Making filesystems, %d of %d done" % (self.ndone, self.njobs)
+        for o in self.running.values():
+            s += "\n\n" + str(o.job)[0:width]
+            for l in o.progress.lines(width):
+                s += "\n  " + l
                 pass
-            elif w[2].startswith("nvme") and 'p' not in w[2]:
-                disks.append("/dev/" + w[2])
+            pass
+        self.p.redraw()
+        self.p.popupInfo(s, reformat=False)
+        self.last_show = time.time()
+        return
+
+    def handle(self):
+        try:
+            while (os.read(self.rfd, 4096)):
                 pass
-            elif (w[2].startswith("md") and ('p' not in w[2])):
-                # Note that the "p" above is important, we need to ignore
-                # RAID partitions and just get the main RAID devices.
-                raids.append(w[2])
+        except BlockingIOError:
+            pass
+        self._reapJobs()
+        self._startJobs()
+        if (not self.running):
+            self.ex.shutdown()
+            os.close(self.rfd)
+            os.close(self.wfd)
+            self.finished = True
+            self.p.popupInfoDone()
+            if (self.done):
+                self.done(self.errs)
                 pass
-            l = f.readline()
+            return
+        if (time.time() - self.last_show >= _show_interval
+            or self.ndone != self.last_ndone):
+            self._show()
+            self.last_ndone = self.ndone
             pass
-        pass
-    except Exception as e:
+        return
+
+    # Run until all the jobs are done, for when there is nothing else
+    # to do.  Returns the errors.
+    def wait(self):
+        while (not self.finished):
+            select.select([ self.rfd ], [ ], [ ], _show_interval)
+            self.handle()
+            pass
+        return self.errs
+
+    pass
+
+# Get the given md device (without the /dev) from sysfs and probe it if
+# it is running.  mds is the MDArray.scan() result if the caller has
+# it.  Returns (md, diskinfo), where md is the MDArray, or None if there
+# is no array, and diskinfo is the _disk_info() return.
+def _raid_info(r, mds=None):
+    if (mds is None):
+        md = MDArray.read(r)
+    else:
+        md = mds.get(r)
         pass
 
-    # For each disk, query it from parted to get the size of each cylinder
-    # and the partitions.
-    for d in disks:
-        (numsects, sectsize, tabletype, partitions, err) = _disk_info(d)
+    if (md is not None and md.level != "inactive"):
+        dinfo = _disk_info("/dev/" + r, SysBlock.get(r))
+    else:
+        dinfo = (0, 0, None, None, None)
+        pass
+    return (md, dinfo)
 
-        if (err is not None):
-            startup_errs += err + "\n"
-            continue
+# Add a disk from the information returned by _disk_info().  Returns a
+# string with any errors.
+def _add_disk(p, d, info, fstab_info):
+    (numsects, sectsize, tabletype, partitions, err) = info
 
-        if (tabletype is None):
-            tabletype = InvalidPartitionTable()
-            pass
+    if (err is not None):
+        return err + "\n"
 
-        disk = Disk(p, d, numsects, sectsize, tabletype)
+    if (tabletype is None):
+        tabletype = InvalidPartitionTable()
+        pass
 
-        if (partitions is None):
-            continue
+    disk = Disk(p, d, numsects, sectsize, tabletype)
 
+    if (partitions is not None):
         _process_partitions(p, disk, partitions, d, disk.split,
                             tabletype, fstab_info)
         pass
+    return ""
 
-    # Now handle the raids.
-    for r in raids:
-        # Find the raid info in /proc/mdstat
-        o = open("/proc/mdstat")
-        rdevs = []
-        found = False
-        for l in o:
-            if (l[0] == 'm'):
-                w = l.split()
-                if (w[0] != r):
-                    continue
-                pass
-            else:
-                continue
-
-            # We found our raid, extract the info
-            found = True
-            r = "/dev/" + r
-            if (w[2] == "active"):
-                level = w[3]
-                n = 4
-            else:
-                level = "inactive"
-                n = 3
-                pass
-
-            for d in w[n:]:
-                d1 = d.split('[')
-                rdevs.append("/dev/" + d1[0])
-                pass
-
-            break
-        
-        if (not found):
-            startup_errs += "RAID %s not found in /proc/mdstat\n" % r
-            continue
-
-        if (level != "inactive"):
-            (numsects, sectsize, tabletype, dpartitions, err) = _disk_info(r)
-        else:
-            numsects = 0
-            sectsize = 0
-            tabletype = None
-            dpartitions = None
-            err = None
-            pass
-
-        if (tabletype is None and level != "inactive"):
-            # No partition table on the MD device, see what else it could be.
-            dest = _process_dev_by_fstab(r, fstab_info)
-            if (not dest):
-                dest = _process_dev_by_contents(r)
-                pass
-            pass
-        else:
-            dest = None
+# Link a device that is a member of a RAID into it.
+def _add_raid_member(p, raid, d):
+    if (d.startswith("/dev/md/")):
+        # In case /dev/md/x ends up in the raid detail
+        dobj = p.findObj("/dev/md" + d.rsplit("/", 1)[1])
+    else:
+        dobj = p.findObj(d)
+        pass
+    if (dobj is None):
+        return ("Unable to find %s that was in RAID %s\n"
+                % (d, raid.devname))
+    if (dobj in raid.vols):
+        return ""
+    rline = p.findLine(dobj)
+    if (dobj.dest.__class__ == RAIDDest):
+        dobj.dest.setRAID(p, rline, raid)
+        pass
+    else:
+        # Hmm, it's not already a RAID.  Switch it over
+        dobj.newDest(p, RAIDDest(RAIDValue(raid)), rline,
+                     doshutdown=False)
+        pass
+    raid.addVolInit(dobj)
+    return ""
+
+# Add a RAID from the information returned by _raid_info(), r is the
+# name without the "/dev/".  Returns a string with any errors.
+def _add_raid(p, r, info, fstab_info):
+    errs = ""
+    (md, dinfo) = info
+    if (md is None):
+        return "RAID %s not found in sysfs\n" % r
+    level = md.level
+    r = "/dev/" + r
+
+    (numsects, sectsize, tabletype, dpartitions, err) = dinfo
+
+    if (tabletype is None and level != "inactive"):
+        # No partition table on the MD device, see what else it could be.
+        dest = _process_dev_by_fstab(r, fstab_info)
+        if (not dest):
+            dest = _process_dev_by_contents(r, RAID.allowed_dests)
             pass
+        pass
+    else:
+        dest = None
+        pass
 
-        raid = RAID(p, r, numsects, sectsize, tabletype, dest,
-                    level=level)
-
-        for d in rdevs:
-            if (d.startswith("/dev/md/")):
-                # In case /dev/md/x ends up in the raid detail
-                dobj = p.findObj("/dev/md" + d.rsplit("/", 1)[1])
-            else:
-                dobj = p.findObj(d)
-                pass
-            if (dobj is None):
-                startup_errs += ("Unable to find %s that was in RAID %s\n"
-                                 % (d, r))
-                continue
-            rline = p.findLine(dobj)
-            if (dobj.dest.__class__ == RAIDDest):
-                dobj.dest.setRAID(p, rline, raid)
-                pass
-            else:
-                # Hmm, it's not already a RAID.  Switch it over
-                dobj.newDest(p, RAIDDest(RAIDValue(raid)), rline,
-                             doshutdown=False)
-                pass
-            raid.addVolInit(dobj)
-            pass
+    raid = RAID(p, r, numsects, sectsize, tabletype, dest,
+                level=level)
 
-        if (dpartitions is not None):
-            _process_partitions(p, raid, dpartitions, r, "p", tabletype,
-                                fstab_info)
+    for m in md.members:
+        errs += _add_raid_member(p, raid, m.devname)
+        if (m.faulty()):
+            errs += "%s in RAID %s is faulty\n" % (m.devname, r)
             pass
         pass
 
-    # Now LVMs
+    if (dpartitions is not None):
+        _process_partitions(p, raid, dpartitions, r, "p", tabletype,
+                            fstab_info)
+        pass
+    return errs
 
-    # First find the volume groups
-    out = _call_lvmdispcmd("vgs")
-    lines = out.split("\n")
-    for l in lines:
-        w = l.split()
-        if (not w):
-            break
-        LVMVG(p, "/dev/" + w[0], int(w[5]), int(w[6]))
+# Add the volume groups (LVMReport.VG) that we don't already have.
+def _add_vgs(p, vgs):
+    for rvg in vgs:
+        if (p.findObj("/dev/" + rvg.name) is not None):
+            continue
+        LVMVG(p, "/dev/" + rvg.name, rvg.numsects, rvg.freesects)
         pass
+    return
 
-    # Now find all the physical volumes and link them into their volume group
-    out = _call_lvmdispcmd("pvs", ["--separator", ":"])
-    lines = out.split("\n")
-    for l in lines:
-        w = l.strip().split(":")
-        if (len(w) < 6):
-            break
-        devname = w[0]
+# Find the physical volumes (LVMReport.PV) and link them into their
+# volume group.  Returns a string with any errors.
+def _add_pvs(p, pvs):
+    errs = ""
+    for rpv in pvs:
+        devname = rpv.devname
         (pvol, rline) = p.findObjLine(devname)
         if pvol is None:
-            startup_errs += "Unable to find LVM PV %s\n" % (devname,)
+            errs += "Unable to find LVM PV %s\n" % (devname,)
             continue
-        if (len(w[1]) > 0):
-            vgdevname = "/dev/" + w[1]
+        if (len(rpv.vgname) > 0):
+            vgdevname = "/dev/" + rpv.vgname
             vg = p.findObj(vgdevname)
-            vg.addPVolInit(pvol)
+            if (pvol not in vg.pvols):
+                vg.addPVolInit(pvol)
+                pass
         else:
             vg = None
             pass
@@ -2930,19 +3396,19 @@ def _add_disks(p, input_fstab):
             pvol.newDest(p, LVMDest(LVMValue(vg, do_init=False)), rline)
             pass
         pass
+    return errs
 
-    # Now find all the logical volumes and link them into their volume group
-    out = _call_lvmdispcmd("lvs")
-    lines = out.split("\n")
-    for l in lines:
-        w = l.split()
-        if (not w):
-            break
-        vgdevname = "/dev/" + w[1]
+# Add the logical volumes (LVMReport.LV) that we don't already have
+# and link them into their volume group.
+def _add_lvs(p, lvs, fstab_info):
+    for rlv in lvs:
+        vgdevname = "/dev/" + rlv.vgname
         vg = p.findObj(vgdevname)
-        devname = vgdevname + "/" + w[0]
-        numsects = int(w[3])
-        mappername = "/dev/mapper/" + w[1] + "-" + w[0]
+        devname = vgdevname + "/" + rlv.name
+        if (p.findObj(devname) is not None):
+            continue
+        numsects = rlv.numsects
+        mappername = "/dev/mapper/" + rlv.vgname + "-" + rlv.name
 
         # Try /dev/mapper/vg-lv first
         dest = _process_dev_by_fstab(devname, fstab_info,
@@ -2952,11 +3418,382 @@ def _add_disks(p, input_fstab):
             dest = _process_dev_by_fstab(devname, fstab_info)
             pass
         if (dest is None):
-            dest =  _process_dev_by_contents(devname)
+            dest =  _process_dev_by_contents(devname, LVMLV.allowed_dests)
             pass
         lvol = LVMLV(p, devname, vg, numsects, dest=dest)
         vg.addLVolInit(lvol)
         pass
+    return
+
+# Return the names (without /dev/) of the devices stacked on top of the
+# given device.
+def _dev_holders(devname):
+    bdev = SysBlock.lookup(devname)
+    if (bdev is None):
+        return [ ]
+    try:
+        return System.current.listdir(os.path.join(bdev.path, "holders"))
+    except OSError:
+        return [ ]
+    return [ ]
+
+# Re-read the partition table of a disk or RAID after it was modified
+# and add just the partitions that are new, along with any RAIDs and
+# LVM volumes udev assembled from them.  Returns False if the device
+# doesn't match what we already have, so everything has to be re-read.
+def _rescan_owner(p, owner):
+    bdev = SysBlock.lookup(owner.devname)
+    if (bdev is None or owner.table is None):
+        return False
+    info = _disk_info(owner.devname, bdev)
+    (numsects, sectsize, tabletype, partitions, err) = info
+    if (err is not None or partitions is None
+        or tabletype.__class__ != owner.table.__class__
+        or numsects != owner.numsects):
+        return False
+
+    have = { }
+    for part in owner.partitions:
+        have[part.num] = part
+        if (part.__class__ == ExtendedPartition):
+            for lpart in part.partitions:
+                have[lpart.num] = lpart
+                pass
+            pass
+        pass
+
+    # Everything we already have must still be there, unchanged and in
+    # the same order.
+    line = p.findLine(owner) + 1
+    found = 0
+    newparts = [ ]
+    for part in partitions:
+        num = int(part["number"])
+        if (num not in have):
+            newparts.append(num)
+            continue
+        obj = have[num]
+        sectstart = int(part["start"].rstrip("s"))
+        nsects = int(part["end"].rstrip("s")) - sectstart + 1
+        if (obj.sectstart != sectstart or obj.numsects != nsects
+            or ((part["type"] == "extended")
+                != (obj.__class__ == ExtendedPartition))
+            or p.findLine(obj) != line):
+            return False
+        found += 1
+        line += 1
+        pass
+    if (found != len(have)):
+        return False
+    if (not newparts):
+        return True
+
+    if (owner.__class__ == RAID):
+        split = "p"
+    else:
+        split = owner.split
+        pass
+    _process_partitions(p, owner, partitions, owner.devname, split,
+                        owner.table, { }, existing=have)
+
+    # Now see if udev did anything with the new partitions.  Any md
+    # device built on them is added (or they are added to it), and
+    # anything with an LVM label is looked up in LVM.
+    errs = ""
+    pvnames = [ ]
+    newdevs = [ owner.devname + split + str(num) for num in newparts ]
+    for name in newdevs:
+        _dev_written(name)
+        for h in _dev_holders(name):
+            if (not h.startswith("md")):
+                continue
+            raid = p.findObj("/dev/" + h)
+            if (raid is None):
+                errs += _add_raid(p, h, _raid_info(h), { })
+                if (Superblock.probe("/dev/" + h)[0] == "LVM2_member"):
+                    pvnames.append("/dev/" + h)
+                    pass
+            else:
+                errs += _add_raid_member(p, raid, name)
+                pass
+            pass
+        if (Superblock.probe(name)[0] == "LVM2_member"):
+            pvnames.append(name)
+            pass
+        pass
+    if (errs):
+        return False
+
+    if (pvnames):
+        try:
+            report = _lvm_report()
+        except CmdErr:
+            return False
+        pvs = [ pv for pv in report.pvs if pv.devname in pvnames ]
+        vgnames = set([ pv.vgname for pv in pvs if pv.vgname ])
+        newvgs = [ v for v in vgnames if p.findObj("/dev/" + v) is None ]
+        _add_vgs(p, [ vg for vg in report.vgs if vg.name in newvgs ])
+        errs += _add_pvs(p, pvs)
+        _add_lvs(p, [ lv for lv in report.lvs if lv.vgname in newvgs ], { })
+        for v in vgnames:
+            rvg = report.findVG(v)
+            if (v not in newvgs and rvg is not None):
+                # An existing VG got bigger
+                vg = p.findObj("/dev/" + v)
+                vg.setSize(p, p.findLine(vg), rvg.numsects, rvg.freesects)
+                pass
+            pass
+        pass
+    return not errs
+
+# A disk went away.  If nothing else was using it, just remove its
+# lines.  Returns False if it was tied into a RAID or LVM, then
+# everything has to be re-read.
+def _remove_disk(p, disk):
+    parts = [ ]
+    if (disk.table is not None):
+        for part in disk.partitions:
+            if (part.__class__ == ExtendedPartition):
+                parts += part.partitions
+                pass
+            parts.append(part)
+            pass
+        pass
+    for part in parts:
+        dest = part.dest
+        if (dest.__class__ == RAIDDest and dest.value.raid is not None):
+            return False
+        if (dest.__class__ == LVMDest and dest.value.vg is not None):
+            return False
+        pass
+    for part in parts:
+        p.deleteLine(p.findLine(part))
+        pass
+    p.deleteLine(p.findLine(disk))
+    del p.disks[p.disks.index(disk.devname)]
+    return True
+
+# An md device was added, started, or changed.  Add it if we don't have
+# it, otherwise pick up any new members and its current size.
+def _update_raid(p, name):
+    raid = p.findObj("/dev/" + name)
+    bdev = SysBlock.get(name)
+    if (bdev is None or bdev.size == 0):
+        # Not started yet, there will be a change event when it is.
+        return True
+    info = _raid_info(name)
+    if (raid is None):
+        if (info[0] is None):
+            return True
+        return not _add_raid(p, name, info, { })
+    (md, dinfo) = info
+    if (md is None or md.level == "inactive"):
+        return True
+    for m in md.members:
+        _add_raid_member(p, raid, m.devname)
+        pass
+    raid.running = True
+    raid.setNumSects(p, p.findLine(raid), bdev.numSects(), bdev.sectsize)
+    return True
+
+# A RAID was stopped.  We keep the RAID, since it may be one that is
+# being set up, but it has no size any more.
+def _stop_raid(p, raid):
+    if (raid.table is not None and raid.partitions):
+        return False
+    raid.setNumSects(p, p.findLine(raid), 0, 512)
+    raid.running = False
+    return True
+
+# Something in LVM changed.  Query LVM and add any new VGs and LVs,
+# remove LVs that no longer exist, and update the VG sizes.
+def _refresh_lvm(p):
+    try:
+        report = _lvm_report()
+    except CmdErr:
+        return False
+    _add_vgs(p, report.vgs)
+    _add_pvs(p, report.pvs)
+    _add_lvs(p, report.lvs, { })
+
+    lvnames = set([ "/dev/" + lv.vgname + "/" + lv.name
+                    for lv in report.lvs ])
+    for rvg in report.vgs:
+        vg = p.findObj("/dev/" + rvg.name)
+        for lvol in vg.lvols[:]:
+            if (lvol.devname not in lvnames):
+                del vg.lvols[vg.lvols.index(lvol)]
+                p.deleteLine(p.findLine(lvol))
+                pass
+            pass
+        vg.setSize(p, p.findLine(vg), rvg.numsects, rvg.freesects)
+        pass
+    return True
+
+# Turn a batch of device events into updates of just the affected
+# disks, RAIDs, and LVM.  Returns False if that couldn't be done and
+# everything needs to be re-read.
+def _handle_uevents(p, events):
+    owners = [ ]
+    raids = [ ]
+    lvm = False
+    for ev in events:
+        if (ev.action == "overflow"):
+            return False
+        if (ev.subsystem != "block" or ev.devname is None):
+            continue
+        name = os.path.basename(ev.devname)
+        if (ev.action == "remove"):
+            obj = p.findObj(ev.devname)
+            if (obj is None):
+                if (name.startswith("dm-")
+                    or ev.devname.startswith("/dev/mapper/")):
+                    lvm = True
+                    pass
+                continue
+            if (obj.__class__ == Disk):
+                if (not _remove_disk(p, obj)):
+                    return False
+                pass
+            elif (obj.__class__ in (Partition, ExtendedPartition)):
+                owner = obj.parent
+                if (owner.__class__ == ExtendedPartition):
+                    owner = owner.parent
+                    pass
+                owners.append(owner)
+            elif (obj.__class__ == RAID):
+                if (not _stop_raid(p, obj)):
+                    return False
+                pass
+            elif (obj.__class__ == LVMLV):
+                lvm = True
+                pass
+            continue
+
+        # Its UUID may have changed.
+        _dev_written(ev.devname)
+        bdev = SysBlock.lookup(ev.devname)
+        if (bdev is None):
+            continue
+        from_part = (bdev.kind == "part")
+        if (from_part):
+            # Work on the disk or RAID the partition is on.
+            pname = os.path.basename(os.path.dirname(
+                System.current.realpath(bdev.path)))
+            bdev = SysBlock.get(pname)
+            if (bdev is None):
+                continue
+            pass
+        if (bdev.kind == "md"):
+            # Re-read the table of a RAID we have, it may have new
+            # partitions.  Arrays starting and stopping are handled by
+            # _update_raid().
+            raid = p.findObj(bdev.devname)
+            if (raid is None or not from_part):
+                if (bdev.name not in raids):
+                    raids.append(bdev.name)
+                    pass
+                pass
+            if (raid is not None and raid.table is not None
+                and bdev.size > 0 and raid not in owners):
+                owners.append(raid)
+                pass
+        elif (bdev.kind == "dm"):
+            lvm = True
+        elif (bdev.kind == "disk"):
+            obj = p.findObj(bdev.devname)
+            if (obj is None):
+                # A new disk
+                info = _disk_info(bdev.devname, bdev)
+                if (_add_disk(p, bdev.devname, info, { })):
+                    return False
+                pass
+            elif (obj not in owners):
+                owners.append(obj)
+                pass
+            pass
+        pass
+
+    for owner in owners:
+        if (p.findObj(owner.devname) is not owner):
+            # Removed above
+            continue
+        if (owner.table is None or not owner.table.usable):
+            # There's nothing we can do with it anyway, don't re-read
+            # everything because of it.
+            continue
+        if (not _rescan_owner(p, owner)):
+            return False
+        pass
+    for name in raids:
+        if (not _update_raid(p, name)):
+            return False
+        pass
+    if (lvm):
+        return _refresh_lvm(p)
+    return True
+
+def _add_disks(p, input_fstab):
+    startup_errs = ""
+
+    p.popupInfo("Reading disk information, please wait")
+
+    (fstab_info, fstab_extra) = _read_fstab(input_fstab)
+
+    # Get all the UUIDs in one go instead of asking about each device.
+    _dev_index.rescan()
+
+    # Get what we found last time, only changed devices are probed.
+    _probe_cache.load()
+
+    # Find the disks and RAIDs in sysfs.
+    disks = []
+    raids = []
+    bdevs = { }
+    try:
+        blockdevs = SysBlock.all_devs()
+    except Exception as e:
+        startup_errs += "Unable to read %s: %s" % (SysBlock.sysblock, str(e))
+        return startup_errs
+
+    for bd in blockdevs:
+        if (bd.kind == "disk"):
+            disks.append(bd.devname)
+            bdevs[bd.devname] = bd
+        elif (bd.kind == "md"):
+            raids.append(bd.name)
+            pass
+        pass
+
+    # Get the state of all the RAIDs and their members in one go.
+    mds = MDArray.scan(raids)
+
+    # Probe all the disks and RAIDs, and query LVM, in parallel.  The
+    # probes don't touch the partitioner, the results are merged into
+    # it below in the same order the devices were found.
+    probes = ([ functools.partial(_disk_info, d, bdevs[d]) for d in disks ]
+              + [ functools.partial(_raid_info, r, mds) for r in raids ]
+              + [ _lvm_report ])
+    results = _run_probes(probes)
+    disk_results = results[0:len(disks)]
+    raid_results = results[len(disks):len(disks) + len(raids)]
+    lvm_report = results[-1]
+
+    # For each disk, use the parted info to get the size of each cylinder
+    # and the partitions.
+    for (d, info) in zip(disks, disk_results):
+        startup_errs += _add_disk(p, d, info, fstab_info)
+        pass
+
+    # Now handle the raids.
+    for (r, info) in zip(raids, raid_results):
+        startup_errs += _add_raid(p, r, info, fstab_info)
+        pass
+
+    # Now LVMs
+    _add_vgs(p, lvm_report.vgs)
+    startup_errs += _add_pvs(p, lvm_report.pvs)
+    _add_lvs(p, lvm_report.lvs, fstab_info)
 
     for f in fstab_info:
         w = fstab_info[f]
@@ -2967,6 +3804,8 @@ def _add_disks(p, input_fstab):
 
     p.setFstabExtra(fstab_extra)
 
+    _probe_cache.save()
+
     p.popupInfoDone()
 
     return startup_errs
@@ -2977,9 +3816,16 @@ def _add_disks(p, input_fstab):
 class Partitioner:
     done = False
     
-    def __init__(self, parent, input_fstab=None, output_fstab=None):
+    def __init__(self, parent, input_fstab=None, output_fstab=None,
+                 probe_cache=True, low_bandwidth=False, layout=None):
         self.window = parent
 
+        # Keep what is sent to the terminal down for serial consoles?
+        Screen.set_low_bandwidth(low_bandwidth, parent)
+
+        # Use probe results from previous runs?
+        _probe_cache.enabled = probe_cache
+
         self.in_reread = False
 
         self.output_fstab_str = output_fstab
@@ -2988,6 +3834,12 @@ class Partitioner:
         # Do optimum (True) or minimum (False) alignment.
         self.align_opt = True
 
+        # Where new partitions are proposed, see FreeExtents.place()
+        self.placement = FreeExtents.LARGEST
+
+        # The last layout file used, see LayoutSolver
+        self.layout_file = ""
+
         # Display Million bytes by default
         self.units = MiBUnits()
 
@@ -3012,9 +3864,9 @@ class Partitioner:
         self._drawHeader()
         self._drawCurrInfo()
 
-        parent.refresh()
-        self.header.refresh()
-        self.footer.refresh()
+        Screen.refresh(parent)
+        Screen.refresh(self.header)
+        Screen.refresh(self.footer)
 
         self.popup = None
 
@@ -3022,22 +3874,46 @@ class Partitioner:
         errs = ""
         if (input_fstab):
             try:
-                infstab = open(input_fstab, "r")
+                infstab = io.StringIO(System.current.read_file(input_fstab))
             except Exception as e:
                 errs = "Unable to open fstab %s: %s" % (input_fstab, str(e))
                 pass
             pass
 
+        # Watch for devices coming and going underneath us.  This is
+        # started before the disks are read so nothing is missed.
+        self.uevents = System.current.open_listener()
+        self.pending_uevents = [ ]
+
+        # Filesystems being made in the background, a JobRunner.
+        self.jobs = None
+
         self.linepos = 0
         self.colpos = 0
         errs += self.initInfo(infstab)
         if (infstab):
             infstab.close()
             pass
+        if (layout and errs):
+            # Show the problems first, the layout comes after.
+            self.popupWin(errs, self.startLayoutDone, layout)
+            errs = ""
+        elif (layout):
+            try:
+                self.layoutCmd(layout)
+            except PartitionerErr as e:
+                errs = str(e)
+                pass
+            pass
         if (errs):
             self.popupWin(errs)
             pass
-        self.sc.refresh()
+        self.refresh()
+        return
+
+    def startLayoutDone(self, layout):
+        self.redraw()
+        self.layoutCmd(layout)
         return
 
     def initInfo(self, infstab):
@@ -3155,6 +4031,9 @@ class Partitioner:
         self.popup = Popup.Popup(self.sc.getWindow(),
                                  self.nlines - 4, self.ncols, 2, 0,
                                  s, None, None, reformat=reformat)
+        # Work is done before returning to the main loop, get this out
+        # first.
+        Screen.update()
         return
         
     def popupInfoDone(self):
@@ -3184,7 +4063,7 @@ class Partitioner:
         o.handler(o.handlerObj, o.result)
         return
         
-    def popupYesNo(self, s, handler=None, handlerObj=None):
+    def popupYesNo(self, s, handler=None, handlerObj=None, reformat=True):
         o = Obj()
         o.handlerObj = handlerObj
         o.handler = handler
@@ -3192,7 +4071,7 @@ class Partitioner:
         self.popup = Popup.Popup(self.sc.getWindow(),
                                  self.nlines - 4, self.ncols, 2, 0,
                                  s, self._YesNoHandler, o,
-                                 self._YesNoCharHandler)
+                                 self._YesNoCharHandler, reformat=reformat)
         return
 
     def redraw(self):
@@ -3211,9 +4090,9 @@ class Partitioner:
                                  _sizelen, "Size",
                                  _typelen, " Type",
                                  "Info")
-        self.header.clear()
+        Screen.clear(self.header)
         self.header.addstr(0, 0, s)
-        self.header.refresh()
+        Screen.refresh(self.header)
         return
 
     def getWork(self):
@@ -3225,6 +4104,17 @@ class Partitioner:
         return work
         
     def processWork(self, work, outfstab):
+        # Make the filesystems first, the fstab may use their UUIDs.
+        errs = ""
+        jobs = [ w for w in work if isinstance(w, JobObj) ]
+        if (jobs):
+            errs = JobRunner(self, jobs).wait()
+            pass
+        self._writeFstab(work, outfstab)
+        return errs
+
+    # Do everything in work but the jobs, which writes the fstab.
+    def _writeFstab(self, work, outfstab):
         if outfstab:
             self.output_fstab = outfstab
             for l in self.fstab_extra:
@@ -3232,7 +4122,9 @@ class Partitioner:
                 pass
             pass
         for w in work:
-            w.work(self)
+            if (not isinstance(w, JobObj)):
+                w.work(self)
+                pass
             pass
         self.output_fstab = None
         return
@@ -3248,7 +4140,7 @@ class Partitioner:
         # First get our fstab information in a temp file.
         work = self.getWork()
         t = tempfile.TemporaryFile(mode="w+t")
-        self.processWork(work, t)
+        errs = self.processWork(work, t)
 
         # Flush the current contents and re-read the partitions using
         # our saved fstab info.
@@ -3263,6 +4155,235 @@ class Partitioner:
             oldlinepos = self.numlines() - 1
             pass
         self.setPos(oldlinepos, oldcolpos)
+        if (errs):
+            self.popupWin(errs)
+            pass
+        return
+
+    def reReadOwner(self, owner):
+        """Re-read the partition table of a single disk or RAID"""
+        if (owner.__class__ == ExtendedPartition):
+            owner = owner.parent
+            pass
+        if (not _rescan_owner(self, owner)):
+            self.reRead()
+        else:
+            # Keep what was probed for next time, reRead() does this
+            # itself.
+            _probe_cache.save()
+            pass
+        return
+
+    def layoutFileDone(self, o, vals):
+        if (vals is None or not vals[0].strip()):
+            # User aborted
+            return
+        self.layoutCmd(vals[0].strip())
+        return
+
+    # Lay the disks out as a layout file says, see LayoutSolver.  The
+    # plan is shown for the user to accept before anything is done.
+    def layoutCmd(self, filename):
+        try:
+            f = open(filename, "r")
+            try:
+                text = f.read()
+            finally:
+                f.close()
+                pass
+        except (IOError, OSError) as e:
+            raise PartitionerErr("Unable to read layout %s: %s"
+                                 % (filename, str(e)))
+        self.layout_file = filename
+
+        skipped = ""
+        try:
+            requests = LayoutSolver.parse(text)
+            for r in requests:
+                if (r.fstype and _valid_filesystem(r.fstype) is None):
+                    raise PartitionerErr("Layout line %d: unknown filesystem"
+                                         " %s" % (r.lineno, r.fstype))
+                if (r.vg):
+                    o = self.findObj("/dev/" + r.vg)
+                    if (o is not None and o.__class__ != LVMVG):
+                        raise PartitionerErr("Layout line %d: %s is not a"
+                                             " volume group"
+                                             % (r.lineno, o.devname))
+                    pass
+                pass
+            disks = [ ]
+            for name in self.disks:
+                d = self.findObj(name)
+                if (d.table is not None and d.table.usable):
+                    disks.append(LayoutSolver.Disk(
+                        d.devname, d.sectsize, d.free,
+                        functools.partial(d.alignValue, self),
+                        d.table.maxPartitions - len(d.partitions)))
+                    continue
+                why = self._layoutBlank(d)
+                if (why):
+                    skipped += "  %s: %s\n" % (d.devname, why)
+                    continue
+                # A blank disk gets a new GPT, if anything goes on it.
+                table = GUIDPartitionTable()
+                d.getAlignInfo()
+                disks.append(LayoutSolver.Disk(
+                    d.devname, d.sectsize,
+                    FreeExtents.FreeExtents(
+                        table.reservedBeginning,
+                        d.numsects - table.reservedEnd),
+                    functools.partial(d.alignValue, self),
+                    table.maxPartitions, label=table.name))
+                pass
+            if (skipped):
+                skipped = "These disks were left out:\n" + skipped + "\n"
+                pass
+            plan = LayoutSolver.solve(disks, requests)
+        except LayoutSolver.LayoutErr as e:
+            if (skipped):
+                raise PartitionerErr(str(e) + "\n\n" + skipped)
+            raise PartitionerErr(str(e))
+        self.popupYesNo("The layout in %s will be set up like this:\n\n%s\n"
+                        "%sDo you want to do this?"
+                        % (filename, plan.describe(self.units.convToStr),
+                           skipped),
+                        self.layoutQueryDone, plan, reformat=False)
+        return
+
+    # Return why a disk without a usable partition table can't have a
+    # new one for a layout, or None if it is blank and can.
+    def _layoutBlank(self, d):
+        if (d.table is not None
+            and d.table.__class__ != InvalidPartitionTable):
+            return "its partition table can't be changed here"
+        if (_dev_holders(d.devname)):
+            return "it is in use"
+        (t, uuid) = Superblock.probe(d.devname)
+        if (t):
+            return "it holds %s" % t
+        return None
+
+    def layoutQueryDone(self, plan, val):
+        if (not val):
+            return
+
+        # Make all of a disk's partitions at once, as each one re-reads
+        # the disk.
+        errs = ""
+        for d in plan.disks:
+            if (len(d.places) == 0):
+                continue
+            owner = self.findObj(d.name)
+            if (d.label):
+                owner.table.finishTableUpdate(self, GUIDPartitionTable())
+                pass
+            areas = [ (pl.start, pl.numsects) for pl in d.places ]
+            if (not owner.makePartitions(self, areas, owner.subpartitions)):
+                errs += ("Error informing the kernel about the partitions"
+                         + " update for " + d.name + "\n")
+                pass
+            pass
+
+        for r in plan.requests:
+            parts = [ self._layoutPartition(pl)
+                      for pl in plan.placements(r) ]
+            if (r.role == "raid"):
+                raid = self.raidObj.newRAID(self)
+                for part in parts:
+                    dest = self._layoutDest(part, RAIDDest())
+                    raid.addVol(self, part)
+                    dest.setRAID(self, self.findLine(part), raid)
+                    pass
+                parts = [ raid ]
+                pass
+            for part in parts:
+                if (r.vg):
+                    dest = self._layoutDest(part, LVMDest())
+                    vg = self.findObj("/dev/" + r.vg)
+                    if (vg is None):
+                        vg = LVMVG(self, "/dev/" + r.vg, 0, 0)
+                        pass
+                    vg.addPVol(part, self)
+                    dest.setVG(self, self.findLine(part), vg)
+                elif (r.role == "swap"):
+                    self._layoutDest(part, SwapDest())
+                elif (r.fstype):
+                    self._layoutDest(part, FSDest(
+                        subtype=_valid_filesystem(r.fstype),
+                        value=MountPoint(r.mount or "")))
+                    pass
+                pass
+            pass
+        self.redoHighlight()
+        if (errs):
+            self.popupWin(errs + "Linux will not know about the changes."
+                          + "  You will need to restart the system to pick"
+                          + " up the partition changes.")
+            pass
+        return
+
+    # Find the partition made for a placement in a layout.
+    def _layoutPartition(self, pl):
+        owner = self.findObj(pl.disk.name)
+        if (owner is not None and owner.table is not None):
+            for part in owner.partitions:
+                if (part.sectstart == pl.start):
+                    return part
+                pass
+            pass
+        raise PartitionerErr("The partition at %d on %s did not show up"
+                             % (pl.start, pl.disk.name))
+
+    def _layoutDest(self, obj, dest):
+        obj.newDest(self, dest, self.findLine(obj))
+        dest.modified()
+        return dest
+
+    # The file descriptors to watch for device events and background
+    # jobs.
+    def eventFds(self):
+        fds = [ ]
+        if (self.uevents is not None):
+            fds.append(self.uevents.fileno())
+            pass
+        if (self.jobs is not None):
+            fds.append(self.jobs.fileno())
+            pass
+        return fds
+
+    # Called when any of eventFds() are readable.
+    def handleEvents(self):
+        if (self.jobs is not None):
+            self.jobs.handle()
+            pass
+        if (self.uevents is not None):
+            self.pending_uevents += self.uevents.read()
+            pass
+        self._processEvents()
+        return
+
+    def _processEvents(self):
+        # Don't change things out from under a popup, wait until the
+        # user is done with it.
+        if (self.popup or self.in_reread or not self.pending_uevents):
+            return
+        events = self.pending_uevents
+        self.pending_uevents = [ ]
+        try:
+            if (not _handle_uevents(self, events)):
+                self.reRead()
+            else:
+                _probe_cache.save()
+                pass
+            pass
+        except PartitionerErr as e:
+            self.popupWin(str(e))
+        except CmdErr as e:
+            self.popupWin(str(e))
+        except Exception as e:
+            (t, v, tb) = sys.exc_info()
+            self.popupWin(str(e) + "\n" + "\n".join(traceback.format_tb(tb)))
+            pass
         return
 
     def _drawCurrInfo(self):
@@ -3277,9 +4398,11 @@ class Partitioner:
 
         s += " | Units: %-2s" % self.units.name
 
-        self.footer.clear()
+        s += " | Fit: %-7s" % _placement_names[self.placement]
+
+        Screen.clear(self.footer)
         self.footer.addstr(0, 0, s)
-        self.footer.refresh()
+        Screen.refresh(self.footer)
         return
 
     def _reUnit(self):
@@ -3291,6 +4414,9 @@ class Partitioner:
         return
 
     def _handleChar(self, c):
+        if (self.jobs is not None):
+            # Nothing to do but wait.
+            return
         if (self.status_in_footer):
             self._drawCurrInfo()
             pass
@@ -3303,6 +4429,8 @@ class Partitioner:
                 self.popup = None
                 self.redraw()
                 pass
+            # Catch up on anything that happened while it was up.
+            self._processEvents()
             return
         
         if (c == 'Q'):
@@ -3330,16 +4458,29 @@ class Partitioner:
         elif (c == 'U'):
             self.units = self.units.allocNext()
             self._reUnit()
+        elif (c == 'F'):
+            i = FreeExtents.policies.index(self.placement)
+            self.placement = FreeExtents.policies[(i + 1)
+                                                  % len(FreeExtents.policies)]
+            self._drawCurrInfo()
+        elif (c == 'S'):
+            self.popup = PopupEditVals.PopupEditVals(
+                self.getWindow(), 4, 0,
+                (("Layout File", self.layout_file),),
+                50, self.layoutFileDone, None)
         elif (c == 'P'):
-            for d in self.disks + self.raids:
-                try:
-                    _reread_partition_table(d)
-                except CmdErr as e:
-                    pass
+            # These are independent, do them all at once.  Failures are
+            # ignored, the re-read will show what's there.
+            results = System.current.call_all(
+                [ (_rereadpt_cmd(d), d) for d in self.disks + self.raids ],
+                timeout=_query_timeout)
+            for r in results:
+                if (isinstance(r, Exception) and not isinstance(r, CmdErr)):
+                    raise r
                 pass
-            pass
             self.reRead()
         elif (c == '^L'):
+            Screen.repaint(self.window)
             self.redraw()
         elif (c == '?'):
             self.popupWin(_help_text, reformat=False)
@@ -3414,14 +4555,37 @@ class Partitioner:
                             + " chosen, do you really want to quit?",
                             self.queryQuit2Done, work)
             return
+        jobs = [ w for w in work if isinstance(w, JobObj) ]
+        if (jobs):
+            # These can take a while, run them from the main loop so
+            # the progress keeps getting updated.
+            jobs = JobRunner(self, jobs,
+                             functools.partial(self._quitJobsDone, work))
+            if (not jobs.finished):
+                self.jobs = jobs
+                pass
+        else:
+            self._quitJobsDone(work, "")
+            pass
+        return
+
+    def _quitJobsDone(self, work, errs):
+        self.jobs = None
         outfstab = None
         if (self.output_fstab_str):
             outfstab = open(self.output_fstab_str, "w")
             pass
-        self.processWork(work, outfstab)
+        self._writeFstab(work, outfstab)
         if (outfstab):
             outfstab.close()
             pass
+        if (errs):
+            self.popupWin(errs, self.workErrsDone)
+            return
+        self.done = True
+        return
+
+    def workErrsDone(self, o):
         self.done = True
         return
 
@@ -3433,9 +4597,9 @@ class Partitioner:
 
     def _status(self, str):
         self.status_in_footer = True
-        self.footer.clear()
+        Screen.clear(self.footer)
         self.footer.addstr(0, 0, str)
-        self.footer.refresh()
+        Screen.refresh(self.footer)
         return
 
     # The rest are wrapper functions for FlexColumnScroll
@@ -3463,6 +4627,7 @@ class Partitioner:
 
     def refresh(self):
         self.sc.refresh()
+        Screen.update()
         return
 
     pass
@@ -3758,12 +4923,14 @@ partitions without extended partitions.  GPTs support up to 128
 partitions on a disk without extended partitions and are supported by
 EFI and some BIOSes.
 
-When adding a partition, the tool picks the first free area on the
-disk that can fit the current alignment constraints and displays that
-in a prompt.  The user can then edit the values.  This can be a little
-confusing if there is a small disk area free at the start of the disk.
-The small are will be displayed, not the larger area that might be
-available farther down the disk.
+When adding a partition, the tool picks a free area on the disk that
+can fit the current alignment constraints and displays that in a
+prompt.  The user can then edit the values.  Which free area is picked
+is shown by "Fit:" at the bottom of the screen, and the "F" command
+changes it:
+  "Largest" - The largest free area, this is the default
+  "First"   - The first free area on the disk, even if it is small
+  "Best"    - The smallest free area
 
 When editing in sector mode, if the values to fit the alignment
 constraints they will be rejected and the prompt re-displayed with the
@@ -3807,11 +4974,35 @@ devices and add them to a VG and use the VG to create the LVs you need.
 Make sure to set the /boot partition(s) bootable with the "B" command.
 
 The exact configuration depends on your needs, of course.
+
+Automatic Layout
+----------------
+
+Instead of creating everything by hand, the "S" command reads a layout
+file (or give it with --layout when starting) describing what you
+want and works out where it goes on all the disks with usable
+partition tables.  Blank disks get a new GPT partition table, other
+disks are left out.  The result is shown, and nothing is done unless
+you accept it.  Each line of the file is a role, a size, and options:
+
+  raid  512M  fs=ext4 mount=/boot
+  swap  4G    copies=all
+  lvm   1G-   copies=all vg=system
+
+The roles are "fs" (a filesystem, needs fs=), "swap", "raid" (a RAID1
+of partitions on different disks, holding a filesystem or put in a
+volume group with vg=), and "lvm" (partitions put in the volume group
+vg=, which is created if needed).  Sizes are bytes with K, M, G, or T,
+a percentage of each disk's free space like "20%", or "min-max" to
+take what is left over, where either may be left off.  "copies=" is
+how many different disks get one, or "all", 2 is the default for
+raid and 1 for the rest.  A "#" starts a comment.
 """
 
 def partition(stdscr, argv):
     output_fstab = None
     input_fstab = None
+    layout = None
     for i in argv:
         if (output_fstab == ""):
             output_fstab = i
@@ -3819,6 +5010,9 @@ def partition(stdscr, argv):
         if (input_fstab == ""):
             input_fstab = i
             continue
+        if (layout == ""):
+            layout = i
+            continue
 
         if i == "--output-fstab":
             output_fstab = "" # Mark for next iteration
@@ -3826,14 +5020,28 @@ def partition(stdscr, argv):
         elif i == "--input-fstab":
             input_fstab = "" # Mark for next iteration
             pass
+        elif i == "--layout":
+            layout = "" # Mark for next iteration
+            pass
         else:
             pass
         pass
 
-    p = Partitioner(stdscr, input_fstab=input_fstab, output_fstab=output_fstab)
+    p = Partitioner(stdscr, input_fstab=input_fstab, output_fstab=output_fstab,
+                    layout=layout)
+    stdscr.nodelay(True)
     while (not p.done):
+        efds = p.eventFds()
+        (r, w, e) = select.select([ sys.stdin ] + efds, [ ], [ ],
+                                  getch_interval)
+        if ([ f for f in r if f is not sys.stdin ]):
+            p.handleEvents()
+            pass
         c = stdscr.getch()
-        p.handleChar(CursesKeyMap.keyToStr(c))
+        while (c != -1 and not p.done):
+            p.handleChar(CursesKeyMap.keyToStr(c))
+            c = stdscr.getch()
+            pass
         p.refresh()
         pass
     return
@@ -20,6 +20,7 @@
 
 import curses
 from . import DebugLog
+from . import Screen
 from . import FlexScrollPad
 
 # Break into lines that fit in the number of columns given
@@ -90,7 +91,7 @@ class Popup:
         nlines += 2 # Add space for the border
 
         self.borderwin = parent.derwin(nlines, ncols, y, x)
-        self.borderwin.clear()
+        Screen.clear(self.borderwin)
         self.borderwin.box(0, 0)
 
         # Once we add the border, have to remove it from the display window.
@@ -110,7 +111,7 @@ class Popup:
             i += 1
             pass
             
-        self.borderwin.refresh()
+        Screen.refresh(self.borderwin)
         return
 
     def handleChar(self, c):
@@ -19,6 +19,7 @@
 
 import curses
 from . import DebugLog
+from . import Screen
 
 class PopupEditVals:
     # Create a popup window at the given y,x position, each line
@@ -64,7 +65,7 @@ class PopupEditVals:
             pass
 
         self.borderwin = parent.derwin(nlines + 2, ncols + 2, y, x)
-        self.borderwin.clear()
+        Screen.clear(self.borderwin)
         self.borderwin.box(0, 0)
         
         self.w = self.borderwin.derwin(nlines, ncols, 1, 1)
@@ -83,7 +84,7 @@ class PopupEditVals:
 
         self._setCursor()
         
-        self.borderwin.refresh()
+        Screen.refresh(self.borderwin)
         return
 
     def _setCursor(self):
@@ -186,7 +187,7 @@ class PopupEditVals:
             self._setCursor()
             handled = True
             pass
-        self.w.refresh()
+        Screen.refresh(self.w)
         return handled
     
     pass
@@ -20,6 +20,7 @@
 import curses
 from . import FlexScrollColumn
 from . import DebugLog
+from . import Screen
 
 class PopupList:
     def __init__(self, parent, y, x, list, curr,
@@ -42,7 +43,7 @@ class PopupList:
         self.nlines = nlines
         
         self.borderwin = parent.derwin(nlines + 2, maxwidth + 2, y, x)
-        self.borderwin.clear()
+        Screen.clear(self.borderwin)
         self.borderwin.box(0, 0)
         
         self.w = FlexScrollColumn.FlexScrollColumn(self.borderwin, nlines,
@@ -62,7 +63,7 @@ class PopupList:
 
         self.w.highlightColumn(self.curline, 0)
 
-        self.borderwin.refresh()
+        Screen.refresh(self.borderwin)
         return
 
     def handleChar(self, c):
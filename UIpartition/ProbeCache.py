@@ -0,0 +1,242 @@
+#! /usr/bin/python
+#
+#    uipartition - A disk partitions/RAID/LVM setup tool
+#    Copyright (C) 2010-2015  MontaVista Software, LLC
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor,
+#      Boston, MA  02110-1301  USA
+
+#
+# A cache of device probe results that is kept across runs, so
+# restarting the partitioner on the same hardware doesn't have to read
+# every device again.
+#
+# Each device's results are stored with a key made from things that
+# are cheap to get from sysfs and change if the device does: its
+# identity (name, device number, serial/UUID), its size, its
+# partitions, and its write counters.  Anything written to the device,
+# by us or anyone else, bumps the write counters, so the cached results
+# are thrown away.  Partitions use the write counters of the whole
+# disk, since the disk can be written directly.
+#
+# The cache lives in /run, so it goes away on reboot.  The boot id is
+# checked too, in case it is somewhere more permanent.
+#
+
+import os
+import json
+import threading
+
+from . import SysBlock
+from . import System
+
+cache_file = "/run/uipartition/probe-cache.json"
+
+_version = 2
+
+# Fields in the sysfs stat file for writes, write sectors, discards, and
+# discard sectors.  Older kernels don't have the discard fields.
+_write_fields = (4, 6, 11, 13)
+
+# Attributes that identify a device, in order of preference
+_ident_attrs = ("wwid", "device/wwid", "device/serial", "md/uuid", "dm/uuid")
+
+def _boot_id():
+    return SysBlock.read_attr("/proc/sys/kernel/random/boot_id")
+
+def _write_counts(path):
+    stat = SysBlock.read_attr(os.path.join(path, "stat"))
+    if (stat is None):
+        return None
+    w = stat.split()
+    return [ int(w[i]) for i in _write_fields if i < len(w) ]
+
+def _partition_list(path):
+    parts = [ ]
+    try:
+        names = System.current.listdir(path)
+    except OSError:
+        return parts
+    for n in sorted(names):
+        ppath = os.path.join(path, n)
+        if (not System.current.exists(os.path.join(ppath, "partition"))):
+            continue
+        parts.append([ n, SysBlock.read_attr(os.path.join(ppath, "start")),
+                       SysBlock.read_attr(os.path.join(ppath, "size")) ])
+        pass
+    return parts
+
+# Compute the key for a SysBlock.BlockDev.
+def device_key(bdev):
+    ident = None
+    for a in _ident_attrs:
+        ident = SysBlock.read_attr(os.path.join(bdev.path, a))
+        if (ident):
+            break
+        pass
+    path = System.current.realpath(bdev.path)
+    if (bdev.kind == "part"):
+        # Writes to the disk can change the partition.
+        wpath = os.path.dirname(path)
+        start = SysBlock.read_attr(os.path.join(path, "start"))
+    else:
+        wpath = path
+        start = None
+        pass
+    return [ bdev.name, list(bdev.devnum), bdev.size, bdev.sectsize, ident,
+             start, _partition_list(path), _write_counts(wpath) ]
+
+class ProbeCache:
+    def __init__(self, filename=cache_file):
+        self.filename = filename
+        self.enabled = True
+        self.lock = threading.Lock()
+        self.entries = { }
+        self.used = { }
+        self.pending = { }
+        return
+
+    # Read the cache file, if there is one.
+    def load(self):
+        entries = { }
+        if (self.enabled):
+            try:
+                f = open(self.filename)
+                try:
+                    data = json.load(f)
+                finally:
+                    f.close()
+                    pass
+                if (data.get("version") == _version
+                    and data.get("boot_id") == _boot_id()):
+                    entries = data.get("devices", { })
+                    pass
+                pass
+            except (IOError, OSError, ValueError, AttributeError):
+                pass
+            pass
+        with self.lock:
+            self.entries = entries
+            self.used = { }
+            self.pending = { }
+            pass
+        return
+
+    # Write out the entries that were used or added since load().
+    def save(self):
+        if (not self.enabled):
+            return
+        with self.lock:
+            data = { "version": _version, "boot_id": _boot_id(),
+                     "devices": self.used }
+            pass
+        tmpname = self.filename + ".tmp"
+        try:
+            d = os.path.dirname(self.filename)
+            if (not os.path.isdir(d)):
+                os.makedirs(d, 0o700)
+                pass
+            f = open(tmpname, "w")
+            try:
+                json.dump(data, f)
+            finally:
+                f.close()
+                pass
+            os.replace(tmpname, self.filename)
+        except (IOError, OSError):
+            # It's only a cache.
+            pass
+        return
+
+    def _lookup(self, devname, bdev):
+        if (bdev is None):
+            bdev = SysBlock.lookup(devname)
+            if (bdev is None):
+                return (None, None)
+            pass
+        return (bdev.name, device_key(bdev))
+
+    # Return the cached value of "what" for the device, or None if there
+    # isn't one or the device has changed.  bdev is the
+    # SysBlock.BlockDev for the device, if the caller has it.
+    def get(self, devname, what, bdev=None):
+        if (not self.enabled):
+            return None
+        (name, key) = self._lookup(devname, bdev)
+        if (name is None):
+            return None
+        with self.lock:
+            e = self.entries.get(name)
+            if (e is None or e["key"] != key or what not in e["values"]):
+                # Remember the key from before the probe for put(), in
+                # case the device changes while it is being probed.
+                self.pending[(name, what)] = key
+                return None
+            self.used[name] = e
+            return e["values"][what]
+        return None
+
+    # Store a value for the device.  It must be something that can be
+    # converted to JSON.
+    def put(self, devname, what, value, bdev=None):
+        if (not self.enabled):
+            return
+        (name, key) = self._lookup(devname, bdev)
+        if (name is None):
+            return
+        with self.lock:
+            key = self.pending.pop((name, what), key)
+            e = self.entries.get(name)
+            if (e is None or e["key"] != key):
+                e = { "key": key, "values": { } }
+                self.entries[name] = e
+                pass
+            e["values"][what] = value
+            self.used[name] = e
+            pass
+        return
+
+    # The device was written, forget about it.
+    def invalidate(self, devname):
+        bdev = SysBlock.lookup(devname)
+        if (bdev is None):
+            return
+        with self.lock:
+            if (bdev.name in self.entries):
+                del self.entries[bdev.name]
+                pass
+            if (bdev.name in self.used):
+                del self.used[bdev.name]
+                pass
+            pass
+        return
+
+    pass
+
+# Time computing the keys of all the block devices, which is the cost
+# of a warm start:
+#   python -m UIpartition.ProbeCache
+if __name__== '__main__':
+    import time
+
+    start = time.time()
+    devs = SysBlock.all_devs()
+    for d in devs:
+        key = device_key(d)
+        pass
+    t = time.time() - start
+    print("%d devices in %.1fms, %.1fus per device"
+          % (len(devs), t * 1000, t * 1000000 / max(len(devs), 1)))
+    pass
@@ -0,0 +1,222 @@
+#! /usr/bin/python
+#
+#    uipartition - A disk partitions/RAID/LVM setup tool
+#    Copyright (C) 2010-2015  MontaVista Software, LLC
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor,
+#      Boston, MA  02110-1301  USA
+
+
+#
+# Follow the progress of long running commands (mkfs, mkswap) from
+# their output as it comes in, and the resync of any md RAIDs they are
+# writing to from /proc/mdstat, so there is something to show the user
+# besides a message that doesn't change for minutes.
+#
+# A Progress is updated from the thread running the command and read
+# from the one doing the display.  Everything in it is replaced, never
+# modified in place, so no locking is needed.
+#
+
+import os
+import re
+import time
+
+from . import System
+
+# mke2fs prints "Writing inode tables: 12/80" and backs up over the
+# numbers with backspaces to print the next one, so the numbers often
+# come without the label.
+_e2fs_re = re.compile(r"^(?:(.*?):?\s+)?(\d+)/(\d+)$")
+
+# The part of an md's /proc/mdstat entry about a running resync, like
+#   [==>..................]  resync = 12.6% (132096/1048000) finish=...
+_mdstat_re = re.compile(r"(resync|recovery|reshape|check|repair)\s*=\s*"
+                        r"([0-9.]+)%")
+
+# Returns (fraction, status) for a line of mke2fs output.  Either may
+# be None if the line doesn't have it.
+def parse_e2fs(line):
+    m = _e2fs_re.match(line)
+    if (m is None):
+        return (None, line)
+    n = int(m.group(2))
+    total = int(m.group(3))
+    if (total <= 0):
+        return (None, m.group(1))
+    return (min(n, total) / total, m.group(1))
+
+# Returns (fraction, status) for any line of output from a command we
+# know nothing about.  The status is just the line.
+def parse_other(line):
+    return (None, line)
+
+_parsers = {
+    "mkfs.ext2": parse_e2fs,
+    "mkfs.ext3": parse_e2fs,
+    "mkfs.ext4": parse_e2fs,
+    "mke2fs": parse_e2fs,
+}
+
+# Return { mdname: (action, fraction) } for all the md devices with a
+# resync or similar running, from the contents of /proc/mdstat.
+def parse_mdstat(text):
+    syncs = { }
+    name = None
+    for l in text.split("\n"):
+        if (l.startswith("md")):
+            name = l.split()[0]
+            continue
+        if (name is None):
+            continue
+        m = _mdstat_re.search(l)
+        if (m is not None):
+            syncs[name] = (m.group(1), float(m.group(2)) / 100)
+            pass
+        pass
+    return syncs
+
+def read_mdstat():
+    s = System.current.read_attr("/proc/mdstat")
+    if (s is None):
+        return { }
+    return parse_mdstat(s)
+
+# Return a progress bar width characters wide, like "[====    ]  50%".
+def bar(fraction, width):
+    pct = " %3d%%" % int(fraction * 100)
+    n = width - len(pct) - 2
+    if (n <= 0):
+        return pct.strip()
+    filled = int(fraction * n)
+    return "[" + "=" * filled + " " * (n - filled) + "]" + pct
+
+class Progress:
+    # mds are the md devices (without the /dev/) the work is on.  notify
+    # is called, from the working thread, whenever something changes.
+    def __init__(self, mds=(), notify=None):
+        self.mds = mds
+        self.notify = notify
+        self.start = time.time()
+        self.fraction = None
+        self.status = ""
+        self.mdsync = ""
+        self.step = 0
+        self.nsteps = 1
+        self._parser = parse_other
+        self._buf = ""
+        return
+
+    def _notify(self):
+        if (self.notify):
+            self.notify()
+            pass
+        return
+
+    # A new command is starting, the n'th of count.
+    def startCmd(self, cmd, n, count):
+        self.step = n
+        self.nsteps = count
+        self._parser = _parsers.get(os.path.basename(cmd[0]), parse_other)
+        self._buf = ""
+        self.status = ""
+        self._notify()
+        return
+
+    # Output from the command, from stdout or stderr.
+    def output(self, data):
+        # Progress is written over itself with backspaces or carriage
+        # returns, treat those like the end of a line.
+        lines = re.split("[\r\n\b]", self._buf + data.decode("utf8",
+                                                             "replace"))
+        self._buf = lines[-1]
+        changed = False
+        for l in lines[:-1]:
+            l = l.strip()
+            if (not l):
+                continue
+            (fraction, status) = self._parser(l)
+            if (fraction is not None):
+                self.fraction = (self.step + fraction) / self.nsteps
+                pass
+            if (status is not None):
+                self.status = status
+                pass
+            changed = True
+            pass
+        if (changed):
+            self._notify()
+            pass
+        return
+
+    # Called every so often while the command runs, to check on things
+    # that don't come from its output.
+    def poll(self):
+        if (self.mds):
+            syncs = read_mdstat()
+            s = [ ]
+            for md in self.mds:
+                if (md in syncs):
+                    (action, fraction) = syncs[md]
+                    s.append("%s %s %.1f%%" % (md, action, fraction * 100))
+                    pass
+                pass
+            self.mdsync = ", ".join(s)
+            pass
+        self._notify()
+        return
+
+    def elapsed(self):
+        return int(time.time() - self.start)
+
+    # Lines to display for this, width characters wide.
+    def lines(self, width):
+        l = [ ]
+        s = self.status
+        if (self.mdsync):
+            s += " (%s)" % self.mdsync
+            pass
+        l.append(("%s %ds" % (s, self.elapsed()))[0:width])
+        if (self.fraction is not None):
+            l.append(bar(self.fraction, width))
+            pass
+        return l
+
+    pass
+
+# Print the progress of a command as it runs:
+#   python -m UIpartition.Progress command args...
+if __name__== '__main__':
+    import sys
+    import subprocess
+
+    def show():
+        sys.stdout.write("\r%-70s" % " | ".join(p.lines(70)))
+        sys.stdout.flush()
+        return
+
+    p = Progress(mds=list(read_mdstat().keys()), notify=show)
+    p.startCmd(sys.argv[1:], 0, 1)
+    prog = subprocess.Popen(sys.argv[1:], stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+    while True:
+        data = os.read(prog.stdout.fileno(), 4096)
+        if (not data):
+            break
+        p.output(data)
+        pass
+    prog.wait()
+    sys.stdout.write("\n")
+    pass
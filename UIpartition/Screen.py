@@ -0,0 +1,114 @@
+#! /usr/bin/python
+#
+#    uipartition - A disk partitions/RAID/LVM setup tool
+#    Copyright (C) 2010-2015  MontaVista Software, LLC
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor,
+#      Boston, MA  02110-1301  USA
+
+
+#
+# How window changes get sent to the terminal.
+#
+# Normally each window is refreshed as soon as it changes and cleared
+# windows are repainted from scratch.  That's fine on a local console,
+# but over a slow serial line it sends far more than is needed: a
+# window's clear() makes curses clear the whole terminal and repaint
+# everything on the next refresh, even if only the status line changed.
+#
+# In low bandwidth mode windows are erased instead, so curses compares
+# what gets drawn against what it knows is on the terminal and only
+# sends the cells that changed.  Refreshes only update curses' idea of
+# the screen, update() sends it all out at once, and curses is allowed
+# to use the terminal's insert/delete line and scroll regions.  The
+# terminal is only repainted from scratch when it is really messed up,
+# see repaint().
+#
+
+import os
+import curses
+
+low_bandwidth = False
+
+def set_low_bandwidth(on, w=None):
+    global low_bandwidth
+    low_bandwidth = on
+    if (w is not None):
+        setup_window(w)
+        pass
+    return
+
+# Called on new windows.
+def setup_window(w):
+    if (low_bandwidth):
+        w.idlok(True)
+        pass
+    return
+
+# Blank a window.
+def clear(w):
+    if (low_bandwidth):
+        w.erase()
+    else:
+        w.clear()
+        pass
+    return
+
+# Push a window's changes out, or just mark them to go out on the next
+# update() in low bandwidth mode.
+def refresh(w):
+    if (low_bandwidth):
+        w.noutrefresh()
+    else:
+        w.refresh()
+        pass
+    return
+
+# Send everything that has changed to the terminal.
+def update():
+    if (low_bandwidth):
+        curses.doupdate()
+        pass
+    return
+
+# The terminal doesn't match what curses thinks is there (line noise,
+# kernel messages on the console, etc.), repaint all of it on the next
+# update.  w must be a window covering the whole screen.
+def repaint(w):
+    w.clearok(True)
+    w.noutrefresh()
+    return
+
+# Run argv on a pseudo-terminal connected to ours, and return (status,
+# count) where status is the wait status of the program and count is
+# the number of bytes it sent to the terminal.
+def run_counted(argv):
+    import pty
+
+    count = [ 0 ]
+    def master_read(fd):
+        data = os.read(fd, 4096)
+        count[0] += len(data)
+        return data
+
+    # The new terminal starts out with no size, tell curses ours.
+    try:
+        (cols, lines) = os.get_terminal_size(0)
+        os.environ["LINES"] = str(lines)
+        os.environ["COLUMNS"] = str(cols)
+    except OSError:
+        pass
+    status = pty.spawn(argv, master_read)
+    return (status, count[0])
@@ -0,0 +1,289 @@
+#! /usr/bin/python
+#
+#    uipartition - A disk partitions/RAID/LVM setup tool
+#    Copyright (C) 2010-2015  MontaVista Software, LLC
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor,
+#      Boston, MA  02110-1301  USA
+
+#
+# Recognize what is on a block device by looking at the superblock
+# signatures directly, instead of running "file" or "blkid" on it.
+#
+# Only the things the partitioner cares about are recognized: ext2/3/4,
+# XFS, VFAT, swap, md RAID members (0.90 and 1.x metadata), and LVM2
+# physical volumes.  The types returned are the same names blkid uses
+# for TYPE=.
+#
+
+import struct
+
+from . import System
+
+# How much of the beginning of the device is read.  This covers swap
+# signatures for page sizes up to 64KiB and all the superblocks that are
+# at the front of the device.
+_head_size = 65536
+
+# md 0.90 superblocks are in the last 64KiB-aligned 64KiB block of the
+# device, 1.0 superblocks are 8KiB from the end.  Both are in this much
+# of the end of the device.
+_md_reserved = 65536
+
+_md_magic = 0xa92b4efc
+
+_swap_page_sizes = (4096, 8192, 16384, 32768, 65536)
+
+# ext feature bits that are not in ext2/ext3, from e2fsprogs/libblkid.
+_ext_compat_has_journal = 0x0004
+_ext_incompat_journal_dev = 0x0008
+_ext2_incompat_supp = 0x0002 | 0x0010
+_ext3_incompat_supp = 0x0002 | 0x0004 | 0x0010
+_ext3_ro_compat_supp = 0x0001 | 0x0002 | 0x0004
+
+def _le16(b, off):
+    return struct.unpack_from("<H", b, off)[0]
+
+def _le32(b, off):
+    return struct.unpack_from("<I", b, off)[0]
+
+def _fmt_uuid(b):
+    h = b.hex()
+    return "%s-%s-%s-%s-%s" % (h[0:8], h[8:12], h[12:16], h[16:20], h[20:32])
+
+# LVM stores the PV UUID as 32 characters without dashes, blkid
+# displays it broken up like this.
+def _fmt_lvm_uuid(s):
+    parts = [ ]
+    pos = 0
+    for l in (6, 4, 4, 4, 4, 4, 6):
+        parts.append(s[pos:pos+l])
+        pos += l
+        pass
+    return "-".join(parts)
+
+def _probe_md_at(b, off, version):
+    if (off < 0 or off + 256 > len(b)):
+        return None
+    # 0.90 superblocks are in host byte order, so accept either order.
+    if (version == 0):
+        for order in ("<", ">"):
+            (magic, major) = struct.unpack_from(order + "II", b, off)
+            if (magic == _md_magic and major == 0):
+                return _fmt_uuid(b[off+20:off+24] + b[off+52:off+64])
+            pass
+        return None
+    (magic, major) = struct.unpack_from("<II", b, off)
+    if (magic == _md_magic and major == 1):
+        return _fmt_uuid(b[off+16:off+32])
+    return None
+
+# Return a list of (offset, uuid) for all the md superblocks found, in
+# order of preference.  Arguments are the same as probe_data().
+def md_superblocks(head, tail=None, tailoff=0, size=0):
+    sbs = [ ]
+    if (tail is not None and size >= 2 * _md_reserved):
+        # 0.90 metadata
+        off = (size & ~(_md_reserved - 1)) - _md_reserved
+        uuid = _probe_md_at(tail, off - tailoff, 0)
+        if (uuid):
+            sbs.append((off, uuid))
+            pass
+        # 1.0 metadata
+        off = ((size // 512 - 16) & ~7) * 512
+        uuid = _probe_md_at(tail, off - tailoff, 1)
+        if (uuid):
+            sbs.append((off, uuid))
+            pass
+        pass
+    # 1.1 metadata is at the beginning, 1.2 at 4KiB
+    for off in (0, 4096):
+        uuid = _probe_md_at(head, off, 1)
+        if (uuid):
+            sbs.append((off, uuid))
+            pass
+        pass
+    return sbs
+
+def _probe_md(head, tail, tailoff, size):
+    sbs = md_superblocks(head, tail, tailoff, size)
+    if (sbs):
+        return sbs[0][1]
+    return None
+
+def _probe_lvm(head):
+    # The label may be in any of the first four sectors.
+    for sect in range(0, 4):
+        lbl = head[sect * 512:(sect + 1) * 512]
+        if (len(lbl) < 512):
+            break
+        if (lbl[0:8] != b"LABELONE" or lbl[24:32] != b"LVM2 001"):
+            continue
+        off = _le32(lbl, 20)
+        if (off + 32 > 512):
+            return ""
+        return _fmt_lvm_uuid(lbl[off:off+32].decode("ascii", "replace"))
+    return None
+
+def _probe_xfs(head):
+    if (head[0:4] == b"XFSB"):
+        return ("xfs", _fmt_uuid(head[32:48]))
+    return None
+
+def _probe_ext(head):
+    if (len(head) < 2048 or _le16(head, 1024 + 56) != 0xef53):
+        return None
+    compat = _le32(head, 1024 + 92)
+    incompat = _le32(head, 1024 + 96)
+    ro_compat = _le32(head, 1024 + 100)
+    if (incompat & _ext_incompat_journal_dev):
+        # An external journal, not a filesystem.
+        return None
+    if ((incompat & ~_ext3_incompat_supp)
+        or (ro_compat & ~_ext3_ro_compat_supp)):
+        fstype = "ext4"
+    elif (compat & _ext_compat_has_journal):
+        fstype = "ext3"
+    elif (incompat & ~_ext2_incompat_supp):
+        fstype = "ext4"
+    else:
+        fstype = "ext2"
+        pass
+    return (fstype, _fmt_uuid(head[1024 + 104:1024 + 120]))
+
+def _probe_vfat(head):
+    if (len(head) < 512 or head[510:512] != b"\x55\xaa"):
+        return None
+    if (head[82:87] == b"FAT32"):
+        volid = _le32(head, 67)
+    elif (head[54:59] in (b"FAT12", b"FAT16", b"FAT  ")):
+        volid = _le32(head, 39)
+    else:
+        return None
+    return ("vfat", "%04X-%04X" % (volid >> 16, volid & 0xffff))
+
+def _probe_swap(head):
+    for ps in _swap_page_sizes:
+        if (ps > len(head)):
+            break
+        sig = head[ps - 10:ps]
+        if (sig == b"SWAPSPACE2"):
+            return ("swap", _fmt_uuid(head[1024 + 12:1024 + 28]))
+        if (sig == b"SWAP-SPACE"):
+            return ("swap", None)
+        pass
+    return None
+
+# Work out what is on a device from the data at its beginning (head)
+# and, optionally, its end (tail, which starts at tailoff bytes into the
+# device).  size is the size of the device in bytes.  Returns (type,
+# uuid), with type None if nothing was recognized.
+def probe_data(head, tail=None, tailoff=0, size=0):
+    # RAID and LVM signatures take priority, a RAID1 member will also
+    # have the filesystem of the array on it.
+    uuid = _probe_md(head, tail, tailoff, size)
+    if (uuid):
+        return ("linux_raid_member", uuid)
+    uuid = _probe_lvm(head)
+    if (uuid is not None):
+        return ("LVM2_member", uuid or None)
+    for f in (_probe_xfs, _probe_ext, _probe_vfat, _probe_swap):
+        r = f(head)
+        if (r):
+            return r
+        pass
+    return (None, None)
+
+# Read the parts of the device that hold signatures.  Returns (head,
+# tail, tailoff, size).
+def read_signature_areas(devname):
+    dev = System.current.open_dev(devname)
+    try:
+        size = dev.size()
+        head = dev.pread(_head_size, 0)
+        tail = None
+        tailoff = 0
+        if (size >= 2 * _md_reserved):
+            tailoff = (size & ~(_md_reserved - 1)) - _md_reserved
+            tail = dev.pread(size - tailoff, tailoff)
+            pass
+    finally:
+        dev.close()
+        pass
+    return (head, tail, tailoff, size)
+
+# Return (type, uuid) for the given device, or (None, None) if nothing
+# was recognized or the device could not be read.
+def probe(devname):
+    try:
+        (head, tail, tailoff, size) = read_signature_areas(devname)
+    except OSError:
+        return (None, None)
+    return probe_data(head, tail, tailoff, size)
+
+# What "file" says about the various types, for comparison.
+_file_strs = (("ext2", "ext2 filesystem"), ("ext3", "ext3 filesystem"),
+              ("ext4", "ext4 filesystem"), ("xfs", "XFS filesystem"),
+              ("vfat", "mkdosfs"), ("swap", "swap file"))
+
+def _probe_with_file(devname):
+    import subprocess
+    out = subprocess.run(("file", "--special-files", "--dereference",
+                          devname),
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                         close_fds=True).stdout.decode("utf8")
+    for (t, s) in _file_strs:
+        if (s in out):
+            return t
+        pass
+    return None
+
+# Benchmark the probe against the old "file" based probe:
+#   python -m UIpartition.Superblock [-n count] device ...
+if __name__== '__main__':
+    import sys
+    import time
+
+    count = 100
+    args = sys.argv[1:]
+    if (len(args) >= 2 and args[0] == "-n"):
+        count = int(args[1])
+        args = args[2:]
+        pass
+    if (not args):
+        sys.stderr.write("Usage: %s [-n count] device ...\n" % sys.argv[0])
+        sys.exit(1)
+        pass
+
+    for dev in args:
+        (t, uuid) = probe(dev)
+        start = time.time()
+        for i in range(0, count):
+            probe(dev)
+            pass
+        ptime = (time.time() - start) / count
+
+        ft = _probe_with_file(dev)
+        start = time.time()
+        for i in range(0, count):
+            _probe_with_file(dev)
+            pass
+        ftime = (time.time() - start) / count
+
+        print("%s: probe %s (%s) %.1fus, file %s %.1fus, %.0fx faster"
+              % (dev, t, uuid, ptime * 1000000, ft, ftime * 1000000,
+                 ftime / ptime))
+        pass
+    pass
@@ -0,0 +1,162 @@
+#! /usr/bin/python
+#
+#    uipartition - A disk partitions/RAID/LVM setup tool
+#    Copyright (C) 2010-2015  MontaVista Software, LLC
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor,
+#      Boston, MA  02110-1301  USA
+
+#
+# Find the block devices on the system from /sys/class/block and get
+# their basic information from sysfs.
+#
+
+import os
+import re
+
+from . import System
+
+sysblock = "/sys/class/block"
+
+# Devices with these prefixes are never something we partition.
+_skip_prefixes = ("loop", "ram", "zram", "sr", "fd")
+
+# The eMMC boot and RPMB areas show up as separate devices.
+_mmc_special = re.compile(r"^mmcblk[0-9]+(boot[0-9]+|rpmb)$")
+
+# Read a sysfs attribute, returning None if it doesn't exist.
+def read_attr(path):
+    return System.current.read_attr(path)
+
+def _read_int_attr(path, default=0):
+    v = read_attr(path)
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return default
+    return default
+
+# Information about one entry in /sys/class/block.  kind is one of:
+#   "disk" - Something to partition
+#   "part" - A partition of some other device
+#   "md"   - An md RAID device
+#   "dm"   - A device mapper device that isn't a disk (LVM, crypt, etc.)
+#   None   - Something else we ignore
+class BlockDev:
+    def __init__(self, name):
+        self.name = name
+        self.path = os.path.join(sysblock, name)
+        self.devname = "/dev/" + name
+
+        # sysfs sizes are always in 512 byte units
+        self.size = _read_int_attr(os.path.join(self.path, "size"))
+        self.sectsize = _read_int_attr(os.path.join(self.path, "queue",
+                                                    "logical_block_size"),
+                                       512)
+        if (self.sectsize <= 0):
+            self.sectsize = 512
+            pass
+        self.removable = (read_attr(os.path.join(self.path, "removable"))
+                          == "1")
+        self.partition = _read_int_attr(os.path.join(self.path, "partition"))
+        self.dmname = read_attr(os.path.join(self.path, "dm", "name"))
+        dev = read_attr(os.path.join(self.path, "dev"))
+        try:
+            (major, minor) = dev.split(":")
+            self.devnum = (int(major), int(minor))
+        except (AttributeError, ValueError):
+            self.devnum = (0, 0)
+            pass
+        self.kind = self._getKind()
+        return
+
+    def _getKind(self):
+        name = self.name
+        if (self.partition):
+            return "part"
+        if (name.startswith("md")):
+            return "md"
+        if (self.dmname is not None):
+            # Multipath maps are disks, the rest are built on disks.
+            dmuuid = read_attr(os.path.join(self.path, "dm", "uuid"))
+            if (dmuuid and dmuuid.startswith("mpath-")):
+                self.devname = "/dev/mapper/" + self.dmname
+                return "disk"
+            return "dm"
+        if (name.startswith(_skip_prefixes) or _mmc_special.match(name)):
+            return None
+        if (read_attr(os.path.join(self.path, "hidden")) == "1"):
+            # NVMe multipath controller paths
+            return None
+        if (name.startswith("hd")):
+            # Make sure it is actually a disk
+            if (read_attr(os.path.join(self.path, "device", "media"))
+                != "disk"):
+                return None
+            pass
+        if (self.size == 0):
+            # Empty media slots and such
+            return None
+        if (self._inMultipath()):
+            # One path of a multipath disk, the map is the disk.
+            return None
+        return "disk"
+
+    # Is the device held by a multipath map?
+    def _inMultipath(self):
+        try:
+            holders = System.current.listdir(os.path.join(self.path,
+                                                          "holders"))
+        except OSError:
+            return False
+        for h in holders:
+            dmuuid = read_attr(os.path.join(sysblock, h, "dm", "uuid"))
+            if (dmuuid and dmuuid.startswith("mpath-")):
+                return True
+            pass
+        return False
+
+    # The number of logical sectors on the device
+    def numSects(self):
+        return self.size * 512 // self.sectsize
+
+    pass
+
+# Return the BlockDev for the given name (without the /dev/), or None if
+# it doesn't exist.
+def get(name):
+    if (not System.current.exists(os.path.join(sysblock, name))):
+        return None
+    return BlockDev(name)
+
+# Return the BlockDev for a device file, following any symlinks (like
+# /dev/mapper/xxx to /dev/dm-N), or None if it doesn't exist.
+def lookup(devname):
+    return get(os.path.basename(System.current.realpath(devname)))
+
+# Return a list of all the block devices, in device number order.
+# Raises OSError if sysfs can't be read.
+def all_devs():
+    devs = [ BlockDev(name) for name in System.current.listdir(sysblock) ]
+    devs.sort(key=lambda d: d.devnum)
+    return devs
+
+if __name__== '__main__':
+    for d in all_devs():
+        print("%-12s %-6s %12d %5d %s %s" % (d.name, d.kind, d.numSects(),
+                                            d.sectsize, d.removable,
+                                            d.devname))
+        pass
+    pass
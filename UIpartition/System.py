@@ -0,0 +1,202 @@
+#! /usr/bin/python
+#
+#    uipartition - A disk partitions/RAID/LVM setup tool
+#    Copyright (C) 2010-2015  MontaVista Software, LLC
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor,
+#      Boston, MA  02110-1301  USA
+
+#
+# Everything the partitioner finds out about the machine goes through
+# the System object in "current": running commands, reading sysfs and
+# /proc, looking at /dev, and reading from block devices.  Normally that
+# is the real machine, but another System can be put in its place with
+# set_current(), to run against a made up machine for benchmarks (see
+# Benchmark) or one that was recorded earlier (see Capture).
+#
+# The wipes done when the user quits (see Wipe) don't go through here,
+# so if the System isn't "real" they aren't done.
+#
+
+import os
+import fcntl
+import stat
+import struct
+import selectors
+import subprocess
+
+from . import AsyncCmd
+from . import LVMShell
+from . import UEvent
+
+# How often stream() calls progress.poll(), in seconds.
+_poll_interval = 1.0
+
+# A block device opened for reading.
+class Device:
+    def __init__(self, devname):
+        self.fd = os.open(devname, os.O_RDONLY | os.O_CLOEXEC)
+        return
+
+    # Read n bytes at offset.  May return less at the end of the device.
+    def pread(self, n, offset):
+        return os.pread(self.fd, n, offset)
+
+    # The size of the device in bytes
+    def size(self):
+        return os.lseek(self.fd, 0, os.SEEK_END)
+
+    # Do an ioctl that returns a number in the given struct format.
+    def ioctl_int(self, req, fmt="I"):
+        b = fcntl.ioctl(self.fd, req, bytes(struct.calcsize(fmt)))
+        return struct.unpack(fmt, b)[0]
+
+    def close(self):
+        os.close(self.fd)
+        return
+
+    pass
+
+class System:
+    # Is this the machine we are running on?
+    real = True
+
+    def __init__(self):
+        self.executor = AsyncCmd.Executor()
+
+        # LVM commands are run through one lvm shell if this is set,
+        # see LVMShell.
+        self.lvm_shell = LVMShell.LVMShell()
+        return
+
+    # Run a command and return its output, see AsyncCmd.Executor.call().
+    def call(self, cmd, device=None, timeout=None):
+        return self.executor.call(cmd, device, timeout)
+
+    # Run a batch of (cmd, device) at once, see
+    # AsyncCmd.Executor.call_all().
+    def call_all(self, cmds, timeout=None):
+        return self.executor.call_all(cmds, timeout)
+
+    # Like call(), but pass the output to progress.output() as it comes
+    # in, and call progress.poll() every so often while waiting.
+    def stream(self, cmd, progress):
+        prog = subprocess.Popen(cmd,
+                                stdin=subprocess.DEVNULL,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, close_fds=True)
+        out = { prog.stdout: b"", prog.stderr: b"" }
+        sel = selectors.DefaultSelector()
+        sel.register(prog.stdout, selectors.EVENT_READ)
+        sel.register(prog.stderr, selectors.EVENT_READ)
+        try:
+            while (sel.get_map()):
+                events = sel.select(_poll_interval)
+                if (not events):
+                    progress.poll()
+                    continue
+                for (key, mask) in events:
+                    data = os.read(key.fd, 4096)
+                    if (not data):
+                        sel.unregister(key.fileobj)
+                        continue
+                    out[key.fileobj] += data
+                    progress.output(data)
+                    pass
+                pass
+            prog.wait()
+        finally:
+            sel.close()
+            prog.stdout.close()
+            prog.stderr.close()
+            pass
+        outs = out[prog.stdout].decode("utf8", "replace")
+        err = out[prog.stderr].decode("utf8", "replace")
+        if (prog.returncode != 0):
+            raise AsyncCmd.CmdErr(str(cmd), prog.returncode, outs, err)
+        return outs
+
+    # Read a sysfs or /proc attribute, returning None if it doesn't
+    # exist.
+    def read_attr(self, path):
+        try:
+            f = open(path)
+        except (IOError, OSError):
+            return None
+        try:
+            return f.read().strip()
+        except (IOError, OSError):
+            return None
+        finally:
+            f.close()
+            pass
+        return None
+
+    # Return the contents of a file.  Raises OSError if it can't be read.
+    def read_file(self, path):
+        f = open(path, "r")
+        try:
+            return f.read()
+        finally:
+            f.close()
+            pass
+        return None
+
+    # Raises OSError if the directory can't be read.
+    def listdir(self, path):
+        return os.listdir(path)
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def isdir(self, path):
+        return os.path.isdir(path)
+
+    def realpath(self, path):
+        return os.path.realpath(path)
+
+    # Raises OSError if it isn't a link.
+    def readlink(self, path):
+        return os.readlink(path)
+
+    # Return the device number of the given block device, or None if it
+    # doesn't exist.
+    def dev_number(self, devname):
+        try:
+            st = os.stat(devname)
+        except OSError:
+            return None
+        if (not stat.S_ISBLK(st.st_mode)):
+            return None
+        return st.st_rdev
+
+    # Open a block device for reading.  Raises OSError if it can't be.
+    def open_dev(self, devname):
+        return Device(devname)
+
+    # Return a listener for block device events (see UEvent), or None.
+    def open_listener(self):
+        return UEvent.open_listener()
+
+    pass
+
+current = System()
+
+# Use the given System from now on, returning the one that was in use.
+def set_current(system):
+    global current
+    old = current
+    current = system
+    return old
@@ -0,0 +1,256 @@
+#! /usr/bin/python
+#
+#    uipartition - A disk partitions/RAID/LVM setup tool
+#    Copyright (C) 2010-2015  MontaVista Software, LLC
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor,
+#      Boston, MA  02110-1301  USA
+
+#
+# Listen for block devices coming and going.
+#
+# The kernel uevent netlink socket is used if we can open it.  If not
+# (no permission, or no netlink in a container) inotify on /dev is used
+# instead, which sees devices being created, removed, and written, but
+# doesn't get any other information about them.
+#
+# Listeners have a fileno() that can be passed to select() and a read()
+# that returns all the pending events without blocking.
+#
+
+import os
+import errno
+import socket
+import struct
+import stat
+
+NETLINK_KOBJECT_UEVENT = 15
+
+# The kernel sends to multicast group 1, udev re-sends to group 2 in its
+# own format.  We want the kernel ones.
+_kernel_group = 1
+
+_rcvbuf_size = 1024 * 1024
+
+class UEvent:
+    # action is "add", "remove", "change", etc.  "overflow" means events
+    # were lost, so everything needs to be re-read.
+    def __init__(self, action, devname=None, subsystem="block", devtype=None,
+                 env=None):
+        self.action = action
+        self.devname = devname
+        self.subsystem = subsystem
+        self.devtype = devtype
+        if (env is None):
+            env = { }
+            pass
+        self.env = env
+        return
+
+    def __str__(self):
+        return "%s %s %s %s" % (self.action, self.subsystem, self.devtype,
+                                self.devname)
+
+    pass
+
+# Parse a kernel uevent message, "action@devpath" followed by
+# KEY=value strings, all nil terminated.  Returns None if it isn't one.
+def parse(data):
+    parts = data.split(b"\0")
+    if (b"@" not in parts[0]):
+        return None
+    env = { }
+    for kv in parts[1:]:
+        kv = kv.decode("utf8", "replace")
+        (k, sep, v) = kv.partition("=")
+        if (sep):
+            env[k] = v
+            pass
+        pass
+    devname = env.get("DEVNAME")
+    if (devname and not devname.startswith("/")):
+        devname = "/dev/" + devname
+        pass
+    return UEvent(env.get("ACTION"), devname, env.get("SUBSYSTEM"),
+                  env.get("DEVTYPE"), env)
+
+class NetlinkListener:
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_NETLINK,
+                                  (socket.SOCK_DGRAM | socket.SOCK_NONBLOCK
+                                   | socket.SOCK_CLOEXEC),
+                                  NETLINK_KOBJECT_UEVENT)
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                 _rcvbuf_size)
+        except OSError:
+            pass
+        try:
+            self.sock.bind((0, _kernel_group))
+        except OSError:
+            self.sock.close()
+            raise
+        return
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def read(self):
+        events = [ ]
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                if (e.errno == errno.ENOBUFS):
+                    # The kernel dropped some, we can't know what.
+                    events.append(UEvent("overflow"))
+                    continue
+                raise
+            ev = parse(data)
+            if (ev is not None):
+                events.append(ev)
+                pass
+            pass
+        return events
+
+    def close(self):
+        self.sock.close()
+        return
+
+    pass
+
+# From <sys/inotify.h>
+_IN_CLOSE_WRITE = 0x00000008
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+_inotify_event = struct.Struct("iIII")
+
+class InotifyListener:
+    watchdirs = ("/dev", "/dev/mapper")
+
+    def __init__(self):
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if (self.fd < 0):
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self.wds = { }
+        for d in self.watchdirs:
+            if (not os.path.isdir(d)):
+                continue
+            wd = libc.inotify_add_watch(self.fd, d.encode(),
+                                        _IN_CREATE | _IN_DELETE
+                                        | _IN_CLOSE_WRITE)
+            if (wd >= 0):
+                self.wds[wd] = d
+                pass
+            pass
+        if (not self.wds):
+            os.close(self.fd)
+            raise OSError(errno.ENOENT, "Unable to watch /dev")
+        return
+
+    def fileno(self):
+        return self.fd
+
+    def _event(self, mask, devname):
+        if (mask & _IN_Q_OVERFLOW):
+            return UEvent("overflow")
+        if (mask & _IN_DELETE):
+            # It's gone, so we can't tell what it was.
+            return UEvent("remove", devname)
+        try:
+            if (not stat.S_ISBLK(os.stat(devname).st_mode)):
+                return None
+        except OSError:
+            return None
+        if (mask & _IN_CREATE):
+            return UEvent("add", devname)
+        return UEvent("change", devname)
+
+    def read(self):
+        events = [ ]
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            pos = 0
+            while (pos + _inotify_event.size <= len(data)):
+                (wd, mask, cookie, namelen) = _inotify_event.unpack_from(data,
+                                                                         pos)
+                pos += _inotify_event.size
+                name = data[pos:pos + namelen].split(b"\0")[0].decode(
+                    "utf8", "replace")
+                pos += namelen
+                devname = None
+                if (name and wd in self.wds):
+                    devname = os.path.join(self.wds[wd], name)
+                    pass
+                elif (not (mask & _IN_Q_OVERFLOW)):
+                    continue
+                ev = self._event(mask, devname)
+                if (ev is not None):
+                    events.append(ev)
+                    pass
+                pass
+            pass
+        return events
+
+    def close(self):
+        os.close(self.fd)
+        return
+
+    pass
+
+# Return a listener for block device events, or None if there is no
+# way to get them.
+def open_listener():
+    try:
+        return NetlinkListener()
+    except OSError:
+        pass
+    try:
+        return InotifyListener()
+    except (OSError, AttributeError):
+        pass
+    return None
+
+# Print events as they come in:
+#   python -m UIpartition.UEvent
+if __name__== '__main__':
+    import select
+    import time
+
+    l = open_listener()
+    if (l is None):
+        print("Unable to listen for device events")
+    else:
+        print("Using %s" % l.__class__.__name__)
+        while True:
+            select.select([ l ], [ ], [ ])
+            for ev in l.read():
+                print("%.3f %s" % (time.time(), str(ev)))
+                pass
+            pass
+        pass
+    pass
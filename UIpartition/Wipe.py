@@ -0,0 +1,193 @@
+#! /usr/bin/python
+#
+#    uipartition - A disk partitions/RAID/LVM setup tool
+#    Copyright (C) 2010-2015  MontaVista Software, LLC
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor,
+#      Boston, MA  02110-1301  USA
+
+
+#
+# Remove the signatures from a device so nothing (blkid, mdadm, the
+# kernel partition code, the mkfs "existing filesystem" checks) finds
+# what used to be there.
+#
+# Only the areas signatures live in are zeroed: the first 64KiB, which
+# has the partition table, the primary GPT, md 1.1/1.2 superblocks, LVM
+# labels, swap headers and filesystem superblocks, and the last 64KiB
+# aligned block to the end of the device, which has md 0.90/1.0
+# superblocks and the backup GPT.  See Superblock.py for where these
+# are.
+#
+# BLKZEROOUT is used so the kernel does the zeroing (with a write
+# zeroes command if the device has one) without us passing any data.
+# If the device doesn't support it, or it's a regular file (an image),
+# zeros are written from one buffer that is reused.
+#
+
+import os
+import errno
+import fcntl
+import struct
+
+from . import Superblock
+
+class WipeErr(Exception):
+    def __init__(self, str):
+        self.s = str
+        return
+
+    def __str__(self):
+        return self.s
+
+    pass
+
+# From <linux/fs.h>, _IO(0x12, 127)
+BLKZEROOUT = 0x127f
+
+# Size of the signature areas at each end of the device, this is the
+# same as what Superblock reads.
+_area_size = 65536
+
+# An md superblock, with its bitmap and bad block log headers, fits in
+# this.
+_md_sb_size = 4096
+
+_zeros = bytes(_area_size)
+
+# Errors that mean BLKZEROOUT can't be used here, so write instead.
+_no_zeroout = (errno.ENOTTY, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOSYS)
+
+def _zero_write(fd, start, length):
+    while (length > 0):
+        n = os.pwrite(fd, _zeros[0:min(length, len(_zeros))], start)
+        start += n
+        length -= n
+        pass
+    return
+
+# Zero the (start, length) byte ranges in an open device.
+def _zero_ranges(fd, ranges):
+    use_ioctl = True
+    for (start, length) in ranges:
+        if (length <= 0):
+            continue
+        if (use_ioctl):
+            try:
+                fcntl.ioctl(fd, BLKZEROOUT, struct.pack("QQ", start, length))
+                continue
+            except OSError as e:
+                if (e.errno not in _no_zeroout):
+                    raise
+                use_ioctl = False
+                pass
+            pass
+        _zero_write(fd, start, length)
+        pass
+    if (not use_ioctl):
+        os.fsync(fd)
+        pass
+    return
+
+# The byte ranges wipe() zeroes on a device of the given size.
+def signature_ranges(size):
+    if (size <= 2 * _area_size):
+        return [ (0, size) ]
+    tailoff = (size & ~(_area_size - 1)) - _area_size
+    return [ (0, _area_size), (tailoff, size - tailoff) ]
+
+def _open(devname):
+    try:
+        fd = os.open(devname, os.O_WRONLY | os.O_CLOEXEC)
+    except OSError as e:
+        raise WipeErr("Unable to open %s: %s" % (devname, e.strerror))
+    try:
+        size = os.lseek(fd, 0, os.SEEK_END)
+    except OSError as e:
+        os.close(fd)
+        raise WipeErr("Unable to get the size of %s: %s"
+                      % (devname, e.strerror))
+    return (fd, size)
+
+# Zero the signature areas at both ends of the device.
+def wipe(devname):
+    (fd, size) = _open(devname)
+    try:
+        _zero_ranges(fd, signature_ranges(size))
+    except OSError as e:
+        raise WipeErr("Unable to wipe %s: %s" % (devname, e.strerror))
+    finally:
+        os.close(fd)
+        pass
+    return
+
+# Zero just the md superblocks on a device, like "mdadm
+# --zero-superblock" does, so it won't get put back into an array.
+# Returns the number of superblocks removed.
+def wipe_md(devname):
+    try:
+        sbs = Superblock.md_superblocks(
+            *Superblock.read_signature_areas(devname))
+    except OSError as e:
+        raise WipeErr("Unable to read %s: %s" % (devname, e.strerror))
+    if (not sbs):
+        return 0
+    (fd, size) = _open(devname)
+    try:
+        _zero_ranges(fd, [ (off, min(_md_sb_size, size - off))
+                           for (off, uuid) in sbs ])
+    except OSError as e:
+        raise WipeErr("Unable to wipe %s: %s" % (devname, e.strerror))
+    finally:
+        os.close(fd)
+        pass
+    return len(sbs)
+
+# Compare against the dd this replaced:
+#   python -m UIpartition.Wipe [-n count] device ...
+# This writes to the devices!
+if __name__== '__main__':
+    import sys
+    import time
+    import subprocess
+
+    count = 100
+    args = sys.argv[1:]
+    if (len(args) >= 2 and args[0] == "-n"):
+        count = int(args[1])
+        args = args[2:]
+        pass
+    if (not args):
+        sys.stderr.write("Usage: %s [-n count] device ...\n" % sys.argv[0])
+        sys.exit(1)
+        pass
+
+    for dev in args:
+        start = time.time()
+        for i in range(0, count):
+            wipe(dev)
+            pass
+        t1 = (time.time() - start) / count
+        start = time.time()
+        for i in range(0, count):
+            subprocess.run(("dd", "if=/dev/zero", "of=" + dev, "count=100",
+                            "conv=notrunc"),
+                           stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL)
+            pass
+        t2 = (time.time() - start) / count
+        print("%s: wipe %.3fms, dd %.3fms" % (dev, t1 * 1000, t2 * 1000))
+        pass
+    pass